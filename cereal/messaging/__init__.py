@@ -143,6 +143,7 @@ class SubMaster:
     self.rcv_frame = {s: 0 for s in services}
     self.alive = {s: False for s in services}
     self.recv_dts = {s: deque([0.0] * AVG_FREQ_HISTORY, maxlen=AVG_FREQ_HISTORY) for s in services}
+    self.recv_dts_sum = {s: 0. for s in services}
     self.sock = {}
     self.freq = {}
     self.data = {}
@@ -156,12 +157,31 @@ class SubMaster:
     self.ignore_average_freq = [] if ignore_avg_freq is None else ignore_avg_freq
     self.ignore_alive = [] if ignore_alive is None else ignore_alive
 
+    # liveness is tracked incrementally: a service can only become alive when it is received,
+    # so only received services and the ones still alive need to be checked every frame
+    self.max_rcv_dt = {}
+    self.max_recv_dts_sum = {}
+    self.freq_ok = {}
+    self.track_avg_freq = {}
+    self.updated_services: List[str] = []
+
     for s in services:
       if addr is not None:
         p = self.poller if s not in self.non_polled_services else None
         self.sock[s] = sub_sock(s, poller=p, addr=addr, conflate=True)
       self.freq[s] = service_list[s].frequency
 
+      # arbitrary small number to avoid float comparison. If freq is 0, we can skip the check
+      if self.freq[s] > 1e-5:
+        # alive if delay is within 10x the expected frequency
+        self.max_rcv_dt[s] = 10. / self.freq[s]
+        # alive if average frequency is higher than 90% of expected frequency
+        self.max_recv_dts_sum[s] = AVG_FREQ_HISTORY / (self.freq[s] * 0.90)
+        self.freq_ok[s] = True
+        self.track_avg_freq[s] = (s not in self.non_polled_services) and (s not in self.ignore_average_freq)
+      elif not SIMULATION:
+        self.alive[s] = True
+
       try:
         data = new_message(s)
       except capnp.lib.capnp.KjException:  # pylint: disable=c-extension-no-member
@@ -171,6 +191,8 @@ class SubMaster:
       self.logMonoTime[s] = 0
       self.valid[s] = data.valid
 
+    self.alive_candidates = set(self.max_rcv_dt)
+
   def __getitem__(self, s: str) -> capnp.lib.capnp._DynamicStructReader:
     return self.data[s]
 
@@ -186,17 +208,27 @@ class SubMaster:
 
   def update_msgs(self, cur_time: float, msgs: List[capnp.lib.capnp._DynamicStructReader]) -> None:
     self.frame += 1
-    self.updated = dict.fromkeys(self.updated, False)
+    for s in self.updated_services:
+      self.updated[s] = False
+    self.updated_services = []
+
     for msg in msgs:
       if msg is None:
         continue
 
       s = msg.which()
       self.updated[s] = True
-
-      if self.rcv_time[s] > 1e-5 and self.freq[s] > 1e-5 and (s not in self.non_polled_services) \
-        and (s not in self.ignore_average_freq):
-        self.recv_dts[s].append(cur_time - self.rcv_time[s])
+      self.updated_services.append(s)
+
+      if s in self.max_rcv_dt:
+        if self.rcv_time[s] > 1e-5 and self.track_avg_freq[s]:
+          # keep a running sum of the dts instead of summing the whole history every frame
+          recv_dts = self.recv_dts[s]
+          dt = cur_time - self.rcv_time[s]
+          self.recv_dts_sum[s] += dt - recv_dts[0]
+          recv_dts.append(dt)
+          self.freq_ok[s] = self.recv_dts_sum[s] < self.max_recv_dts_sum[s]
+        self.alive_candidates.add(s)
 
       self.rcv_time[s] = cur_time
       self.rcv_frame[s] = self.frame
@@ -208,18 +240,13 @@ class SubMaster:
         self.alive[s] = True
 
     if not SIMULATION:
-      for s in self.data:
-        # arbitrary small number to avoid float comparison. If freq is 0, we can skip the check
-        if self.freq[s] > 1e-5:
-          # alive if delay is within 10x the expected frequency
-          self.alive[s] = (cur_time - self.rcv_time[s]) < (10. / self.freq[s])
-
-          # alive if average frequency is higher than 90% of expected frequency
-          avg_dt = sum(self.recv_dts[s]) / AVG_FREQ_HISTORY
-          expected_dt = 1 / (self.freq[s] * 0.90)
-          self.alive[s] = self.alive[s] and (avg_dt < expected_dt)
-        else:
-          self.alive[s] = True
+      dead = []
+      for s in self.alive_candidates:
+        self.alive[s] = (cur_time - self.rcv_time[s]) < self.max_rcv_dt[s] and self.freq_ok[s]
+        if not self.alive[s]:
+          dead.append(s)
+      # a service that is not alive stays that way until it is received again
+      self.alive_candidates.difference_update(dead)
 
   def all_alive(self, service_list=None) -> bool:
     if service_list is None:  # check all
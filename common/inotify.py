@@ -0,0 +1,84 @@
+import ctypes
+import ctypes.util
+import os
+import select
+import struct
+
+IN_MODIFY = 0x2
+IN_CLOSE_WRITE = 0x8
+IN_MOVED_FROM = 0x40
+IN_MOVED_TO = 0x80
+IN_CREATE = 0x100
+IN_DELETE = 0x200
+IN_DELETE_SELF = 0x400
+IN_MOVE_SELF = 0x800
+IN_Q_OVERFLOW = 0x4000
+IN_IGNORED = 0x8000
+IN_ONLYDIR = 0x1000000
+
+IN_NONBLOCK = os.O_NONBLOCK
+IN_CLOEXEC = os.O_CLOEXEC
+
+EVENT_HEADER = struct.Struct("iIII")
+
+
+def _load_libc():
+  try:
+    libc = ctypes.CDLL(ctypes.util.find_library("c"), use_errno=True)
+    libc.inotify_init1  # pylint: disable=pointless-statement
+  except (OSError, AttributeError):
+    return None
+  return libc
+
+_libc = _load_libc()
+
+
+def available():
+  return _libc is not None
+
+
+class Inotify:
+  """Minimal wrapper around the linux inotify API, reads (name, mask) events of watched directories."""
+  def __init__(self):
+    if _libc is None:
+      raise OSError("inotify is not available")
+
+    self.fd = _libc.inotify_init1(IN_NONBLOCK | IN_CLOEXEC)
+    if self.fd < 0:
+      err = ctypes.get_errno()
+      raise OSError(err, os.strerror(err))
+
+  def add_watch(self, path, mask):
+    wd = _libc.inotify_add_watch(self.fd, os.fsencode(path), mask)
+    if wd < 0:
+      err = ctypes.get_errno()
+      raise OSError(err, os.strerror(err), path)
+    return wd
+
+  def rm_watch(self, wd):
+    _libc.inotify_rm_watch(self.fd, wd)
+
+  def read(self, timeout=None):
+    """Waits up to timeout seconds for events, returns a list of (wd, mask, name) tuples"""
+    if not select.select([self.fd], [], [], timeout)[0]:
+      return []
+
+    try:
+      buf = os.read(self.fd, 64 * 1024)
+    except BlockingIOError:
+      return []
+
+    events = []
+    i = 0
+    while i < len(buf):
+      wd, mask, _, length = EVENT_HEADER.unpack_from(buf, i)
+      i += EVENT_HEADER.size
+      name = buf[i:i + length].rstrip(b"\0").decode()
+      i += length
+      events.append((wd, mask, name))
+    return events
+
+  def close(self):
+    if self.fd >= 0:
+      os.close(self.fd)
+      self.fd = -1
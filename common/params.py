@@ -1,9 +1,144 @@
+import threading
+from collections import defaultdict
+
+from common import inotify
 from common.params_pyx import Params, ParamKeyType, UnknownKeyName, put_nonblocking # pylint: disable=no-name-in-module, import-error
+from selfdrive.swaglog import cloudlog
 assert Params
 assert ParamKeyType
 assert UnknownKeyName
 assert put_nonblocking
 
+PARAM_CHANGE_EVENTS = inotify.IN_MOVED_TO | inotify.IN_MOVED_FROM | inotify.IN_CLOSE_WRITE | inotify.IN_DELETE | \
+                      inotify.IN_DELETE_SELF | inotify.IN_MOVE_SELF | inotify.IN_ONLYDIR
+
+_MISSING = object()
+
+
+def _key_name(key):
+  return key.decode() if isinstance(key, bytes) else key
+
+
+class CachedParams:
+  """Process-local cache on top of Params for reads in hot loops.
+
+  Values are read from disk once and then served from memory. A thread watches the params
+  directory with inotify, drops values from the cache as they change and calls the callbacks
+  subscribed to the changed keys. Without inotify, or once the directory can't be watched
+  anymore, every read goes to Params.
+  """
+  def __init__(self, d=""):
+    self.params = Params(d)
+    self._cache = {}
+    self._generation = defaultdict(int)
+    self._callbacks = defaultdict(list)
+    self._lock = threading.Lock()
+    self._exit_event = threading.Event()
+
+    self._inotify = None
+    self._thread = None
+    if inotify.available():
+      self._inotify = inotify.Inotify()
+      self._inotify.add_watch(self.params.get_param_path(), PARAM_CHANGE_EVENTS)
+      self._thread = threading.Thread(target=self._watch, daemon=True)
+      self._thread.start()
+
+  def close(self):
+    if self._thread is not None:
+      self._exit_event.set()
+      self._thread.join()
+      self._thread = None
+
+  def _invalidate(self, key=None):
+    with self._lock:
+      if key is None:
+        self._cache.clear()
+        for k in self._generation:
+          self._generation[k] += 1
+      else:
+        self._cache.pop(key, None)
+        self._generation[key] += 1
+
+  def _watch(self):
+    try:
+      while not self._exit_event.is_set() and self._read_events():
+        pass
+    finally:
+      notifier, self._inotify = self._inotify, None
+      notifier.close()
+      self._invalidate()
+
+  def _read_events(self):
+    """Handles one batch of events, returns False once the params directory can't be watched anymore"""
+    changed = set()
+    for _, mask, name in self._inotify.read(timeout=0.5):
+      if mask & (inotify.IN_IGNORED | inotify.IN_DELETE_SELF | inotify.IN_MOVE_SELF):
+        # the watch is gone with the directory, watch whatever is at the params path now
+        try:
+          self._inotify.add_watch(self.params.get_param_path(), PARAM_CHANGE_EVENTS)
+        except OSError:
+          return False
+      if mask & (inotify.IN_Q_OVERFLOW | inotify.IN_IGNORED | inotify.IN_DELETE_SELF | inotify.IN_MOVE_SELF):
+        # events were lost or the directory was replaced, nothing in the cache can be trusted
+        self._invalidate()
+        changed.update(self._callbacks)
+      elif name:
+        self._invalidate(name)
+        changed.add(name)
+
+    for key in changed:
+      callbacks = self._callbacks.get(key, [])
+      if callbacks:
+        value = self.get(key)
+        for callback in list(callbacks):
+          try:
+            callback(key, value)
+          except Exception:
+            # don't let a broken subscriber stop the watcher, the cache would go stale
+            cloudlog.exception(f"CachedParams callback for {key} failed")
+    return True
+
+  def subscribe(self, key, callback):
+    """Calls callback(key, value) from the watcher thread every time the param changes. Exceptions are logged."""
+    self.params.check_key(key)
+    self._callbacks[_key_name(key)].append(callback)
+
+  def unsubscribe(self, key, callback):
+    self._callbacks[_key_name(key)].remove(callback)
+
+  def get(self, key, block=False, encoding=None):
+    key = _key_name(key)
+    if block or self._inotify is None:
+      return self.params.get(key, block=block, encoding=encoding)
+
+    val = self._cache.get(key, _MISSING)
+    if val is _MISSING:
+      with self._lock:
+        generation = self._generation[key]
+      val = self.params.get(key)
+      with self._lock:
+        # a change while reading leaves the value uncached, the next read gets the new one
+        if self._generation[key] == generation:
+          self._cache[key] = val
+
+    return val if (val is None or encoding is None) else val.decode(encoding)
+
+  def get_bool(self, key):
+    return self.get(key) == b"1"
+
+  def put(self, key, dat):
+    self.params.put(key, dat)
+    self._invalidate(_key_name(key))
+
+  def put_bool(self, key, val):
+    self.params.put_bool(key, val)
+    self._invalidate(_key_name(key))
+
+  def delete(self, key):
+    self.params.delete(key)
+    self._invalidate(_key_name(key))
+
+
 if __name__ == "__main__":
   import sys
 
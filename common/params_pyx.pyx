@@ -20,6 +20,7 @@ cdef extern from "selfdrive/common/params.h":
     int put(string, string) nogil
     int putBool(string, bool) nogil
     bool checkKey(string) nogil
+    string getParamPath(string) nogil
     void clearAll(ParamKeyType)
 
 
@@ -49,6 +50,11 @@ cdef class Params:
       raise UnknownKeyName(key)
     return key
 
+  def get_param_path(self, key=""):
+    """Returns the path of the file holding a param, or of the directory of all params without a key"""
+    cdef string k = ensure_bytes(key)
+    return self.p.getParamPath(k).decode()
+
   def get(self, key, bool block=False, encoding=None):
     cdef string k = self.check_key(key)
     cdef string val
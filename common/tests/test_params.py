@@ -0,0 +1,140 @@
+import os
+import queue
+import shutil
+import tempfile
+import time
+import unittest
+from unittest import mock
+
+from common import inotify
+from common.params import CachedParams, Params
+
+
+def wait_for(condition, timeout=2.):
+  end = time.monotonic() + timeout
+  while not condition():
+    if time.monotonic() > end:
+      return False
+    time.sleep(0.01)
+  return True
+
+
+class FakeInotify:
+  """Returns the queued events once, for events the kernel can't be made to send"""
+  def __init__(self, events):
+    self.events = events
+
+  def read(self, timeout=None):
+    events, self.events = self.events, []
+    return events
+
+  def add_watch(self, path, mask):
+    return 1
+
+  def close(self):
+    pass
+
+
+class TestCachedParams(unittest.TestCase):
+  def setUp(self):
+    self.tmpdir = tempfile.mkdtemp()
+    self.addCleanup(shutil.rmtree, self.tmpdir)
+    self.params = Params(self.tmpdir)
+
+  def _cached(self):
+    cp = CachedParams(self.tmpdir)
+    self.addCleanup(cp.close)
+    return cp
+
+  def _remove_params_dir(self):
+    d = os.path.join(self.tmpdir, "d")
+    shutil.rmtree(os.path.realpath(d))
+    os.unlink(d)
+
+  def _replace_params_dir(self):
+    # like ensure_params_path, a new directory is symlinked and moved over <params>/d, then the old one is removed
+    old_dir = os.path.realpath(os.path.join(self.tmpdir, "d"))
+    new_dir = tempfile.mkdtemp(dir=self.tmpdir, prefix=".tmp_")
+    os.symlink(new_dir, new_dir + ".link")
+    os.rename(new_dir + ".link", os.path.join(self.tmpdir, "d"))
+    shutil.rmtree(old_dir)
+
+  @unittest.skipIf(not inotify.available(), "needs inotify")
+  def test_external_changes(self):
+    cp = self._cached()
+    self.assertIsNone(cp.get("DongleId"))
+
+    self.params.put("DongleId", "cb38263377b873ee")
+    self.assertTrue(wait_for(lambda: cp.get("DongleId") == b"cb38263377b873ee"))
+    self.assertEqual(cp.get("DongleId", encoding="utf8"), "cb38263377b873ee")
+
+    self.params.delete("DongleId")
+    self.assertTrue(wait_for(lambda: cp.get("DongleId") is None))
+
+  @unittest.skipIf(not inotify.available(), "needs inotify")
+  def test_subscribe(self):
+    cp = self._cached()
+    q = queue.Queue()
+
+    def broken(key, value):
+      raise ValueError(value)
+
+    with mock.patch("common.params.cloudlog") as cloudlog:
+      cp.subscribe("IsMetric", broken)
+      cp.subscribe("IsMetric", lambda key, value: q.put((key, value)))
+
+      self.params.put_bool("IsMetric", True)
+      self.assertEqual(q.get(timeout=2), ("IsMetric", b"1"))
+      self.assertTrue(cloudlog.exception.called)
+
+      # the watcher survived the broken callback
+      cp.unsubscribe("IsMetric", broken)
+      self.params.put_bool("IsMetric", False)
+      self.assertEqual(q.get(timeout=2), ("IsMetric", b"0"))
+      self.assertTrue(cp.get_bool("IsMetric") is False)
+
+  def test_queue_overflow(self):
+    with mock.patch.object(inotify, "available", return_value=False):
+      cp = self._cached()
+    cp._inotify = FakeInotify([])
+    values = []
+    cp.subscribe("IsMetric", lambda key, value: values.append(value))
+
+    self.params.put_bool("IsMetric", True)
+    self.assertTrue(cp.get_bool("IsMetric"))
+    self.params.put_bool("IsMetric", False)
+    self.assertTrue(cp.get_bool("IsMetric"))  # cached, the event was lost
+
+    cp._inotify = FakeInotify([(-1, inotify.IN_Q_OVERFLOW, "")])
+    self.assertTrue(cp._read_events())
+    self.assertFalse(cp.get_bool("IsMetric"))
+    self.assertEqual(values, [b"0"])
+
+  @unittest.skipIf(not inotify.available(), "needs inotify")
+  def test_replaced_params_dir(self):
+    self.params.put("DongleId", "cb38263377b873ee")
+    cp = self._cached()
+    self.assertEqual(cp.get("DongleId"), b"cb38263377b873ee")
+
+    self._replace_params_dir()
+    self.assertTrue(wait_for(lambda: cp.get("DongleId") is None))
+
+    # the new directory is watched
+    self.params.put("DongleId", "0123456789abcdef")
+    self.assertTrue(wait_for(lambda: cp.get("DongleId") == b"0123456789abcdef"))
+    self.assertIsNotNone(cp._inotify)
+
+  @unittest.skipIf(not inotify.available(), "needs inotify")
+  def test_params_dir_removed(self):
+    cp = self._cached()
+    self.assertIsNone(cp.get("DongleId"))
+    self._remove_params_dir()
+
+    # without a directory to watch every read goes to Params
+    self.assertTrue(wait_for(lambda: cp._inotify is None))
+    Params(self.tmpdir).put("DongleId", "cb38263377b873ee")
+    self.assertEqual(cp.get("DongleId"), b"cb38263377b873ee")
+
+
+if __name__ == "__main__":
+  unittest.main()
@@ -18,6 +18,7 @@
 //#define DEBUG printf
 
 #define MAX_BAD_COUNTER 5
+#define CAN_INVALID_CNT 5
 
 // Car specific functions
 unsigned int honda_checksum(uint32_t address, const std::vector<uint8_t> &d);
@@ -60,6 +61,7 @@ private:
 
 public:
   bool can_valid = false;
+  int can_invalid_cnt = CAN_INVALID_CNT;
   uint64_t last_sec = 0;
 
   CANParser(int abus, const std::string& dbc_name,
@@ -68,11 +70,13 @@ public:
   CANParser(int abus, const std::string& dbc_name, bool ignore_checksum, bool ignore_counter);
   #ifndef DYNAMIC_CAPNP
   void update_string(const std::string &data, bool sendcan);
+  void update_strings(const std::vector<std::string> &data, std::vector<SignalValue> &vals, bool sendcan);
   void UpdateCans(uint64_t sec, const capnp::List<cereal::CanData>::Reader& cans);
   #endif
   void UpdateCans(uint64_t sec, const capnp::DynamicStruct::Reader& cans);
   void UpdateValid(uint64_t sec);
-  std::vector<SignalValue> query_latest();
+  void query_latest(std::vector<SignalValue> &vals, uint64_t last_ts = 0);
+  MessageState *get_message_state(uint32_t address);
 };
 
 class CANPacker {
@@ -71,12 +71,21 @@ cdef extern from "common_dbc.h":
 
 cdef extern from "common.h":
   cdef const DBC* dbc_lookup(const string);
+  cdef int CAN_INVALID_CNT
+
+  cdef cppclass MessageState:
+    uint32_t address
+    vector[Signal] parse_sigs
+    vector[double] vals
 
   cdef cppclass CANParser:
     bool can_valid
+    int can_invalid_cnt
     CANParser(int, string, vector[MessageParseOptions], vector[SignalParseOptions])
     void update_string(string, bool)
-    vector[SignalValue] query_latest()
+    void update_strings(vector[string]&, vector[SignalValue]&, bool)
+    void query_latest(vector[SignalValue]&, uint64_t)
+    MessageState *get_message_state(uint32_t)
 
   cdef cppclass CANPacker:
    CANPacker(string)
@@ -1,9 +1,16 @@
 #!/usr/bin/env python3
+import io
 import re
 import os
 import sys
+import mmap
+import struct
+import hashlib
 import numbers
 from collections import namedtuple, defaultdict
+from collections.abc import Mapping
+
+import numpy as np
 
 def int_or_float(s):
   # return number, trying to maintain int format
@@ -13,116 +20,313 @@ def int_or_float(s):
     return float(s)
 
 
+# next to the tools' cache, a shared tmp directory would let other users plant compiled DBCs
+DBC_CACHE_DIR = os.getenv("DBC_CACHE_DIR", os.path.join(os.path.expanduser("~/.commacache"), "dbc"))
+DBC_CACHE_MAGIC = b"OPDBCBIN"
+DBC_CACHE_VERSION = 1
+
+# magic, version, number of messages, signals and value definitions, size of the string table
+DBC_CACHE_HEADER = struct.Struct("<8sIIIII")
+
+
+def _string_field(name):
+  # strings are stored as an offset and length into the string table
+  return [(name, "<u4"), (f"{name}_len", "<u4")]
+
+
+DBC_MSG_DTYPE = np.dtype([("address", "<u4"), ("size", "<u4"), *_string_field("name"), ("sig_start", "<u4"), ("num_sigs", "<u4")])
+# numbers are stored as text, so integers too large for a double and float formatting survive a round trip
+DBC_SIG_DTYPE = np.dtype([*_string_field("name"), ("start_bit", "<u2"), ("msb", "<u2"), ("lsb", "<u2"), ("size", "<u2"),
+                          ("is_little_endian", "u1"), ("is_signed", "u1"), *_string_field("factor"), *_string_field("offset"),
+                          *_string_field("tmin"), *_string_field("tmax"), *_string_field("units")])
+DBC_VAL_DTYPE = np.dtype([("address", "<u4"), *_string_field("name"), *_string_field("def_val")])
+DBC_CACHE_TABLES = (DBC_MSG_DTYPE, DBC_SIG_DTYPE, DBC_VAL_DTYPE)
+
 DBCSignal = namedtuple("DBCSignal", ["name", "start_bit", "msb", "lsb", "size", "is_little_endian", "is_signed",
                                      "factor", "offset", "tmin", "tmax", "units"])
 
 
+def parse_dbc(name, lines):
+  # regexps from https://github.com/ebroecker/canmatrix/blob/master/canmatrix/importdbc.py
+  bo_regexp = re.compile(r"^BO\_ (\w+) (\w+) *: (\w+) (\w+)")
+  sg_regexp = re.compile(r"^SG\_ (\w+) : (\d+)\|(\d+)@(\d+)([\+|\-]) \(([0-9.+\-eE]+),([0-9.+\-eE]+)\) \[([0-9.+\-eE]+)\|([0-9.+\-eE]+)\] \"(.*)\" (.*)")
+  sgm_regexp = re.compile(r"^SG\_ (\w+) (\w+) *: (\d+)\|(\d+)@(\d+)([\+|\-]) \(([0-9.+\-eE]+),([0-9.+\-eE]+)\) \[([0-9.+\-eE]+)\|([0-9.+\-eE]+)\] \"(.*)\" (.*)")
+  val_regexp = re.compile(r"VAL\_ (\w+) (\w+) (\s*[-+]?[0-9]+\s+\".+?\"[^;]*)")
+
+  # A dictionary which maps message ids to tuples ((name, size), signals).
+  #   name is the ASCII name of the message.
+  #   size is the size of the message in bytes.
+  #   signals is a list signals contained in the message.
+  # signals is a list of DBCSignal in order of increasing start_bit.
+  msgs = {}
+
+  # A dictionary which maps message ids to a list of tuples (signal name, definition value pairs)
+  def_vals = defaultdict(list)
+
+  # used to find big endian LSB from MSB and size
+  be_bits = [(j + i*8) for i in range(64) for j in range(7, -1, -1)]
+
+  for l in lines:
+    l = l.strip()
+
+    if l.startswith("BO_ "):
+      # new group
+      dat = bo_regexp.match(l)
+
+      if dat is None:
+        print("bad BO {0}".format(l))
+
+      msg_name = dat.group(2)
+      size = int(dat.group(3))
+      ids = int(dat.group(1), 0)  # could be hex
+      if ids in msgs:
+        sys.exit("Duplicate address detected %d %s" % (ids, name))
+
+      msgs[ids] = ((msg_name, size), [])
+
+    if l.startswith("SG_ "):
+      # new signal
+      dat = sg_regexp.match(l)
+      go = 0
+      if dat is None:
+        dat = sgm_regexp.match(l)
+        go = 1
+
+      if dat is None:
+        print("bad SG {0}".format(l))
+
+      sgname = dat.group(1)
+      start_bit = int(dat.group(go + 2))
+      signal_size = int(dat.group(go + 3))
+      is_little_endian = int(dat.group(go + 4)) == 1
+      is_signed = dat.group(go + 5) == '-'
+      factor = int_or_float(dat.group(go + 6))
+      offset = int_or_float(dat.group(go + 7))
+      tmin = int_or_float(dat.group(go + 8))
+      tmax = int_or_float(dat.group(go + 9))
+      units = dat.group(go + 10)
+
+      if is_little_endian:
+        lsb = start_bit
+        msb = start_bit + signal_size - 1
+      else:
+        lsb = be_bits[be_bits.index(start_bit) + signal_size - 1]
+        msb = start_bit
+
+      msgs[ids][1].append(
+        DBCSignal(sgname, start_bit, msb, lsb, signal_size, is_little_endian,
+                  is_signed, factor, offset, tmin, tmax, units))
+
+      assert lsb < (64*8) and msb < (64*8), f"Signal out of bounds: {msb=} {lsb=}"
+
+    if l.startswith("VAL_ "):
+      # new signal value/definition
+      dat = val_regexp.match(l)
+
+      if dat is None:
+        print("bad VAL {0}".format(l))
+
+      ids = int(dat.group(1), 0)  # could be hex
+      sgname = dat.group(2)
+      defvals = dat.group(3)
+
+      defvals = defvals.replace("?", r"\?")  # escape sequence in C++
+      defvals = defvals.split('"')[:-1]
+
+      # convert strings to UPPER_CASE_WITH_UNDERSCORES
+      defvals[1::2] = [d.strip().upper().replace(" ", "_") for d in defvals[1::2]]
+      defvals = '"' + "".join(str(i) for i in defvals) + '"'
+
+      def_vals[ids].append((sgname, defvals))
+
+  for msg in msgs.values():
+    msg[1].sort(key=lambda x: x.start_bit)
+
+
+  return msgs, def_vals
+
+
+def compile_dbc(msgs, def_vals):
+  """Packs parsed messages and value definitions into the tables of the binary DBC format."""
+  strings = bytearray()
+  string_offsets = {}
+
+  def add_string(st):
+    if st not in string_offsets:
+      dat = st.encode("ascii")
+      string_offsets[st] = (len(strings), len(dat))
+      strings.extend(dat)
+    return string_offsets[st]
+
+  msg_rows, sig_rows, val_rows = [], [], []
+  for address, ((msg_name, size), sigs) in msgs.items():
+    msg_rows.append((address, size, *add_string(msg_name), len(sig_rows), len(sigs)))
+    for sig in sigs:
+      nums = [x for v in (sig.factor, sig.offset, sig.tmin, sig.tmax) for x in add_string(repr(v))]
+      sig_rows.append((*add_string(sig.name), sig.start_bit, sig.msb, sig.lsb, sig.size, sig.is_little_endian, sig.is_signed,
+                       *nums, *add_string(sig.units)))
+
+  for address, vals in def_vals.items():
+    for sgname, defvals in vals:
+      val_rows.append((address, *add_string(sgname), *add_string(defvals)))
+
+  msg_table = np.array(msg_rows, dtype=DBC_MSG_DTYPE)
+  sig_table = np.array(sig_rows, dtype=DBC_SIG_DTYPE)
+  val_table = np.array(val_rows, dtype=DBC_VAL_DTYPE)
+  return (msg_table, sig_table, val_table), bytes(strings)
+
+
+def dbc_cache_path(name, dat):
+  """Cache file of a DBC, keyed on its contents so edited DBCs are compiled again."""
+  digest = hashlib.sha256(dat).hexdigest()[:16]
+  return os.path.join(DBC_CACHE_DIR, f"{name}_v{DBC_CACHE_VERSION}_{digest}.bin")
+
+
+def write_dbc_cache(fn, tables, strings):
+  os.makedirs(os.path.dirname(fn), exist_ok=True)
+  tmp_fn = f"{fn}.{os.getpid()}.tmp"
+  with open(tmp_fn, "wb") as f:
+    f.write(DBC_CACHE_HEADER.pack(DBC_CACHE_MAGIC, DBC_CACHE_VERSION, *(len(t) for t in tables), len(strings)))
+    for t in tables:
+      f.write(t.tobytes())
+    f.write(strings)
+  os.replace(tmp_fn, fn)
+
+
+def read_dbc_cache(fn):
+  """Maps a compiled DBC into memory. Returns None if it is missing or from another version."""
+  try:
+    with open(fn, "rb") as f:
+      buf = mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ)
+  except (FileNotFoundError, ValueError):
+    return None
+
+  if len(buf) < DBC_CACHE_HEADER.size:
+    return None
+  magic, version, *counts, strings_len = DBC_CACHE_HEADER.unpack_from(buf)
+  if magic != DBC_CACHE_MAGIC or version != DBC_CACHE_VERSION:
+    return None
+
+  tables = []
+  offset = DBC_CACHE_HEADER.size
+  for dtype, count in zip(DBC_CACHE_TABLES, counts):
+    tables.append(np.frombuffer(buf, dtype=dtype, count=count, offset=offset))
+    offset += dtype.itemsize * count
+  if offset + strings_len != len(buf):
+    return None
+  return tables, memoryview(buf)[offset:]
+
+
+class DBCMessages(Mapping):
+  """Maps message ids to ((name, size), signals) like a dict, decoding
+  each message's signals from the compiled tables on first access."""
+  def __init__(self, tables, strings):
+    msgs, self._sigs, _ = tables
+    self._strings = bytes(strings).decode("ascii")
+    self._msgs = {m[0]: m for m in msgs.tolist()}
+    self._decoded = {}
+
+  def get_string(self, off, length):
+    return self._strings[off:off + length]
+
+  def name(self, address):
+    return self.get_string(*self._msgs[address][2:4])
+
+  def __getitem__(self, address):
+    if address not in self._decoded:
+      _, size, name, name_len, sig_start, num_sigs = self._msgs[address]
+      st = self._strings
+      sigs = []
+      for s in self._sigs[sig_start:sig_start + num_sigs].tolist():
+        sigs.append(DBCSignal(st[s[0]:s[0] + s[1]], *s[2:6], bool(s[6]), bool(s[7]),
+                              *[int_or_float(st[s[i]:s[i] + s[i + 1]]) for i in range(8, 16, 2)], st[s[16]:s[16] + s[17]]))
+      self._decoded[address] = ((self.get_string(name, name_len), size), sigs)
+    return self._decoded[address]
+
+  def __iter__(self):
+    return iter(self._msgs)
+
+  def __len__(self):
+    return len(self._msgs)
+
+
+def get_checksum_state(dbc_name):
+  """Returns the checksum type and the expected layout of the CHECKSUM and COUNTER signals of a DBC:
+  (checksum_type, checksum_size, counter_size, checksum_start_bit, counter_start_bit, little_endian)"""
+  if dbc_name.startswith(("honda_", "acura_")):
+    checksum_type = "honda"
+    checksum_size = 4
+    counter_size = 2
+    checksum_start_bit = 3
+    counter_start_bit = 5
+    little_endian = False
+  elif dbc_name.startswith(("toyota_", "lexus_")):
+    checksum_type = "toyota"
+    checksum_size = 8
+    counter_size = None
+    checksum_start_bit = 7
+    counter_start_bit = None
+    little_endian = False
+  elif dbc_name.startswith(("vw_", "volkswagen_", "audi_", "seat_", "skoda_")):
+    checksum_type = "volkswagen"
+    checksum_size = 8
+    counter_size = 4
+    checksum_start_bit = 0
+    counter_start_bit = 0
+    little_endian = True
+  elif dbc_name.startswith(("subaru_global_")):
+    checksum_type = "subaru"
+    checksum_size = 8
+    counter_size = None
+    checksum_start_bit = 0
+    counter_start_bit = None
+    little_endian = True
+  elif dbc_name.startswith(("chrysler_", "stellantis_")):
+    checksum_type = "chrysler"
+    checksum_size = 8
+    counter_size = None
+    checksum_start_bit = 7
+    counter_start_bit = None
+    little_endian = False
+  else:
+    checksum_type = None
+    checksum_size = None
+    counter_size = None
+    checksum_start_bit = None
+    counter_start_bit = None
+    little_endian = None
+
+  return checksum_type, checksum_size, counter_size, checksum_start_bit, counter_start_bit, little_endian
+
+
 class dbc():
-  def __init__(self, fn):
+  def __init__(self, fn, use_cache=True):
     self.name, _ = os.path.splitext(os.path.basename(fn))
-    with open(fn, encoding="ascii") as f:
-      self.txt = f.readlines()
+    with open(fn, "rb") as f:
+      dat = f.read()
+    self.txt = io.StringIO(dat.decode("ascii"), newline=None).readlines()
     self._warned_addresses = set()
 
-    # regexps from https://github.com/ebroecker/canmatrix/blob/master/canmatrix/importdbc.py
-    bo_regexp = re.compile(r"^BO\_ (\w+) (\w+) *: (\w+) (\w+)")
-    sg_regexp = re.compile(r"^SG\_ (\w+) : (\d+)\|(\d+)@(\d+)([\+|\-]) \(([0-9.+\-eE]+),([0-9.+\-eE]+)\) \[([0-9.+\-eE]+)\|([0-9.+\-eE]+)\] \"(.*)\" (.*)")
-    sgm_regexp = re.compile(r"^SG\_ (\w+) (\w+) *: (\d+)\|(\d+)@(\d+)([\+|\-]) \(([0-9.+\-eE]+),([0-9.+\-eE]+)\) \[([0-9.+\-eE]+)\|([0-9.+\-eE]+)\] \"(.*)\" (.*)")
-    val_regexp = re.compile(r"VAL\_ (\w+) (\w+) (\s*[-+]?[0-9]+\s+\".+?\"[^;]*)")
+    cache_fn = dbc_cache_path(self.name, dat)
+    compiled = read_dbc_cache(cache_fn) if use_cache else None
+    if compiled is None:
+      compiled = compile_dbc(*parse_dbc(self.name, self.txt))
+      if use_cache:
+        try:
+          write_dbc_cache(cache_fn, *compiled)
+        except OSError:
+          pass
+    tables, strings = compiled
 
-    # A dictionary which maps message ids to tuples ((name, size), signals).
-    #   name is the ASCII name of the message.
-    #   size is the size of the message in bytes.
-    #   signals is a list signals contained in the message.
-    # signals is a list of DBCSignal in order of increasing start_bit.
-    self.msgs = {}
+    # A mapping of message ids to tuples ((name, size), signals), see parse_dbc.
+    self.msgs = DBCMessages(tables, strings)
 
     # A dictionary which maps message ids to a list of tuples (signal name, definition value pairs)
     self.def_vals = defaultdict(list)
+    for address, *refs in tables[2].tolist():
+      self.def_vals[address].append((self.msgs.get_string(*refs[:2]), self.msgs.get_string(*refs[2:])))
 
-    # used to find big endian LSB from MSB and size
-    be_bits = [(j + i*8) for i in range(64) for j in range(7, -1, -1)]
-
-    for l in self.txt:
-      l = l.strip()
-
-      if l.startswith("BO_ "):
-        # new group
-        dat = bo_regexp.match(l)
-
-        if dat is None:
-          print("bad BO {0}".format(l))
-
-        name = dat.group(2)
-        size = int(dat.group(3))
-        ids = int(dat.group(1), 0)  # could be hex
-        if ids in self.msgs:
-          sys.exit("Duplicate address detected %d %s" % (ids, self.name))
-
-        self.msgs[ids] = ((name, size), [])
-
-      if l.startswith("SG_ "):
-        # new signal
-        dat = sg_regexp.match(l)
-        go = 0
-        if dat is None:
-          dat = sgm_regexp.match(l)
-          go = 1
-
-        if dat is None:
-          print("bad SG {0}".format(l))
-
-        sgname = dat.group(1)
-        start_bit = int(dat.group(go + 2))
-        signal_size = int(dat.group(go + 3))
-        is_little_endian = int(dat.group(go + 4)) == 1
-        is_signed = dat.group(go + 5) == '-'
-        factor = int_or_float(dat.group(go + 6))
-        offset = int_or_float(dat.group(go + 7))
-        tmin = int_or_float(dat.group(go + 8))
-        tmax = int_or_float(dat.group(go + 9))
-        units = dat.group(go + 10)
-
-        if is_little_endian:
-          lsb = start_bit
-          msb = start_bit + signal_size - 1
-        else:
-          lsb = be_bits[be_bits.index(start_bit) + signal_size - 1]
-          msb = start_bit
-
-        self.msgs[ids][1].append(
-          DBCSignal(sgname, start_bit, msb, lsb, signal_size, is_little_endian,
-                    is_signed, factor, offset, tmin, tmax, units))
-
-        assert lsb < (64*8) and msb < (64*8), f"Signal out of bounds: {msb=} {lsb=}"
-
-      if l.startswith("VAL_ "):
-        # new signal value/definition
-        dat = val_regexp.match(l)
-
-        if dat is None:
-          print("bad VAL {0}".format(l))
-
-        ids = int(dat.group(1), 0)  # could be hex
-        sgname = dat.group(2)
-        defvals = dat.group(3)
-
-        defvals = defvals.replace("?", r"\?")  # escape sequence in C++
-        defvals = defvals.split('"')[:-1]
-
-        # convert strings to UPPER_CASE_WITH_UNDERSCORES
-        defvals[1::2] = [d.strip().upper().replace(" ", "_") for d in defvals[1::2]]
-        defvals = '"' + "".join(str(i) for i in defvals) + '"'
-
-        self.def_vals[ids].append((sgname, defvals))
-
-    for msg in self.msgs.values():
-      msg[1].sort(key=lambda x: x.start_bit)
-
-    self.msg_name_to_address = {}
-    for address, m in self.msgs.items():
-      name = m[0][0]
-      self.msg_name_to_address[name] = address
+    self.msg_name_to_address = {self.msgs.name(address): address for address in self.msgs}
 
   def lookup_msg_id(self, msg_id):
     if not isinstance(msg_id, numbers.Number):
@@ -0,0 +1,243 @@
+import os
+from collections import defaultdict
+
+import numpy as np
+
+from opendbc import DBC_PATH
+from opendbc.can.dbc import dbc, get_checksum_state
+
+MAX_BAD_COUNTER = 5
+
+# magic final padding byte of the volkswagen CRC, by address and then message counter (see common.cc)
+VOLKSWAGEN_CRC_MAGIC = {
+  0x86: [0x86] * 16,
+  0x9F: [0xF5] * 16,
+  0xAD: [0x3F, 0x69, 0x39, 0xDC, 0x94, 0xF9, 0x14, 0x64, 0xD8, 0x6A, 0x34, 0xCE, 0xA2, 0x55, 0xB5, 0x2C],
+  0xFD: [0xB4, 0xEF, 0xF8, 0x49, 0x1E, 0xE5, 0xC2, 0xC0, 0x97, 0x19, 0x3C, 0xC9, 0xF1, 0x98, 0xD6, 0x61],
+  0x106: [0x07] * 16,
+  0x117: [0x16] * 16,
+  0x120: [0xC4, 0xE2, 0x4F, 0xE4, 0xF8, 0x2F, 0x56, 0x81, 0x9F, 0xE5, 0x83, 0x44, 0x05, 0x3F, 0x97, 0xDF],
+  0x121: [0xE9, 0x65, 0xAE, 0x6B, 0x7B, 0x35, 0xE5, 0x5F, 0x4E, 0xC7, 0x86, 0xA2, 0xBB, 0xDD, 0xEB, 0xB4],
+  0x122: [0x37, 0x7D, 0xF3, 0xA9, 0x18, 0x46, 0x6D, 0x4D, 0x3D, 0x71, 0x92, 0x9C, 0xE5, 0x32, 0x10, 0xB9],
+  0x126: [0xDA] * 16,
+  0x12B: [0x6A, 0x38, 0xB4, 0x27, 0x22, 0xEF, 0xE1, 0xBB, 0xF8, 0x80, 0x84, 0x49, 0xC7, 0x9E, 0x1E, 0x2B],
+  0x12E: [0xF8, 0xE5, 0x97, 0xC9, 0xD6, 0x07, 0x47, 0x21, 0x66, 0xDD, 0xCF, 0x6F, 0xA1, 0x94, 0x74, 0x63],
+  0x187: [0x7F, 0xED, 0x17, 0xC2, 0x7C, 0xEB, 0x44, 0x21, 0x01, 0xFA, 0xDB, 0x15, 0x4A, 0x6B, 0x23, 0x05],
+  0x30C: [0x0F] * 16,
+  0x30F: [0x0C] * 16,
+  0x324: [0x27] * 16,
+  0x3C0: [0xC3] * 16,
+  0x65D: [0xAC, 0xB3, 0xAB, 0xEB, 0x7A, 0xE1, 0x3B, 0xF7, 0x73, 0xBA, 0x7C, 0x9E, 0x06, 0x5F, 0x02, 0xD9],
+}
+
+
+def crc8_lut(poly):
+  lut = np.zeros(256, dtype=np.uint8)
+  for i in range(256):
+    crc = i
+    for _ in range(8):
+      crc = ((crc << 1) ^ poly) & 0xFF if crc & 0x80 else (crc << 1) & 0xFF
+    lut[i] = crc
+  return lut
+
+CRC8_LUT_8H2F = crc8_lut(0x2F)
+CRC8_LUT_D5 = crc8_lut(0xD5)
+
+
+def address_byte_sum(address):
+  s = 0
+  while address:
+    s += address & 0xFF
+    address >>= 8
+  return s
+
+
+# The checksums below are vectorized versions of the ones in common.cc. dat is
+# a (frames, length) uint8 array of frames of the same address and length.
+def honda_checksum(address, dat):
+  s = sum((address >> i) & 0xF for i in range(0, 32, 4))
+  nibbles = dat.astype(np.int64)
+  nibbles[:, -1] >>= 4  # remove checksum
+  s = s + ((nibbles & 0xF) + (nibbles >> 4)).sum(axis=1)
+  return (8 - s) & 0xF
+
+
+def toyota_checksum(address, dat):
+  return (dat.shape[1] + address_byte_sum(address) + dat[:, :-1].sum(axis=1, dtype=np.int64)) & 0xFF
+
+
+def subaru_checksum(address, dat):
+  return (address_byte_sum(address) + dat[:, 1:].sum(axis=1, dtype=np.int64)) & 0xFF
+
+
+def chrysler_checksum(address, dat):
+  checksum = np.full(len(dat), 0xFF, dtype=np.uint8)
+  for j in range(dat.shape[1] - 1):
+    for i in range(7, -1, -1):
+      bit_set = (dat[:, j] >> i) & 1 == 1
+      high = (checksum & 0x80) != 0
+      shifted = checksum << 1
+      checksum = np.where(bit_set, np.where(high, 1, 0x1C) ^ (shifted | 1), np.where(high, 0x1D, 0) ^ shifted).astype(np.uint8)
+  return ~checksum & 0xFF
+
+
+def volkswagen_checksum(address, dat):
+  crc = np.full(len(dat), 0xFF, dtype=np.uint8)
+  for i in range(1, dat.shape[1]):
+    crc = CRC8_LUT_8H2F[crc ^ dat[:, i]]
+  # undefined messages get no padding, so their CRC check is expected to fail
+  magic = np.array(VOLKSWAGEN_CRC_MAGIC.get(address, [0] * 16), dtype=np.uint8)
+  crc = CRC8_LUT_8H2F[crc ^ magic[dat[:, 1] & 0xF]]
+  return crc ^ 0xFF
+
+
+def pedal_checksum(address, dat):
+  crc = np.full(len(dat), 0xFF, dtype=np.uint8)
+  for i in range(dat.shape[1] - 2, -1, -1):
+    crc = CRC8_LUT_D5[crc ^ dat[:, i]]
+  return crc
+
+CHECKSUMS = {
+  "honda": honda_checksum,
+  "toyota": toyota_checksum,
+  "volkswagen": volkswagen_checksum,
+  "subaru": subaru_checksum,
+  "chrysler": chrysler_checksum,
+  "pedal": pedal_checksum,
+}
+
+
+def get_signal_check(checksum_type, address, sig_name):
+  """Returns the checksum function of a checksum signal, "counter" for a checked counter
+  signal, or None, following the signal types of dbc_template.cc in the same order."""
+  if sig_name == "CHECKSUM" and checksum_type in ("honda", "toyota", "volkswagen", "subaru", "chrysler"):
+    return CHECKSUMS[checksum_type]
+  if sig_name == "COUNTER" and checksum_type in ("honda", "volkswagen"):
+    return "counter"
+  if address in (0x200, 0x201):
+    return {"CHECKSUM_PEDAL": pedal_checksum, "COUNTER_PEDAL": "counter"}.get(sig_name)
+  if address == 0x250:
+    return {"CHECKSUM": pedal_checksum, "COUNTER": "counter"}.get(sig_name)
+  return None
+
+
+def get_raw_values(dat, sig):
+  """Extracts the raw value of a signal from every frame, like get_raw_value in parser.cc."""
+  ret = np.zeros(len(dat), dtype=np.uint64)
+  i = sig.msb // 8
+  bits = sig.size
+  while 0 <= i < dat.shape[1] and bits > 0:
+    lsb = sig.lsb if sig.lsb // 8 == i else i * 8
+    msb = sig.msb if sig.msb // 8 == i else (i + 1) * 8 - 1
+    size = msb - lsb + 1
+
+    d = (dat[:, i] >> (lsb - i * 8)) & ((1 << size) - 1)
+    ret |= d.astype(np.uint64) << np.uint64(bits - size)
+
+    bits -= size
+    i = i - 1 if sig.is_little_endian else i + 1
+
+  if sig.size == 64:
+    return ret.view(np.int64) if sig.is_signed else ret
+
+  ret = ret.view(np.int64)
+  if sig.is_signed:
+    ret = np.where((ret >> (sig.size - 1)) & 1, ret - (1 << sig.size), ret)
+  return ret
+
+
+def counter_valid(counter, cnt_size):
+  """Replays MessageState::update_counter_generic over a sequence of counter values."""
+  expected = (np.concatenate(([0], counter[:-1])) + 1) & ((1 << cnt_size) - 1)
+  bad = counter != expected
+
+  # counter_fail goes up on every bad counter and down to a minimum of zero on every good one,
+  # the running sum reflected at zero is the sum minus its running minimum
+  steps = np.where(bad, 1, -1)
+  s = np.cumsum(steps)
+  counter_fail = s - np.minimum(np.minimum.accumulate(s), 0)
+  return ~(bad & (counter_fail >= MAX_BAD_COUNTER))
+
+
+def frames_to_array(dats, length):
+  if all(len(d) == length for d in dats):
+    buf = b"".join(dats)
+  else:
+    buf = b"".join(bytes(d).ljust(length, b"\x00")[:length] for d in dats)
+  return np.frombuffer(buf, dtype=np.uint8).reshape(len(dats), length)
+
+
+def decode_can(dbc_name, address, t, dat, src, bus=0, msgs=None):
+  """Decodes every frame of a bus at once. address, t, dat and src are the per-frame
+  addresses, times, payloads and source buses, e.g. the columns of can_capnp_to_can_list
+  over a whole segment. msgs optionally limits decoding to the given message names or addresses.
+
+  Returns two dicts keyed by message name. The first maps signal names to (t, values) arrays.
+  The second maps "checksum" and "counter" to (t, valid) arrays for messages that have them,
+  a frame is accepted by CANParser when all of them are valid. Values are decoded from every
+  frame, including the ones that fail their checks."""
+  can_dbc = dbc(dbc_name if os.path.isfile(dbc_name) else os.path.join(DBC_PATH, dbc_name + ".dbc"))
+  checksum_type = get_checksum_state(can_dbc.name)[0]
+
+  address = np.asarray(address, dtype=np.int64)
+  t = np.asarray(t)
+  src = np.asarray(src)
+  on_bus = np.flatnonzero(src == bus)
+
+  if msgs is None:
+    addresses = set(can_dbc.msgs)
+  else:
+    addresses = {can_dbc.lookup_msg_id(m) for m in msgs}
+
+  signals = {}
+  valid = {}
+  for addr in np.unique(address[on_bus]):
+    addr = int(addr)
+    if addr not in addresses:
+      continue
+    (msg_name, _), sigs = can_dbc.msgs[addr]
+    idxs = on_bus[address[on_bus] == addr]
+    msg_dat = [dat[i] for i in idxs]
+    lengths = np.array([len(d) for d in msg_dat])
+    keep = lengths <= 64
+    idxs, lengths = idxs[keep], lengths[keep]
+    msg_dat = [d for d, k in zip(msg_dat, keep) if k]
+    msg_t = t[idxs]
+
+    msg_signals = defaultdict(lambda: np.zeros(len(idxs)))
+    msg_valid = {}
+    counter, counter_size = None, None
+    # checks run in the order of the generated DBC, which puts COUNTER and CHECKSUM first
+    checks = [get_signal_check(checksum_type, addr, sig.name) for sig in sorted(sigs, key=lambda s: s.name not in ("COUNTER", "CHECKSUM"))]
+    checks = [c for c in checks if c is not None]
+    checksum_first = len(checks) > 0 and checks[0] != "counter"
+    # frames of one address almost always share a length, checksums depend on it
+    for length in np.unique(lengths):
+      sel = np.flatnonzero(lengths == length)
+      arr = frames_to_array([msg_dat[i] for i in sel], int(length))
+      for sig in sigs:
+        raw = get_raw_values(arr, sig)
+        msg_signals[sig.name][sel] = raw * sig.factor + sig.offset
+
+        check = get_signal_check(checksum_type, addr, sig.name)
+        if check == "counter":
+          if counter is None:
+            counter, counter_size = np.zeros(len(idxs), dtype=np.int64), sig.size
+          counter[sel] = raw
+        elif check is not None:
+          msg_valid.setdefault("checksum", np.ones(len(idxs), dtype=bool))[sel] = check(addr, arr) == raw
+
+    if counter is not None:
+      # MessageState::parse stops at the first failed check, a frame that fails a checksum
+      # parsed before the counter doesn't advance the counter
+      replayed = np.ones(len(idxs), dtype=bool)
+      if "checksum" in msg_valid and checksum_first:
+        replayed = msg_valid["checksum"]
+      msg_valid["counter"] = np.ones(len(idxs), dtype=bool)
+      msg_valid["counter"][replayed] = counter_valid(counter[replayed], counter_size)
+
+    signals[msg_name] = {name: (msg_t, values) for name, values in msg_signals.items()}
+    if msg_valid:
+      valid[msg_name] = {name: (msg_t, v) for name, v in msg_valid.items()}
+
+  return signals, valid
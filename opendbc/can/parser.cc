@@ -31,6 +31,8 @@ int64_t get_raw_value(const std::vector<uint8_t> &msg, const Signal &sig) {
 
 
 bool MessageState::parse(uint64_t sec, const std::vector<uint8_t> &dat) {
+  // values are only stored once every check passed, vals can be read through the python views
+  std::vector<double> tmp_vals(parse_sigs.size());
 
   for (int i = 0; i < parse_sigs.size(); i++) {
     auto &sig = parse_sigs[i];
@@ -71,8 +73,12 @@ bool MessageState::parse(uint64_t sec, const std::vector<uint8_t> &dat) {
       return false;
     }
 
-    // TODO: these may get updated if the invalid or checksum gets checked later
-    vals[i] = tmp * sig.factor + sig.offset;
+    tmp_vals[i] = tmp * sig.factor + sig.offset;
+  }
+
+  // assign elementwise, so vals.data() stays valid
+  for (int i = 0; i < parse_sigs.size(); i++) {
+    vals[i] = tmp_vals[i];
     all_vals[i].push_back(vals[i]);
   }
   seen = sec;
@@ -210,6 +216,18 @@ void CANParser::update_string(const std::string &data, bool sendcan) {
   UpdateValid(last_sec);
 }
 
+void CANParser::update_strings(const std::vector<std::string> &data, std::vector<SignalValue> &vals, bool sendcan) {
+  if (data.empty()) return;
+
+  // parse the whole batch first, then collect every message seen since its first event
+  update_string(data[0], sendcan);
+  const uint64_t first_sec = last_sec;
+  for (size_t i = 1; i < data.size(); i++) {
+    update_string(data[i], sendcan);
+  }
+  query_latest(vals, first_sec);
+}
+
 void CANParser::UpdateCans(uint64_t sec, const capnp::List<cereal::CanData>::Reader& cans) {
   //DEBUG("got %d messages\n", cans.size());
 
@@ -281,18 +299,17 @@ void CANParser::UpdateValid(uint64_t sec) {
       can_valid = false;
     }
   }
+  can_invalid_cnt = can_valid ? 0 : can_invalid_cnt + 1;
 }
 
-std::vector<SignalValue> CANParser::query_latest() {
-  std::vector<SignalValue> ret;
-
+void CANParser::query_latest(std::vector<SignalValue> &vals, uint64_t last_ts) {
   for (auto& kv : message_states) {
     auto& state = kv.second;
-    if (last_sec != 0 && state.seen != last_sec) continue;
+    if (last_ts != 0 && state.seen < last_ts) continue;
 
     for (int i = 0; i < state.parse_sigs.size(); i++) {
       const Signal &sig = state.parse_sigs[i];
-      ret.push_back((SignalValue){
+      vals.push_back((SignalValue){
         .address = state.address,
         .name = sig.name,
         .value = state.vals[i],
@@ -301,6 +318,9 @@ std::vector<SignalValue> CANParser::query_latest() {
       state.all_vals[i].clear();
     }
   }
+}
 
-  return ret;
+MessageState *CANParser::get_message_state(uint32_t address) {
+  auto state_it = message_states.find(address);
+  return state_it == message_states.end() ? nullptr : &state_it->second;
 }
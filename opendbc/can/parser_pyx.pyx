@@ -9,13 +9,25 @@ from libcpp cimport bool
 from libcpp.map cimport map
 
 from .common cimport CANParser as cpp_CANParser
-from .common cimport SignalParseOptions, MessageParseOptions, dbc_lookup, SignalValue, DBC
+from .common cimport SignalParseOptions, MessageParseOptions, MessageState, dbc_lookup, SignalValue, DBC, CAN_INVALID_CNT
 
 import os
 import numbers
+import numpy as np
 from collections import defaultdict
 
-cdef int CAN_INVALID_CNT = 5
+
+cdef class SignalHandle:
+  """A signal of a CANParser resolved at construction, read with CANParser.get."""
+  cdef const double *ptr
+
+  cdef readonly:
+    object values
+    int slot
+
+  @property
+  def value(self):
+    return self.ptr[0]
 
 
 cdef class CANParser:
@@ -29,15 +41,19 @@ cdef class CANParser:
   cdef readonly:
     dict vl
     dict vl_all
+    dict vl_array
+    dict vl_slots
     bool can_valid
     string dbc_name
     int can_invalid_cnt
+    int bus
 
   def __init__(self, dbc_name, signals, checks=None, bus=0, enforce_checks=True):
     if checks is None:
       checks = []
 
     self.dbc_name = dbc_name
+    self.bus = bus
     self.dbc = dbc_lookup(dbc_name)
     if not self.dbc:
       raise RuntimeError(f"Can't find DBC: {dbc_name}")
@@ -101,18 +117,36 @@ cdef class CANParser:
       message_options_v.push_back(mpo)
 
     self.can = new cpp_CANParser(bus, dbc_name, message_options_v, signal_options_v)
-    self.update_vl()
 
-  cdef unordered_set[uint32_t] update_vl(self):
+    # Read-only views of the latest signal values of each message, straight from the C++ parser.
+    # Like vl, they only change when a frame passes its checksum and counter checks.
+    # vl_slots maps signal names to their index in the message's array.
+    self.vl_array = {}
+    self.vl_slots = {}
+    cdef MessageState *state
+    cdef int n
+    for msg_address in message_options:
+      state = self.can.get_message_state(msg_address)
+      n = state.vals.size()
+      arr = np.asarray(<double[:n]> state.vals.data()) if n > 0 else np.zeros(0)
+      arr.flags.writeable = False
+      slots = {(<unicode>state.parse_sigs[i].name): i for i in range(n)}
+
+      name = self.address_to_msg_name[msg_address].decode('utf8')
+      self.vl_array[msg_address] = self.vl_array[name] = arr
+      self.vl_slots[msg_address] = self.vl_slots[name] = slots
+
+    cdef vector[SignalValue] new_vals
+    self.can.query_latest(new_vals, 0)
+    self.update_vl(new_vals)
+
+  cdef unordered_set[uint32_t] update_vl(self, vector[SignalValue] &new_vals):
     cdef unordered_set[uint32_t] updated_addrs
 
     # Update invalid flag
-    self.can_invalid_cnt += 1
-    if self.can.can_valid:
-      self.can_invalid_cnt = 0
+    self.can_invalid_cnt = self.can.can_invalid_cnt
     self.can_valid = self.can_invalid_cnt < CAN_INVALID_CNT
 
-    new_vals = self.can.query_latest()
     for cv in new_vals:
       # Cast char * directly to unicode
       cv_name = <unicode>cv.name
@@ -122,22 +156,31 @@ cdef class CANParser:
 
     return updated_addrs
 
-  def update_string(self, dat, sendcan=False):
-    for v in self.vl_all.values():
-      v.clear()
+  def handle(self, msg, sig):
+    """Returns a handle to the latest value of signal sig in message msg (name or address).
+    Reading it with get() skips the string lookups of cp.vl[msg][sig], and gives the same value."""
+    cdef const double[::1] values = self.vl_array[msg]
+    cdef SignalHandle h = SignalHandle.__new__(SignalHandle)
+    h.slot = self.vl_slots[msg][sig]
+    h.values = self.vl_array[msg]
+    h.ptr = &values[h.slot]
+    return h
+
+  cpdef double get(self, SignalHandle h):
+    return h.ptr[0]
 
-    self.can.update_string(dat, sendcan)
-    return self.update_vl()
+  def update_string(self, dat, sendcan=False):
+    return self.update_strings([dat], sendcan)
 
   def update_strings(self, strings, sendcan=False):
+    cdef vector[SignalValue] new_vals
+
     for v in self.vl_all.values():
       v.clear()
 
-    updated_addrs = set()
-    for s in strings:
-      self.can.update_string(s, sendcan)
-      updated_addrs.update(self.update_vl())
-    return updated_addrs
+    # parse all strings in C++ before touching any python objects
+    self.can.update_strings(strings, new_vals, sendcan)
+    return self.update_vl(new_vals)
 
 
 cdef class CANDefine():
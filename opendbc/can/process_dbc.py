@@ -5,7 +5,7 @@ import sys
 import jinja2
 
 from collections import Counter
-from opendbc.can.dbc import dbc
+from opendbc.can.dbc import dbc, get_checksum_state
 
 def process(in_fn, out_fn):
   dbc_name = os.path.split(out_fn)[-1].replace('.cc', '')
@@ -25,48 +25,8 @@ def process(in_fn, out_fn):
   def_vals = {a: sorted(set(b)) for a, b in can_dbc.def_vals.items()}  # remove duplicates
   def_vals = sorted(def_vals.items())
 
-  if can_dbc.name.startswith(("honda_", "acura_")):
-    checksum_type = "honda"
-    checksum_size = 4
-    counter_size = 2
-    checksum_start_bit = 3
-    counter_start_bit = 5
-    little_endian = False
-  elif can_dbc.name.startswith(("toyota_", "lexus_")):
-    checksum_type = "toyota"
-    checksum_size = 8
-    counter_size = None
-    checksum_start_bit = 7
-    counter_start_bit = None
-    little_endian = False
-  elif can_dbc.name.startswith(("vw_", "volkswagen_", "audi_", "seat_", "skoda_")):
-    checksum_type = "volkswagen"
-    checksum_size = 8
-    counter_size = 4
-    checksum_start_bit = 0
-    counter_start_bit = 0
-    little_endian = True
-  elif can_dbc.name.startswith(("subaru_global_")):
-    checksum_type = "subaru"
-    checksum_size = 8
-    counter_size = None
-    checksum_start_bit = 0
-    counter_start_bit = None
-    little_endian = True
-  elif can_dbc.name.startswith(("chrysler_", "stellantis_")):
-    checksum_type = "chrysler"
-    checksum_size = 8
-    counter_size = None
-    checksum_start_bit = 7
-    counter_start_bit = None
-    little_endian = False
-  else:
-    checksum_type = None
-    checksum_size = None
-    counter_size = None
-    checksum_start_bit = None
-    counter_start_bit = None
-    little_endian = None
+  checksum_type, checksum_size, counter_size, checksum_start_bit, counter_start_bit, little_endian = \
+    get_checksum_state(can_dbc.name)
 
   # sanity checks on expected COUNTER and CHECKSUM rules, as packer and parser auto-compute those signals
   for address, msg_name, _, sigs in msgs:
@@ -25,73 +25,74 @@ CANPACKET_HEAD_SIZE = 0x5
 DLC_TO_LEN = [0, 1, 2, 3, 4, 5, 6, 7, 8, 12, 16, 20, 24, 32, 48, 64]
 LEN_TO_DLC = {length: dlc for (dlc, length) in enumerate(DLC_TO_LEN)}
 
+CAN_HEADER = struct.Struct("<BI")
+USB_PACKET_SIZE = 64
+USB_PACKET_DATA_SIZE = USB_PACKET_SIZE - 1  # first byte of every USB packet is a counter
+CAN_CHUNK_SIZE = 256
+
 def pack_can_buffer(arr):
-  snds = [b'']
-  idx = 0
+  snds = []
+  chunk = bytearray()
   for address, _, dat, bus in arr:
     assert len(dat) in LEN_TO_DLC
     if DEBUG:
       print(f"  W 0x{address:x}: 0x{dat.hex()}")
     extended = 1 if address >= 0x800 else 0
     data_len_code = LEN_TO_DLC[len(dat)]
-    header = bytearray(5)
-    word_4b = address << 3 | extended << 2
-    header[0] = (data_len_code << 4) | (bus << 1)
-    header[1] = word_4b & 0xFF
-    header[2] = (word_4b >> 8) & 0xFF
-    header[3] = (word_4b >> 16) & 0xFF
-    header[4] = (word_4b >> 24) & 0xFF
-    snds[idx] += header + dat
-    if len(snds[idx]) > 256: # Limit chunks to 256 bytes
-      snds.append(b'')
-      idx += 1
+    chunk += CAN_HEADER.pack((data_len_code << 4) | (bus << 1), address << 3 | extended << 2)
+    chunk += dat
+    if len(chunk) > CAN_CHUNK_SIZE: # Limit chunks to 256 bytes
+      snds.append(chunk)
+      chunk = bytearray()
+  snds.append(chunk)
 
   #Apply counter to each 64 byte packet
-  for idx in range(len(snds)):
-    tx = b''
-    counter = 0
-    for i in range (0, len(snds[idx]), 63):
-      tx += bytes([counter]) + snds[idx][i:i+63]
-      counter += 1
-    snds[idx] = tx
+  for idx, chunk in enumerate(snds):
+    num_packets = -(-len(chunk) // USB_PACKET_DATA_SIZE)
+    tx = bytearray(len(chunk) + num_packets)
+    src = memoryview(chunk)
+    for counter in range(num_packets):
+      i = counter * USB_PACKET_DATA_SIZE
+      o = counter * USB_PACKET_SIZE
+      end = min(i + USB_PACKET_DATA_SIZE, len(chunk))
+      tx[o] = counter
+      tx[o + 1:o + 1 + end - i] = src[i:end]
+    snds[idx] = bytes(tx)
   return snds
 
 def unpack_can_buffer(dat):
-  ret = []
-  counter = 0
-  tail = bytearray()
-  for i in range(0, len(dat), 64):
+  # strip the counters, stopping at the first lost USB packet
+  dat = memoryview(dat)
+  packets = []
+  for counter, i in enumerate(range(0, len(dat), USB_PACKET_SIZE)):
     if counter != dat[i]:
       print("CAN: LOST RECV PACKET COUNTER")
       break
-    counter+=1
-    chunk = tail + dat[i+1:i+64]
-    tail = bytearray()
-    pos = 0
-    while pos<len(chunk):
-      data_len = DLC_TO_LEN[(chunk[pos]>>4)]
-      pckt_len = CANPACKET_HEAD_SIZE + data_len
-      if pckt_len <= len(chunk[pos:]):
-        header = chunk[pos:pos+CANPACKET_HEAD_SIZE]
-        if len(header) < 5:
-          print("CAN: MALFORMED USB RECV PACKET")
-          break
-        bus = (header[0] >> 1) & 0x7
-        address = (header[4] << 24 | header[3] << 16 | header[2] << 8 | header[1]) >> 3
-        returned = (header[1] >> 1) & 0x1
-        rejected = header[1] & 0x1
-        data = chunk[pos + CANPACKET_HEAD_SIZE:pos + CANPACKET_HEAD_SIZE + data_len]
-        if returned:
-          bus += 128
-        if rejected:
-          bus += 192
-        if DEBUG:
-          print(f"  R 0x{address:x}: 0x{data.hex()}")
-        ret.append((address, 0, data, bus))
-        pos += pckt_len
-      else:
-        tail = chunk[pos:]
-        break
+    packets.append(dat[i + 1:i + USB_PACKET_SIZE])
+  buf = bytearray().join(packets)
+
+  ret = []
+  pos = 0
+  while pos < len(buf):
+    data_len = DLC_TO_LEN[buf[pos] >> 4]
+    end = pos + CANPACKET_HEAD_SIZE + data_len
+    if end > len(buf):
+      # incomplete packet at the end of the transfer
+      break
+    head, word_4b = CAN_HEADER.unpack_from(buf, pos)
+    bus = (head >> 1) & 0x7
+    address = word_4b >> 3
+    returned = (word_4b >> 1) & 0x1
+    rejected = word_4b & 0x1
+    data = buf[pos + CANPACKET_HEAD_SIZE:end]
+    if returned:
+      bus += 128
+    if rejected:
+      bus += 192
+    if DEBUG:
+      print(f"  R 0x{address:x}: 0x{data.hex()}")
+    ret.append((address, 0, data, bus))
+    pos = end
   return ret
 
 def ensure_health_packet_version(fn):
@@ -272,6 +272,46 @@ cdef class AcadosOcpSolverCython:
         return out
 
 
+    def get_all(self, str field_, out_=None):
+        """
+        Get the last solution of the solver for all stages at once:
+
+            :param field: string in ['x', 'u', 'z', 'pi', 'lam', 't', 'sl', 'su']
+            :param out: optional preallocated C-contiguous float64 array with a row per stage, starting at stage 0.
+                Defaults to a new array with N+1 rows for 'x' and N rows for the other fields.
+        """
+
+        out_fields = ['x', 'u', 'z', 'pi', 'lam', 't', 'sl', 'su']
+        field = field_.encode('utf-8')
+
+        if field_ not in out_fields:
+            raise Exception('AcadosOcpSolverCython.get_all(): {} is an invalid argument.\
+                    \n Possible values are {}. Exiting.'.format(field_, out_fields))
+
+        if out_ is None:
+            n_stages = self.N + 1 if field_ == 'x' else self.N
+            dims_0 = acados_solver_common.ocp_nlp_dims_get_from_attr(self.nlp_config,
+                self.nlp_dims, self.nlp_out, 0, field)
+            out_ = np.zeros((n_stages, dims_0))
+
+        cdef double[:, ::1] out = out_
+        if out.shape[0] > self.N + 1 or (field_ == 'pi' and out.shape[0] > self.N):
+            raise Exception('AcadosOcpSolverCython.get_all(): too many stages for field {}, got: {}.'.format(field_, out.shape[0]))
+
+        cdef int stage, dims
+        for stage in range(out.shape[0]):
+            dims = acados_solver_common.ocp_nlp_dims_get_from_attr(self.nlp_config,
+                self.nlp_dims, self.nlp_out, stage, field)
+            if dims > out.shape[1]:
+                raise Exception('AcadosOcpSolverCython.get_all(): field {} at stage {} has dimension {} (you have {})'\
+                    .format(field_, stage, dims, out.shape[1]))
+            if dims > 0:
+                acados_solver_common.ocp_nlp_out_get(self.nlp_config, \
+                    self.nlp_dims, self.nlp_out, stage, field, <void *> &out[stage, 0])
+
+        return out_
+
+
     def print_statistics(self):
         """
         prints statistics of previous solver run as a table:
@@ -548,6 +588,60 @@ cdef class AcadosOcpSolverCython:
                     self.nlp_solver, stage, field, <void *> value.data)
 
 
+    def set_all(self, str field_, value_):
+        """
+        Set numerical data inside the solver for all stages at once.
+
+            :param field: string in ['p', 'yref', 'x', 'u', 'pi', 'lam', 't', 'z', 'sl', 'su']
+            :param value: 2d array with a row per stage, starting at stage 0, at most N+1 rows and N for 'pi'.
+                Rows can be wider than the field at a stage, e.g. the terminal yref uses the first ny_e values.
+        """
+        cost_fields = ['y_ref', 'yref']
+        out_fields = ['x', 'u', 'pi', 'lam', 't', 'z', 'sl', 'su']
+
+        if field_ not in ['p'] + cost_fields + out_fields:
+            raise Exception("AcadosOcpSolverCython.set_all(): {} is not a valid argument.\
+                \nPossible values are {}. Exiting.".format(field_, ['p'] + cost_fields + out_fields))
+
+        field = field_.encode('utf-8')
+        cdef bint is_param = field_ == 'p'
+        cdef bint is_cost = field_ in cost_fields
+
+        cdef double[:, ::1] value = np.ascontiguousarray(value_, dtype=np.float64)
+        if value.shape[0] > self.N + 1 or (field_ == 'pi' and value.shape[0] > self.N):
+            raise Exception('AcadosOcpSolverCython.set_all(): too many stages for field {}, got: {}, N is {}.'\
+                .format(field_, value.shape[0], self.N))
+        if value.shape[0] > 0 and value.shape[1] == 0:
+            raise Exception('AcadosOcpSolverCython.set_all(): got empty rows for field {}.'.format(field_))
+
+        cdef int stage, dims
+        cdef int cost_dims[2]
+        for stage in range(value.shape[0]):
+            if is_param:
+                assert acados_solver.acados_update_params(self.capsule, stage, &value[stage, 0], value.shape[1]) == 0
+                continue
+
+            if is_cost:
+                acados_solver_common.ocp_nlp_cost_dims_get_from_attr(self.nlp_config, \
+                    self.nlp_dims, self.nlp_out, stage, field, &cost_dims[0])
+                dims = cost_dims[0]
+            else:
+                dims = acados_solver_common.ocp_nlp_dims_get_from_attr(self.nlp_config,
+                    self.nlp_dims, self.nlp_out, stage, field)
+            if dims > value.shape[1]:
+                raise Exception('AcadosOcpSolverCython.set_all(): mismatching dimension for field "{}" at stage {} '\
+                    'with dimension {} (you have {})'.format(field_, stage, dims, value.shape[1]))
+            if dims == 0:
+                continue
+
+            if is_cost:
+                acados_solver_common.ocp_nlp_cost_model_set(self.nlp_config,
+                    self.nlp_dims, self.nlp_in, stage, field, <void *> &value[stage, 0])
+            else:
+                acados_solver_common.ocp_nlp_out_set(self.nlp_config,
+                    self.nlp_dims, self.nlp_out, stage, field, <void *> &value[stage, 0])
+
+
     def cost_set(self, int stage, str field_, value_):
         """
         Set numerical data in the cost module of the solver.
@@ -28,10 +28,10 @@ from cereal import log
 from cereal.services import service_list
 from common.api import Api
 from common.basedir import PERSIST
-from common.file_helpers import CallbackReader
 from common.params import Params
 from common.realtime import sec_since_boot
 from selfdrive.hardware import HARDWARE, PC, TICI
+from selfdrive.loggerd.chunked_upload import ChunkedUpload
 from selfdrive.loggerd.config import ROOT
 from selfdrive.loggerd.xattr_cache import getxattr, setxattr
 from selfdrive.statsd import STATS_DIR
@@ -60,7 +60,7 @@ upload_queue: Any = queue.Queue()
 low_priority_send_queue: Any = queue.Queue()
 log_recv_queue: Any = queue.Queue()
 cancelled_uploads: Any = set()
-UploadItem = namedtuple('UploadItem', ['path', 'url', 'headers', 'created_at', 'id', 'retry_count', 'current', 'progress', 'allow_cellular'], defaults=(0, False, 0, False))
+UploadItem = namedtuple('UploadItem', ['path', 'url', 'headers', 'created_at', 'id', 'retry_count', 'current', 'progress', 'allow_cellular', 'chunks'], defaults=(0, False, 0, False, ()))
 
 cur_upload_items: Dict[int, Any] = {}
 
@@ -77,14 +77,16 @@ class UploadQueueCache():
       upload_queue_json = UploadQueueCache.params.get("AthenadUploadQueue")
       if upload_queue_json is not None:
         for item in json.loads(upload_queue_json):
-          upload_queue.put(UploadItem(**item))
+          upload_queue.put(UploadItem(**item)._replace(current=False))
     except Exception:
       cloudlog.exception("athena.UploadQueueCache.initialize.exception")
 
   @staticmethod
   def cache(upload_queue):
     try:
-      items = [i._asdict() for i in upload_queue.queue if i.id not in cancelled_uploads]
+      # uploads in progress are kept too, with the chunks they have done so far
+      items = list(upload_queue.queue) + [i for i in list(cur_upload_items.values()) if i is not None]
+      items = [i._asdict() for i in items if i.id not in cancelled_uploads]
       UploadQueueCache.params.put("AthenadUploadQueue", json.dumps(items))
     except Exception:
       cloudlog.exception("athena.UploadQueueCache.cache.exception")
@@ -139,8 +141,11 @@ def jsonrpc_handler(end_event):
 
 
 def retry_upload(tid: int, end_event: threading.Event, increase_count: bool = True) -> None:
-  if cur_upload_items[tid].retry_count < MAX_RETRY_COUNT:
-    item = cur_upload_items[tid]
+  # the item is no longer in progress, otherwise the cache would keep it twice, or keep a dropped one
+  item = cur_upload_items[tid]
+  cur_upload_items[tid] = None
+
+  if item.retry_count < MAX_RETRY_COUNT:
     new_retry_count = item.retry_count + 1 if increase_count else item.retry_count
 
     item = item._replace(
@@ -151,12 +156,13 @@ def retry_upload(tid: int, end_event: threading.Event, increase_count: bool = Tr
     upload_queue.put_nowait(item)
     UploadQueueCache.cache(upload_queue)
 
-    cur_upload_items[tid] = None
-
     for _ in range(RETRY_DELAY):
       time.sleep(1)
       if end_event.is_set():
         break
+  else:
+    cloudlog.event("athena.upload_handler.drop", item=item, error=True)
+    UploadQueueCache.cache(upload_queue)
 
 
 def upload_handler(end_event: threading.Event) -> None:
@@ -197,6 +203,11 @@ def upload_handler(end_event: threading.Event) -> None:
 
           cur_upload_items[tid] = cur_upload_items[tid]._replace(progress=cur / sz if sz else 1)
 
+        def chunk_cb(idx):
+          # a restarted upload reports chunks again, keep every index once
+          cur_upload_items[tid] = cur_upload_items[tid]._replace(chunks=sorted(set(cur_upload_items[tid].chunks) | {idx}))
+          UploadQueueCache.cache(upload_queue)
+
         fn = cur_upload_items[tid].path
         try:
           sz = os.path.getsize(fn)
@@ -204,13 +215,18 @@ def upload_handler(end_event: threading.Event) -> None:
           sz = -1
 
         cloudlog.event("athena.upload_handler.upload_start", fn=fn, sz=sz, network_type=network_type, metered=metered, retry_count=cur_upload_items[tid].retry_count)
-        response = _do_upload(cur_upload_items[tid], cb)
+        start_time = time.monotonic()
+        upload = _do_upload(cur_upload_items[tid], cb, chunk_cb)
+        response = upload.run()
 
         if response.status_code not in (200, 201, 401, 403, 412):
           cloudlog.event("athena.upload_handler.retry", status_code=response.status_code, fn=fn, sz=sz, network_type=network_type, metered=metered)
           retry_upload(tid, end_event)
         else:
-          cloudlog.event("athena.upload_handler.success", fn=fn, sz=sz, network_type=network_type, metered=metered)
+          speed = (upload.sent / 1e6) / max(time.monotonic() - start_time, 1e-3)
+          cloudlog.event("athena.upload_handler.success", fn=fn, sz=sz, network_type=network_type, metered=metered,
+                         chunks=upload.chunk_count, resumed=upload.resumed, speed=speed)
+          cur_upload_items[tid] = None
 
         UploadQueueCache.cache(upload_queue)
       except (requests.exceptions.Timeout, requests.exceptions.ConnectionError, requests.exceptions.SSLError):
@@ -226,17 +242,9 @@ def upload_handler(end_event: threading.Event) -> None:
       cloudlog.exception("athena.upload_handler.exception")
 
 
-def _do_upload(upload_item, callback=None):
-  with open(upload_item.path, "rb") as f:
-    size = os.fstat(f.fileno()).st_size
-
-    if callback:
-      f = CallbackReader(f, callback, size)
-
-    return requests.put(upload_item.url,
-                        data=f,
-                        headers={**upload_item.headers, 'Content-Length': str(size)},
-                        timeout=30)
+def _do_upload(upload_item, callback=None, chunk_callback=None):
+  return ChunkedUpload(upload_item.path, upload_item.url, upload_item.headers, done_chunks=upload_item.chunks,
+                       progress_callback=callback, chunk_callback=chunk_callback, timeout=30)
 
 
 # security: user should be able to request any message from their car
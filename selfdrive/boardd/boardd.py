@@ -1,8 +1,9 @@
 # pylint: skip-file
 
 # Cython, now uses scons to build
-from selfdrive.boardd.boardd_api_impl import can_list_to_can_capnp
+from selfdrive.boardd.boardd_api_impl import can_list_to_can_capnp, can_strings_to_can_list
 assert can_list_to_can_capnp
+assert can_strings_to_can_list
 
 def can_capnp_to_can_list(can, src_filter=None):
   ret = []
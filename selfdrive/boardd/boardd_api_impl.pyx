@@ -2,7 +2,9 @@
 # cython: language_level=3
 from libcpp.vector cimport vector
 from libcpp.string cimport string
+from libcpp.unordered_set cimport unordered_set
 from libcpp cimport bool
+from libc.stdint cimport uint64_t
 
 cdef struct can_frame:
   long address
@@ -11,6 +13,8 @@ cdef struct can_frame:
   long src
 
 cdef extern void can_list_to_can_capnp_cpp(const vector[can_frame] &can_list, string &out, bool sendCan, bool valid)
+cdef extern void can_capnp_to_can_list_cpp(const vector[string] &strings, vector[can_frame] &can_list,
+                                           const unordered_set[uint64_t] &src_addrs, bool sendCan)
 
 def can_list_to_can_capnp(can_msgs, msgtype='can', valid=True):
   cdef vector[can_frame] can_list
@@ -26,3 +30,16 @@ def can_list_to_can_capnp(can_msgs, msgtype='can', valid=True):
   cdef string out
   can_list_to_can_capnp_cpp(can_list, out, msgtype == 'sendcan', valid)
   return out
+
+def can_strings_to_can_list(strings, src_addrs=None, msgtype='can'):
+  """Decodes the frames of serialized can events into (address, busTime, dat, src) tuples.
+  A non-empty src_addrs limits this to an iterable of (src, address) pairs, the rest is skipped
+  without being converted to python objects."""
+  cdef unordered_set[uint64_t] filt
+  if src_addrs is not None:
+    for src, address in src_addrs:
+      filt.insert((<uint64_t>src << 32) | <uint64_t>address)
+
+  cdef vector[can_frame] can_list
+  can_capnp_to_can_list_cpp(strings, can_list, filt, msgtype == 'sendcan')
+  return [(f.address, f.busTime, f.dat, f.src) for f in can_list]
@@ -1,3 +1,5 @@
+#include <unordered_set>
+
 #include "cereal/messaging/messaging.h"
 #include "panda.h"
 
@@ -22,4 +24,27 @@ void can_list_to_can_capnp_cpp(const std::vector<can_frame> &can_list, std::stri
   capnp::writeMessage(output_stream, msg);
 }
 
+void can_capnp_to_can_list_cpp(const std::vector<std::string> &strings, std::vector<can_frame> &can_list,
+                               const std::unordered_set<uint64_t> &src_addrs, bool sendCan) {
+  AlignedBuffer aligned_buf;
+  for (const auto &s : strings) {
+    capnp::FlatArrayMessageReader cmsg(aligned_buf.align(s.data(), s.size()));
+    cereal::Event::Reader event = cmsg.getRoot<cereal::Event>();
+    if (event.which() != (sendCan ? cereal::Event::SENDCAN : cereal::Event::CAN)) continue;
+
+    auto cans = sendCan ? event.getSendcan() : event.getCan();
+    for (auto c : cans) {
+      // only copy out the frames we're interested in, keyed by src in the upper 32 bits
+      if (!src_addrs.empty() && src_addrs.find(((uint64_t)c.getSrc() << 32) | c.getAddress()) == src_addrs.end()) continue;
+
+      auto dat = c.getDat();
+      can_frame &f = can_list.emplace_back();
+      f.address = c.getAddress();
+      f.busTime = c.getBusTime();
+      f.dat.assign((const char *)dat.begin(), dat.size());
+      f.src = c.getSrc();
+    }
+  }
+}
+
 }
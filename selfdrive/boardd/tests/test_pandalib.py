@@ -0,0 +1,46 @@
+#!/usr/bin/env python3
+import random
+import unittest
+
+from panda import pack_can_buffer, unpack_can_buffer, DLC_TO_LEN
+
+
+def random_can_messages(n):
+  msgs = []
+  for _ in range(n):
+    address = random.randint(1, 0x1FFFFFFF) if random.random() < 0.5 else random.randint(1, 0x7FF)
+    dat = bytes(random.getrandbits(8) for _ in range(random.choice(DLC_TO_LEN)))
+    msgs.append((address, 0, dat, random.randint(0, 2)))
+  return msgs
+
+
+class TestPandaLib(unittest.TestCase):
+  def test_pack_unpack_fuzz(self):
+    random.seed(0)
+    for _ in range(1000):
+      msgs = random_can_messages(random.randint(0, 200))
+      snds = pack_can_buffer(msgs)
+
+      unpacked = []
+      for tx in snds:
+        # every USB packet starts with its index in the chunk
+        for counter, i in enumerate(range(0, len(tx), 64)):
+          self.assertEqual(tx[i], counter)
+        unpacked += unpack_can_buffer(tx)
+
+      self.assertEqual(msgs, [(a, b, bytes(dat), bus) for a, b, dat, bus in unpacked])
+
+  def test_unpack_lost_counter(self):
+    random.seed(0)
+    msgs = random_can_messages(10)
+    tx = pack_can_buffer(msgs)[0]
+    self.assertGreater(len(tx), 64)
+
+    # everything after a lost USB packet is dropped
+    rx = bytearray(tx)
+    rx[64] = 5
+    self.assertEqual(unpack_can_buffer(rx), unpack_can_buffer(tx[:64]))
+
+
+if __name__ == "__main__":
+  unittest.main()
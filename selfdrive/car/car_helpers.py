@@ -4,7 +4,7 @@ from typing import Any, Dict, List
 from common.params import Params
 from common.basedir import BASEDIR
 from selfdrive.version import is_comma_remote, is_tested_branch
-from selfdrive.car.fingerprints import eliminate_incompatible_cars, all_legacy_fingerprint_cars
+from selfdrive.car.fingerprints import ALL_FINGERPRINT_CARS_MASK, cars_from_mask, compatible_cars_mask
 from selfdrive.car.vin import get_vin, VIN_UNKNOWN
 from selfdrive.car.fw_versions import get_fw_versions, match_fw_to_car
 from selfdrive.swaglog import cloudlog
@@ -120,7 +120,9 @@ def fingerprint(logcan, sendcan):
   Params().put("CarVin", vin)
 
   finger = gen_empty_fingerprint()
-  candidate_cars = {i: all_legacy_fingerprint_cars() for i in [0, 1]}  # attempt fingerprint on both bus 0 and 1
+  # candidates are bitsets over all_legacy_fingerprint_cars(), attempt fingerprint on both bus 0 and 1
+  candidate_cars = {i: ALL_FINGERPRINT_CARS_MASK for i in [0, 1]}
+  seen_msgs = {i: set() for i in candidate_cars}
 
   #print(candidate_cars)
 
@@ -140,20 +142,24 @@ def fingerprint(logcan, sendcan):
           finger[can.src] = {}
         finger[can.src][can.address] = len(can.dat)
 
-      for b in candidate_cars:
-        # Ignore extended messages and VIN query response.
-        if can.src == b and can.address < 0x800 and can.address not in (0x7df, 0x7e0, 0x7e8):
-          candidate_cars[b] = eliminate_incompatible_cars(can, candidate_cars[b])
+      # Ignore extended messages and VIN query response.
+      if can.src in candidate_cars and can.address < 0x800 and can.address not in (0x7df, 0x7e0, 0x7e8):
+        # an (address, length) only eliminates cars the first time it's seen
+        msg = (can.address, len(can.dat))
+        if msg not in seen_msgs[can.src]:
+          seen_msgs[can.src].add(msg)
+          candidate_cars[can.src] &= compatible_cars_mask(*msg)
 
     # if we only have one car choice and the time since we got our first
     # message has elapsed, exit
     for b in candidate_cars:
-      if len(candidate_cars[b]) == 1 and frame > frame_fingerprint:
+      cc = candidate_cars[b]
+      if cc and not cc & (cc - 1) and frame > frame_fingerprint:
         # fingerprint done
-        car_fingerprint = candidate_cars[b][0]
+        car_fingerprint = cars_from_mask(cc)[0]
 
     # bail if no cars left or we've been waiting for more than 2s
-    failed = (all(len(cc) == 0 for cc in candidate_cars.values()) and frame > frame_fingerprint) or frame > 200
+    failed = (all(cc == 0 for cc in candidate_cars.values()) and frame > frame_fingerprint) or frame > 200
     succeeded = car_fingerprint is not None
     done = failed or succeeded
 
@@ -1,5 +1,7 @@
 import os
 import traceback
+from collections import defaultdict
+
 from common.basedir import BASEDIR
 
 
@@ -53,6 +55,35 @@ def is_valid_for_fingerprint(msg, car_fingerprint):
   return (adr in car_fingerprint and car_fingerprint[adr] == len(msg.dat)) or adr >= 0x800
 
 
+def _build_fingerprint_index():
+  # inverted index from (address, length) to a bitset of the FPv1 cars that have it in any of their fingerprints
+  cars = list(_FINGERPRINTS.keys())
+  index = defaultdict(int)
+  for i, car_name in enumerate(cars):
+    for fingerprint in _FINGERPRINTS[car_name]:
+      for adr_len in {**fingerprint, **_DEBUG_ADDRESS}.items():  # add alien debug address
+        index[adr_len] |= 1 << i
+  return cars, dict(index)
+
+
+_FINGERPRINT_CARS, _FINGERPRINT_INDEX = _build_fingerprint_index()
+_FINGERPRINT_CAR_BITS = {car_name: 1 << i for i, car_name in enumerate(_FINGERPRINT_CARS)}
+ALL_FINGERPRINT_CARS_MASK = (1 << len(_FINGERPRINT_CARS)) - 1
+
+
+def compatible_cars_mask(address, length):
+  """Returns the bitset of FPv1 cars that could have sent a message with this address and length."""
+  # ignore addresses that are more than 11 bits
+  if address >= 0x800:
+    return ALL_FINGERPRINT_CARS_MASK
+  return _FINGERPRINT_INDEX.get((address, length), 0)
+
+
+def cars_from_mask(mask):
+  """Returns the cars in a bitset from compatible_cars_mask, in all_legacy_fingerprint_cars order."""
+  return [car_name for car_name, bit in _FINGERPRINT_CAR_BITS.items() if mask & bit]
+
+
 def eliminate_incompatible_cars(msg, candidate_cars):
   """Removes cars that could not have sent msg.
 
@@ -63,22 +94,8 @@ def eliminate_incompatible_cars(msg, candidate_cars):
      Returns:
       A list containing the subset of candidate_cars that could have sent msg.
   """
-  compatible_cars = []
-
-  for car_name in candidate_cars:
-    car_fingerprints = _FINGERPRINTS[car_name]
-
-    for fingerprint in car_fingerprints:
-      fingerprint.update(_DEBUG_ADDRESS)  # add alien debug address
-
-      #print(fingerprint)
-      #print(msg)
-      #print(car_name)
-      if is_valid_for_fingerprint(msg, fingerprint):
-        compatible_cars.append(car_name)
-        break
-
-  return compatible_cars
+  mask = compatible_cars_mask(msg.address, len(msg.dat))
+  return [car_name for car_name in candidate_cars if mask & _FINGERPRINT_CAR_BITS[car_name]]
 
 
 def all_known_cars():
@@ -1,16 +1,15 @@
 #!/usr/bin/env python3
 import struct
 import traceback
-from typing import Any, List
+from typing import Any, Dict, FrozenSet, List, Optional, Tuple
 from collections import defaultdict
 from dataclasses import dataclass
-
-from tqdm import tqdm
+from functools import lru_cache
 
 import panda.python.uds as uds
 from cereal import car
 from selfdrive.car.fingerprints import FW_VERSIONS, get_attr_from_cars
-from selfdrive.car.isotp_parallel_query import IsoTpParallelQuery
+from selfdrive.car.isotp_parallel_query import IsoTpQueryScheduler
 from selfdrive.car.toyota.values import CAR as TOYOTA
 from selfdrive.swaglog import cloudlog
 
@@ -185,11 +184,6 @@ REQUESTS: List[Request] = [
 ]
 
 
-def chunks(l, n=128):
-  for i in range(0, len(l), n):
-    yield l[i:i + n]
-
-
 def build_fw_dict(fw_versions):
   fw_versions_dict = {}
   for fw in fw_versions:
@@ -199,34 +193,88 @@ def build_fw_dict(fw_versions):
   return fw_versions_dict
 
 
-def match_fw_to_car_fuzzy(fw_versions_dict, log=True, exclude=None):
-  """Do a fuzzy FW match. This function will return a match, and the number of firmware version
-  that were matched uniquely to that specific car. If multiple ECUs uniquely match to different cars
-  the match is rejected."""
+# These ECUs are known to be shared between models (EPS only between hybrid/ICE version)
+# Getting this exactly right isn't crucial, but excluding camera and radar makes it almost
+# impossible to get 3 matching versions, even if two models with shared parts are released at the same
+# time and only one is in our database.
+FUZZY_EXCLUDE_ECUS = [Ecu.fwdCamera, Ecu.fwdRadar, Ecu.eps, Ecu.debug]
+
+ESSENTIAL_ECUS = [Ecu.engine, Ecu.eps, Ecu.esp, Ecu.fwdRadar, Ecu.fwdCamera, Ecu.vsa]
+
+
+@dataclass
+class FwIndex:
+  cars: FrozenSet[str]
+  # (addr, subaddr, fw) -> cars with that FW response on that address, for the fuzzy match
+  fuzzy: Dict[Tuple[int, Optional[int], bytes], Tuple[str, ...]]
+  # (addr, subaddr) -> ECUs on that address, as (cars checked, cars requiring a response, cars by version)
+  ecus: Dict[Tuple[int, Optional[int]], List[Tuple[FrozenSet[str], FrozenSet[str], Dict[bytes, FrozenSet[str]]]]]
+
 
-  # These ECUs are known to be shared between models (EPS only between hybrid/ICE version)
-  # Getting this exactly right isn't crucial, but excluding camera and radar makes it almost
-  # impossible to get 3 matching versions, even if two models with shared parts are released at the same
-  # time and only one is in our database.
-  exclude_types = [Ecu.fwdCamera, Ecu.fwdRadar, Ecu.eps, Ecu.debug]
+def ecu_required(candidate, ecu_type):
+  """Returns whether candidate must respond on an ECU for an exact match."""
+  # Ignore non essential ecus, this includes the virtual debug ecu
+  if ecu_type not in ESSENTIAL_ECUS:
+    return False
 
-  # Build lookup table from (addr, subaddr, fw) to list of candidate cars
-  all_fw_versions = defaultdict(list)
-  for candidate, fw_by_addr in FW_VERSIONS.items():
-    if candidate == exclude:
-      continue
+  if ecu_type == Ecu.esp and candidate in (TOYOTA.RAV4, TOYOTA.COROLLA, TOYOTA.HIGHLANDER, TOYOTA.SIENNA, TOYOTA.LEXUS_IS):
+    return False
 
-    for addr, fws in fw_by_addr.items():
-      if addr[0] in exclude_types:
+  # On some Toyota models, the engine can show on two different addresses
+  if ecu_type == Ecu.engine and candidate in (TOYOTA.CAMRY, TOYOTA.COROLLA_TSS2, TOYOTA.CHR, TOYOTA.LEXUS_IS):
+    return False
+
+  return True
+
+
+def build_fw_index(fw_versions):
+  fuzzy = defaultdict(list)
+  checked = defaultdict(set)
+  required = defaultdict(set)
+  by_version = defaultdict(lambda: defaultdict(set))
+
+  for candidate, fw_by_addr in fw_versions.items():
+    for ecu, fws in fw_by_addr.items():
+      ecu_type, addr = ecu[0], ecu[1:]
+      if ecu_type not in FUZZY_EXCLUDE_ECUS:
+        for f in fws:
+          fuzzy[(addr[0], addr[1], f)].append(candidate)
+
+      if ecu_type == Ecu.debug:
         continue
+      checked[ecu].add(candidate)
+      if ecu_required(candidate, ecu_type):
+        required[ecu].add(candidate)
       for f in fws:
-        all_fw_versions[(addr[1], addr[2], f)].append(candidate)
+        by_version[ecu][f].add(candidate)
+
+  ecus = defaultdict(list)
+  for ecu in checked:
+    versions = {f: frozenset(cars) for f, cars in by_version[ecu].items()}
+    ecus[ecu[1:]].append((frozenset(checked[ecu]), frozenset(required[ecu]), versions))
+
+  return FwIndex(frozenset(fw_versions), {k: tuple(v) for k, v in fuzzy.items()}, dict(ecus))
+
+
+@lru_cache(maxsize=None)
+def get_fw_index():
+  """Index of FW_VERSIONS, built once per process."""
+  return build_fw_index(FW_VERSIONS)
+
+
+def match_fw_to_car_fuzzy(fw_versions_dict, log=True, exclude=None):
+  """Do a fuzzy FW match. This function will return a match, and the number of firmware version
+  that were matched uniquely to that specific car. If multiple ECUs uniquely match to different cars
+  the match is rejected."""
+  fuzzy_index = get_fw_index().fuzzy
 
   match_count = 0
   candidate = None
   for addr, version in fw_versions_dict.items():
     # All cars that have this FW response on the specified address
-    candidates = all_fw_versions[(addr[0], addr[1], version)]
+    candidates = fuzzy_index.get((addr[0], addr[1], version), ())
+    if exclude in candidates:
+      candidates = [c for c in candidates if c != exclude]
 
     if len(candidates) == 1:
       match_count += 1
@@ -249,44 +297,31 @@ def match_fw_to_car_exact(fw_versions_dict):
   FW versions for a list of "essential" ECUs. If an ECU is not considered
   essential the FW version can be missing to get a fingerprint, but if it's present it
   needs to match the database."""
-  invalid = []
-  candidates = FW_VERSIONS
-
-  for candidate, fws in candidates.items():
-    for ecu, expected_versions in fws.items():
-      ecu_type = ecu[0]
-      addr = ecu[1:]
-      found_version = fw_versions_dict.get(addr, None)
-      ESSENTIAL_ECUS = [Ecu.engine, Ecu.eps, Ecu.esp, Ecu.fwdRadar, Ecu.fwdCamera, Ecu.vsa]
-      if ecu_type == Ecu.esp and candidate in (TOYOTA.RAV4, TOYOTA.COROLLA, TOYOTA.HIGHLANDER, TOYOTA.SIENNA, TOYOTA.LEXUS_IS) and found_version is None:
-        continue
-
-      # On some Toyota models, the engine can show on two different addresses
-      if ecu_type == Ecu.engine and candidate in (TOYOTA.CAMRY, TOYOTA.COROLLA_TSS2, TOYOTA.CHR, TOYOTA.LEXUS_IS) and found_version is None:
-        continue
-
-      # Ignore non essential ecus
-      if ecu_type not in ESSENTIAL_ECUS and found_version is None:
-        continue
-
-      # Virtual debug ecu doesn't need to match the database
-      if ecu_type == Ecu.debug:
-        continue
+  index = get_fw_index()
+  invalid = set()
 
-      if found_version not in expected_versions:
-        invalid.append(candidate)
-        break
+  for addr, ecus in index.ecus.items():
+    found_version = fw_versions_dict.get(addr, None)
+    for checked, required, by_version in ecus:
+      if found_version is None:
+        invalid |= required
+      else:
+        invalid |= checked - by_version.get(found_version, frozenset())
 
-  return set(candidates.keys()) - set(invalid)
+  return set(index.cars - invalid)
 
 
 def match_fw_to_car(fw_versions, allow_fuzzy=True):
   fw_versions_dict = build_fw_dict(fw_versions)
+  return match_fw_dict_to_car(fw_versions_dict, allow_fuzzy)
+
+
+def match_fw_dict_to_car(fw_versions_dict, allow_fuzzy=True, log=True):
   matches = match_fw_to_car_exact(fw_versions_dict)
 
   exact_match = True
   if allow_fuzzy and len(matches) == 0:
-    matches = match_fw_to_car_fuzzy(fw_versions_dict)
+    matches = match_fw_to_car_fuzzy(fw_versions_dict, log=log)
 
     # Fuzzy match found
     if len(matches) == 1:
@@ -295,6 +330,20 @@ def match_fw_to_car(fw_versions, allow_fuzzy=True):
   return exact_match, matches
 
 
+def match_fw_dicts_to_cars(fw_versions_dicts, allow_fuzzy=True):
+  """Matches many FW version dicts, e.g. from build_fw_dict over the carFw of a set of routes.
+  Returns a list of (exact_match, matches), computed once per distinct set of FW versions."""
+  results = {}
+  ret = []
+  for fw_versions_dict in fw_versions_dicts:
+    key = frozenset(fw_versions_dict.items())
+    if key not in results:
+      results[key] = match_fw_dict_to_car(fw_versions_dict, allow_fuzzy, log=False)
+    exact_match, matches = results[key]
+    ret.append((exact_match, set(matches)))
+  return ret
+
+
 def get_fw_versions(logcan, sendcan, extra=None, timeout=0.1, debug=False, progress=False):
   ecu_types = {}
 
@@ -323,20 +372,30 @@ def get_fw_versions(logcan, sendcan, extra=None, timeout=0.1, debug=False, progr
 
   addrs.insert(0, parallel_addrs)
 
-  fw_versions = {}
-  for i, addr in enumerate(tqdm(addrs, disable=not progress)):
-    for addr_chunk in chunks(addr):
-      for r in REQUESTS:
-        try:
-          addrs = [(a, s) for (b, a, s) in addr_chunk if b in (r.brand, 'any')]
+  # All requests go out at once, ECUs on different addresses and buses are queried concurrently.
+  # Requests to the same address (e.g. the sub addresses) are queued up in order.
+  scheduler = IsoTpQueryScheduler(sendcan, logcan, max_in_flight=128, debug=debug)
+  total_timeout = 0.
+  for i, addr in enumerate(addrs):
+    for r in REQUESTS:
+      query_addrs = [(a, s) for (b, a, s) in addr if b in (r.brand, 'any')]
 
-          if addrs:
-            query = IsoTpParallelQuery(sendcan, logcan, r.bus, addrs, r.request, r.response, r.rx_offset, debug=debug)
-            t = 2 * timeout if i == 0 else timeout
-            fw_versions.update(query.get_data(t))
+      if query_addrs:
+        t = 2 * timeout if i == 0 else timeout
+        try:
+          scheduler.add_query(r.bus, query_addrs, r.request, r.response, r.rx_offset, timeout=t)
+          total_timeout += 10 * t
         except Exception:
           cloudlog.warning(f"FW query exception: {traceback.format_exc()}")
 
+  fw_versions = {}
+  try:
+    # Later requests take precedence for an address
+    for query_fw_versions in scheduler.run(total_timeout, progress=progress):
+      fw_versions.update(query_fw_versions)
+  except Exception:
+    cloudlog.warning(f"FW query exception: {traceback.format_exc()}")
+
   # Build capnp list to put into CarParams
   car_fw = []
   for addr, version in fw_versions.items():
@@ -1,13 +1,38 @@
 import time
 from collections import defaultdict
+from dataclasses import dataclass, field
 from functools import partial
-from typing import Optional
+from typing import Dict, List, Optional, Tuple
+
+from tqdm import tqdm
 
 import cereal.messaging as messaging
 from selfdrive.swaglog import cloudlog
-from selfdrive.boardd.boardd import can_list_to_can_capnp
+from selfdrive.boardd.boardd import can_list_to_can_capnp, can_strings_to_can_list
 from panda.python.uds import CanClient, IsoTpMessage, FUNCTIONAL_ADDRS, get_rx_addr_for_tx_addr
 
+# responses to functional queries, on any physical address
+FUNCTIONAL_RX_ADDRS = list(range(0x7E8, 0x7F0)) + list(range(0x18DAF100, 0x18DAF200))
+
+
+def pop_msgs(msg_buffer, key, sub_addr=None):
+  """Removes and returns the buffered messages of key, only the ones for sub_addr if set"""
+  if sub_addr is None:
+    return msg_buffer.pop(key, [])
+
+  # Filter based on subadress
+  msgs = []
+  keep_msgs = []
+  for m in msg_buffer.get(key, []):
+    first_byte = m[2][0]
+    if first_byte == sub_addr:
+      msgs.append(m)
+    else:
+      keep_msgs.append(m)
+
+  msg_buffer[key] = keep_msgs
+  return msgs
+
 
 class IsoTpParallelQuery:
   def __init__(self, sendcan, logcan, bus, addrs, request, response, response_offset=0x8, functional_addr=False, debug=False):
@@ -29,19 +54,21 @@ class IsoTpParallelQuery:
     self.msg_addrs = {tx_addr: get_rx_addr_for_tx_addr(tx_addr[0], rx_offset=response_offset) for tx_addr in self.real_addrs}
     self.msg_buffer = defaultdict(list)
 
+    rx_addrs = FUNCTIONAL_RX_ADDRS if functional_addr else self.msg_addrs.values()
+    self.src_addrs = [(bus, a) for a in rx_addrs]
+
   def rx(self):
     """Drain can socket and sort messages into buffers based on address"""
-    can_packets = messaging.drain_sock(self.logcan, wait_for_one=True)
-
-    for packet in can_packets:
-      for msg in packet.can:
-        if msg.src == self.bus:
-          if self.functional_addr:
-            if (0x7E8 <= msg.address <= 0x7EF) or (0x18DAF100 <= msg.address <= 0x18DAF1FF):
-              fn_addr = next(a for a in FUNCTIONAL_ADDRS if msg.address - a <= 32)
-              self.msg_buffer[fn_addr].append((msg.address, msg.busTime, msg.dat, msg.src))
-          elif msg.address in self.msg_addrs.values():
-            self.msg_buffer[msg.address].append((msg.address, msg.busTime, msg.dat, msg.src))
+    can_strings = messaging.drain_sock_raw(self.logcan, wait_for_one=True)
+
+    # frames from other buses and addresses are skipped before being decoded
+    for msg in can_strings_to_can_list(can_strings, self.src_addrs):
+      address = msg[0]
+      if self.functional_addr:
+        fn_addr = next(a for a in FUNCTIONAL_ADDRS if address - a <= 32)
+        self.msg_buffer[fn_addr].append(msg)
+      else:
+        self.msg_buffer[address].append(msg)
 
   def _can_tx(self, tx_addr, dat, bus):
     """Helper function to send single message"""
@@ -50,25 +77,10 @@ class IsoTpParallelQuery:
 
   def _can_rx(self, addr, sub_addr=None):
     """Helper function to retrieve message with specified address and subadress from buffer"""
-    keep_msgs = []
-
-    if sub_addr is None:
-      msgs = self.msg_buffer[addr]
-    else:
-      # Filter based on subadress
-      msgs = []
-      for m in self.msg_buffer[addr]:
-        first_byte = m[2][0]
-        if first_byte == sub_addr:
-          msgs.append(m)
-        else:
-          keep_msgs.append(m)
-
-    self.msg_buffer[addr] = keep_msgs
-    return msgs
+    return pop_msgs(self.msg_buffer, addr, sub_addr)
 
   def _drain_rx(self):
-    messaging.drain_sock(self.logcan)
+    messaging.drain_sock_raw(self.logcan)
     self.msg_buffer = defaultdict(list)
 
   def get_data(self, timeout, total_timeout=None):
@@ -146,3 +158,171 @@ class IsoTpParallelQuery:
         break
 
     return results
+
+
+@dataclass
+class IsoTpQueryJob:
+  query: int
+  bus: int
+  tx_addr: Tuple[int, Optional[int]]
+  rx_addr: int
+  request: List[bytes]
+  response: List[bytes]
+  timeout: float
+  counter: int = 0
+  last_rx_time: float = 0.
+  msg: Optional[IsoTpMessage] = field(default=None, repr=False)
+
+  @property
+  def ecu_keys(self):
+    # ECUs behind sub addresses share their tx and rx addresses, and only answer one request at a time
+    return {(self.bus, self.tx_addr[0]), (self.bus, self.rx_addr)}
+
+
+class IsoTpQueryScheduler:
+  """Runs the queries of many IsoTpParallelQuery's at once, possibly on different buses.
+
+  Every ECU goes through the requests of its queries on its own, sending the next request
+  as soon as it answered the previous one. Queries to the same ECU run in the order they were
+  added, all others run concurrently. An ECU gives up on a query after timeout without a response."""
+  def __init__(self, sendcan, logcan, max_in_flight=128, debug=False):
+    self.sendcan = sendcan
+    self.logcan = logcan
+    self.max_in_flight = max_in_flight
+    self.debug = debug
+
+    self.jobs: List[IsoTpQueryJob] = []
+    self.num_queries = 0
+    self.msg_buffer: Dict[Tuple[int, int], list] = defaultdict(list)
+    self.last_rx_time: Dict[Tuple[int, int], float] = {}
+
+  def add_query(self, bus, addrs, request, response, response_offset=0x8, timeout=0.1):
+    """Adds a query with the arguments of IsoTpParallelQuery, returns its index in the results of run"""
+    query = self.num_queries
+
+    jobs = []
+    for a in addrs:
+      tx_addr = a if isinstance(a, tuple) else (a, None)
+      rx_addr = get_rx_addr_for_tx_addr(tx_addr[0], rx_offset=response_offset)
+      if rx_addr is None:
+        raise ValueError(f"functional address not supported: {hex(tx_addr[0])}")
+      jobs.append(IsoTpQueryJob(query, bus, tx_addr, rx_addr, request, response, timeout))
+
+    # only added once all addresses are valid
+    self.jobs += jobs
+    self.num_queries += 1
+    return query
+
+  def rx(self, src_addrs):
+    """Drain can socket and sort messages into buffers based on bus and address"""
+    can_strings = messaging.drain_sock_raw(self.logcan, wait_for_one=True)
+
+    now = time.monotonic()
+    for msg in can_strings_to_can_list(can_strings, src_addrs):
+      self.msg_buffer[(msg[3], msg[0])].append(msg)
+      self.last_rx_time[(msg[3], msg[0])] = now
+
+  def _can_tx(self, tx_addr, dat, bus):
+    """Helper function to send single message"""
+    msg = [tx_addr, 0, dat, bus]
+    self.sendcan.send(can_list_to_can_capnp([msg], msgtype='sendcan'))
+
+  def _can_rx(self, bus, addr, sub_addr=None):
+    """Helper function to retrieve message with specified bus, address and subadress from buffer"""
+    return pop_msgs(self.msg_buffer, (bus, addr), sub_addr)
+
+  def _start(self, job, now):
+    # late responses to an earlier query of this ECU, received while it was idle
+    self.msg_buffer.pop((job.bus, job.rx_addr), None)
+
+    sub_addr = job.tx_addr[1]
+    can_client = CanClient(self._can_tx, partial(self._can_rx, job.bus, job.rx_addr, sub_addr=sub_addr), job.tx_addr[0],
+                           job.rx_addr, job.bus, sub_addr=sub_addr, debug=self.debug)
+
+    max_len = 8 if sub_addr is None else 7
+
+    job.msg = IsoTpMessage(can_client, timeout=0, max_len=max_len, debug=self.debug)
+    job.msg.send(job.request[0])
+    job.last_rx_time = now
+
+  def _step(self, job, now, results):
+    """Processes the responses of a running job, returns True once it's done"""
+    try:
+      dat: Optional[bytes] = job.msg.recv()
+    except Exception:
+      cloudlog.exception("Error processing UDS response")
+      return True
+
+    # multi frame responses keep the job alive while they come in
+    job.last_rx_time = max(job.last_rx_time, self.last_rx_time.get((job.bus, job.rx_addr), 0.))
+
+    if not dat:
+      if now - job.last_rx_time > job.timeout:
+        if job.counter > 0:
+          cloudlog.warning(f"iso-tp query timeout after receiving response: {job.tx_addr}")
+        return True
+      return False
+
+    expected_response = job.response[job.counter]
+    if dat[:len(expected_response)] != expected_response:
+      cloudlog.warning(f"iso-tp query bad response: 0x{dat.hex()}")
+      return True
+
+    if job.counter + 1 < len(job.request):
+      job.counter += 1
+      job.msg.send(job.request[job.counter])
+      job.last_rx_time = now
+      return False
+
+    results[job.query][job.tx_addr] = dat[len(expected_response):]
+    return True
+
+  def run(self, total_timeout=10., progress=False):
+    """Runs all added queries, returns a list with the responses by tx address of each query"""
+    results: List[Dict[Tuple[int, Optional[int]], bytes]] = [{} for _ in range(self.num_queries)]
+    src_addrs = {(job.bus, job.rx_addr) for job in self.jobs}
+
+    messaging.drain_sock_raw(self.logcan)
+    self.msg_buffer = defaultdict(list)
+    self.last_rx_time = {}
+
+    pending = self.jobs
+    active: List[IsoTpQueryJob] = []
+    busy = set()
+    pbar = tqdm(total=len(self.jobs), disable=not progress)
+    start_time = time.monotonic()
+    while pending or active:
+      # start the next query of every idle ECU, keeping the order of queries to the same ECU
+      now = time.monotonic()
+      blocked = set(busy)
+      waiting = []
+      for job in pending:
+        keys = job.ecu_keys
+        if len(active) < self.max_in_flight and blocked.isdisjoint(keys):
+          self._start(job, now)
+          active.append(job)
+          busy |= keys
+        else:
+          waiting.append(job)
+        blocked |= keys
+      pending = waiting
+
+      self.rx(src_addrs)
+
+      now = time.monotonic()
+      running = []
+      for job in active:
+        if self._step(job, now, results):
+          busy -= job.ecu_keys
+          pbar.update()
+        else:
+          running.append(job)
+      active = running
+
+      if now - start_time > total_timeout:
+        cloudlog.warning("iso-tp query timeout while receiving data")
+        break
+
+    pbar.close()
+    self.jobs = []
+    return results
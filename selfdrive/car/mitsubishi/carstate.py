@@ -1,3 +1,5 @@
+from types import SimpleNamespace
+
 from cereal import car
 from common.numpy_fast import mean
 from common.filter_simple import FirstOrderFilter
@@ -26,6 +28,7 @@ class CarState(CarStateBase):
     self.low_speed_lockout = False
     self.acc_type = 1
     self.newSteerActuatorDelay = 0.3
+    self.sig = None
 
   def swapBytesSigned(self, data):
     ret = ((data & 0xff) << 8) + ((data >> 8)  & 0xff)
@@ -36,12 +39,22 @@ class CarState(CarStateBase):
   def swapBytesUnsigned(self, data):
     return ((data & 0x0f) << 8) + ((data >> 8)  & 0xff)
 
+  @staticmethod
+  def get_signal_handles(cp):
+    # resolve every parsed signal once, so update() reads values without string lookups
+    return SimpleNamespace(**{sig: cp.handle(msg, sig) for sig, msg, _ in CarState.get_can_signals()
+                              if sig in cp.vl_slots[msg]})
+
   def update(self, cp, cp_cam):
     ret = car.CarState.new_message()
 
-    ret.doorOpen = any([cp.vl["DOORS_STATUS"]["DOOR_OPEN_FL"], cp.vl["DOORS_STATUS"]["DOOR_OPEN_FR"],
-                        cp.vl["DOORS_STATUS"]["DOOR_OPEN_RL"], cp.vl["DOORS_STATUS"]["DOOR_OPEN_RR"]])
-    ret.seatbeltUnlatched = cp.vl["SEATBELT_STATUS"]["SEATBELT_DRIVER_UNLATCHED"] != 0
+    if self.sig is None:
+      self.sig = self.get_signal_handles(cp)
+    sig = self.sig
+    get = cp.get
+
+    ret.doorOpen = any([get(sig.DOOR_OPEN_FL), get(sig.DOOR_OPEN_FR), get(sig.DOOR_OPEN_RL), get(sig.DOOR_OPEN_RR)])
+    ret.seatbeltUnlatched = get(sig.SEATBELT_DRIVER_UNLATCHED) != 0
 
     ret.brakePressed = False #cp.vl["BRAKE_MODULE"]["BRAKE_PRESSED"] != 0
 
@@ -58,34 +71,34 @@ class CarState(CarStateBase):
 
 
     speed_factor = 0.27/4
-    ret.wheelSpeeds.fl = self.swapBytesUnsigned(int(cp.vl["WHEEL_SPEEDS_1"]["WHEEL_SPEED_FL"])) * CV.KPH_TO_MS * speed_factor
-    ret.wheelSpeeds.fr = self.swapBytesUnsigned(int(cp.vl["WHEEL_SPEEDS_1"]["WHEEL_SPEED_FR"])) * CV.KPH_TO_MS * speed_factor
-    ret.wheelSpeeds.rl = self.swapBytesUnsigned(int(cp.vl["WHEEL_SPEEDS_1"]["WHEEL_SPEED_RL"])) * CV.KPH_TO_MS * speed_factor
-    ret.wheelSpeeds.rr = self.swapBytesUnsigned(int(cp.vl["WHEEL_SPEEDS_2"]["WHEEL_SPEED_RR"])) * CV.KPH_TO_MS * speed_factor
+    ret.wheelSpeeds.fl = self.swapBytesUnsigned(int(get(sig.WHEEL_SPEED_FL))) * CV.KPH_TO_MS * speed_factor
+    ret.wheelSpeeds.fr = self.swapBytesUnsigned(int(get(sig.WHEEL_SPEED_FR))) * CV.KPH_TO_MS * speed_factor
+    ret.wheelSpeeds.rl = self.swapBytesUnsigned(int(get(sig.WHEEL_SPEED_RL))) * CV.KPH_TO_MS * speed_factor
+    ret.wheelSpeeds.rr = self.swapBytesUnsigned(int(get(sig.WHEEL_SPEED_RR))) * CV.KPH_TO_MS * speed_factor
 
     ret.vEgoRaw = mean([ret.wheelSpeeds.fl, ret.wheelSpeeds.fr, ret.wheelSpeeds.rl, ret.wheelSpeeds.rr])
     ret.vEgo, ret.aEgo = self.update_speed_kf(ret.vEgoRaw)
 
     ret.standstill = ret.vEgoRaw < 10
 
-    sta = self.swapBytesSigned(int(cp.vl["STEER_ANGLE_SENSOR"]["STEER_ANGLE"]))
+    sta = self.swapBytesSigned(int(get(sig.STEER_ANGLE)))
     sta-=4096
     sta /= 3
     ret.steeringAngleDeg = sta
 
-    srd = self.swapBytesSigned(int(cp.vl["STEER_ANGLE_SENSOR"]["STEER_RATE"]))
+    srd = self.swapBytesSigned(int(get(sig.STEER_RATE)))
     srd -= 4096
     ret.steeringRateDeg = srd
 
-    can_gear = int(cp.vl["GEARBOX"]["GEAR_SHIFTER"])
+    can_gear = int(get(sig.GEAR_SHIFTER))
     ret.gearShifter = self.parse_gear_shifter(self.shifter_values.get(can_gear, None))
 
     # continuous blinker signals for assisted lane change
     ret.leftBlinker, ret.rightBlinker = self.update_blinker_from_lamp(
-      50, cp.vl["WARNING_SIGNALS"]["TURN_LEFT_SIGNAL"], cp.vl["WARNING_SIGNALS"]["TURN_RIGHT_SIGNAL"])
+      50, get(sig.TURN_LEFT_SIGNAL), get(sig.TURN_RIGHT_SIGNAL))
 
-    ret.steeringTorque = -cp.vl["STEER_MOMENT_SENSOR"]["STEER_MOMENT"]
-    ret.steeringTorqueEps = cp.vl["STEER_MOMENT_SENSOR"]["STEER_MOMENT_EPS"]
+    ret.steeringTorque = -get(sig.STEER_MOMENT)
+    ret.steeringTorqueEps = get(sig.STEER_MOMENT_EPS)
 
     ret.steeringTorqueEps *= ret.steeringTorque
 
@@ -97,16 +110,16 @@ class CarState(CarStateBase):
     #ret.steerWarning = False#0
 
     #ret.cruiseState.available = cp.vl["ACC_STATUS"]["CRUISE_ON"] != 0
-    ret.cruiseState.speed = cp.vl["ACC_STATUS"]["SET_SPEED"] * CV.KPH_TO_MS
+    ret.cruiseState.speed = get(sig.SET_SPEED) * CV.KPH_TO_MS
     #ret.cruiseState.enabled = bool(cp.vl["ACC_STATUS"]["CRUISE_ACTIVE"])
 
 
-    ret.cruiseState.enabled = bool(cp.vl["JOYSTICK_COMMAND"]["OP_ON"])
-    ret.cruiseState.available = bool(cp.vl["JOYSTICK_COMMAND"]["OP_ON"])
+    ret.cruiseState.enabled = bool(get(sig.OP_ON))
+    ret.cruiseState.available = bool(get(sig.OP_ON))
 
     #use to transfer steerRatioValue
-    ret.yawRate = int(cp.vl["JOYSTICK_COMMAND"]["STEER_RATIO_VAL"])/10
-    ret.newSteerActuatorDelay = int(cp.vl["JOYSTICK_COMMAND"]["ACTUATOR_DELAY_VAL"])/500
+    ret.yawRate = int(get(sig.STEER_RATIO_VAL))/10
+    ret.newSteerActuatorDelay = int(get(sig.ACTUATOR_DELAY_VAL))/500
 
     #print ("ACTUATOR_DELAY_VAL %d %d" % (ret.newSteerActuatorDelay, ret.yawRate))
     #print (ret.newSteerActuatorDelay)
@@ -124,8 +137,8 @@ class CarState(CarStateBase):
     return ret
 
   @staticmethod
-  def get_can_parser(CP):
-    signals = [
+  def get_can_signals():
+    return [
       # sig_name, sig_address
       ("DOOR_OPEN_FL", "DOORS_STATUS", 0),
       ("DOOR_OPEN_FR", "DOORS_STATUS", 0),
@@ -163,6 +176,10 @@ class CarState(CarStateBase):
       ("ACTUATOR_DELAY_VAL", "JOYSTICK_COMMAND", 0),
     ]
 
+  @staticmethod
+  def get_can_parser(CP):
+    signals = CarState.get_can_signals()
+
     checks = [
       ("DOORS_STATUS", 1),
       ("SEATBELT_STATUS", 1),
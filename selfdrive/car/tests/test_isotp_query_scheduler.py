@@ -0,0 +1,163 @@
+#!/usr/bin/env python3
+import struct
+import threading
+import time
+import unittest
+
+import cereal.messaging as messaging
+from selfdrive.boardd.boardd import can_list_to_can_capnp, can_strings_to_can_list
+from selfdrive.car.fw_versions import SHORT_TESTER_PRESENT_REQUEST, SHORT_TESTER_PRESENT_RESPONSE, \
+                                      TOYOTA_VERSION_REQUEST, TOYOTA_VERSION_RESPONSE, \
+                                      UDS_VERSION_REQUEST, UDS_VERSION_RESPONSE
+from selfdrive.car.isotp_parallel_query import IsoTpQueryScheduler
+
+TOYOTA_REQUEST = [SHORT_TESTER_PRESENT_REQUEST, TOYOTA_VERSION_REQUEST]
+TOYOTA_RESPONSE = [SHORT_TESTER_PRESENT_RESPONSE, TOYOTA_VERSION_RESPONSE]
+
+
+class SimulatedEcus(threading.Thread):
+  """ISO-TP responders on the other end of the sendcan and can sockets, like a car behind boardd.
+  ecus maps (bus, tx_addr, sub_addr) to a dict of responses by request. ECUs answer at tx_addr + 8,
+  delays maps (bus, tx_addr, sub_addr, request) to how long the ECU takes to answer it."""
+  def __init__(self, ecus, delays=None):
+    super().__init__(daemon=True)
+    self.ecus = ecus
+    self.delays = delays or {}
+    self.delayed = []
+    self.requests = []
+    self.pending_frames = {}
+    self.exit_event = threading.Event()
+
+    self.sendcan = messaging.sub_sock('sendcan', timeout=10)
+    self.can = messaging.pub_sock('can')
+
+  def _send(self, bus, tx_addr, sub_addr, frames):
+    prefix = b"" if sub_addr is None else bytes([sub_addr])
+    self.can.send(can_list_to_can_capnp([[tx_addr + 8, 0, prefix + f, bus] for f in frames]))
+
+  def _rx(self, address, dat, bus):
+    if (bus, address, None) in self.ecus:
+      sub_addr = None
+    elif len(dat) and (bus, address, dat[0]) in self.ecus:
+      sub_addr, dat = dat[0], dat[1:]
+    else:
+      return
+
+    key = (bus, address, sub_addr)
+    max_len = 8 if sub_addr is None else 7
+    frame_type = dat[0] >> 4
+    if frame_type == 0x0:
+      request = bytes(dat[1:1 + (dat[0] & 0xF)])
+      self.requests.append((key, request))
+      response = self.ecus[key].get(request)
+      if response is None:
+        return
+
+      if key + (request,) in self.delays:
+        self.delayed.append((time.monotonic() + self.delays[key + (request,)], bus, address, sub_addr,
+                             [(bytes([len(response)]) + response).ljust(max_len, b"\x00")]))
+      elif len(response) < max_len:
+        self._send(bus, address, sub_addr, [(bytes([len(response)]) + response).ljust(max_len, b"\x00")])
+      else:
+        self._send(bus, address, sub_addr, [struct.pack("!H", 0x1000 | len(response)) + response[:max_len - 2]])
+        self.pending_frames[key] = response[max_len - 2:]
+    elif frame_type == 0x3 and key in self.pending_frames:
+      remaining = self.pending_frames.pop(key)
+      frames = []
+      for i in range(0, len(remaining), max_len - 1):
+        idx = i // (max_len - 1) + 1
+        frames.append((bytes([0x20 | (idx & 0xF)]) + remaining[i:i + max_len - 1]).ljust(max_len, b"\x00"))
+      self._send(bus, address, sub_addr, frames)
+
+  def run(self):
+    while not self.exit_event.is_set():
+      for address, _, dat, bus in can_strings_to_can_list(messaging.drain_sock_raw(self.sendcan), msgtype='sendcan'):
+        self._rx(address, dat, bus)
+
+      for d in [d for d in self.delayed if d[0] < time.monotonic()]:
+        self.delayed.remove(d)
+        self._send(*d[1:])
+
+      # like a panda, keep can events coming when the bus is quiet
+      self.can.send(can_list_to_can_capnp([]))
+      time.sleep(0.005)
+
+  def stop(self):
+    self.exit_event.set()
+    self.join()
+
+
+class TestIsoTpQueryScheduler(unittest.TestCase):
+  def _run(self, ecus, queries, total_timeout=10., delays=None, max_in_flight=128):
+    sim = SimulatedEcus(ecus, delays)
+    sendcan = messaging.pub_sock('sendcan')
+    logcan = messaging.sub_sock('can', timeout=1000)
+    time.sleep(0.5)  # let the sockets connect
+
+    sim.start()
+    try:
+      scheduler = IsoTpQueryScheduler(sendcan, logcan, max_in_flight=max_in_flight)
+      for q in queries:
+        scheduler.add_query(*q)
+      t = time.monotonic()
+      results = scheduler.run(total_timeout)
+      return results, time.monotonic() - t, sim.requests
+    finally:
+      sim.stop()
+
+  def test_request_chain(self):
+    version = b"\x01896630E41200\x00\x00\x00\x00"
+    ecus = {(0, 0x7e0, None): {SHORT_TESTER_PRESENT_REQUEST: SHORT_TESTER_PRESENT_RESPONSE,
+                               TOYOTA_VERSION_REQUEST: TOYOTA_VERSION_RESPONSE + version}}
+    results, _, _ = self._run(ecus, [(0, [0x7e0], TOYOTA_REQUEST, TOYOTA_RESPONSE)])
+    self.assertEqual(results, [{(0x7e0, None): version}])
+
+  def test_buses_and_sub_addrs(self):
+    ecus = {
+      (0, 0x7e0, None): {UDS_VERSION_REQUEST: UDS_VERSION_RESPONSE + b"bus0"},
+      (1, 0x7e0, None): {UDS_VERSION_REQUEST: UDS_VERSION_RESPONSE + b"bus1"},
+      (1, 0x750, 0xf): {SHORT_TESTER_PRESENT_REQUEST: SHORT_TESTER_PRESENT_RESPONSE,
+                        TOYOTA_VERSION_REQUEST: TOYOTA_VERSION_RESPONSE + b"sub f"},
+      (1, 0x750, 0x6d): {SHORT_TESTER_PRESENT_REQUEST: SHORT_TESTER_PRESENT_RESPONSE,
+                         TOYOTA_VERSION_REQUEST: TOYOTA_VERSION_RESPONSE + b"sub 6d"},
+    }
+    queries = [
+      (0, [0x7e0], [UDS_VERSION_REQUEST], [UDS_VERSION_RESPONSE]),
+      (1, [0x7e0], [UDS_VERSION_REQUEST], [UDS_VERSION_RESPONSE]),
+      (1, [(0x750, 0xf)], TOYOTA_REQUEST, TOYOTA_RESPONSE),
+      (1, [(0x750, 0x6d)], TOYOTA_REQUEST, TOYOTA_RESPONSE),
+    ]
+    results, _, requests = self._run(ecus, queries)
+    self.assertEqual(results, [{(0x7e0, None): b"bus0"}, {(0x7e0, None): b"bus1"},
+                               {(0x750, 0xf): b"sub f"}, {(0x750, 0x6d): b"sub 6d"}])
+
+    # the ECUs behind 0x750 are queried one after another, in order
+    sub_addr_requests = [key[2] for key, _ in requests if key[1] == 0x750]
+    self.assertEqual(sub_addr_requests, [0xf, 0xf, 0x6d, 0x6d])
+
+  def test_missing_ecus(self):
+    ecus = {(1, 0x7e0, None): {UDS_VERSION_REQUEST: UDS_VERSION_RESPONSE + b"engine"}}
+    timeout = 0.1
+    queries = [(1, [0x7e0] + list(range(0x700, 0x7e0, 0x10)), [UDS_VERSION_REQUEST], [UDS_VERSION_RESPONSE], 0x8, timeout)] * 3
+    results, duration, _ = self._run(ecus, queries)
+    self.assertEqual(results, [{(0x7e0, None): b"engine"}] * 3)
+
+    # silent ECUs are waited on concurrently, the three queries to each take about 3 timeouts
+    self.assertLess(duration, 3 * timeout + 0.5)
+
+  def test_late_response(self):
+    # the engine answers the first query after it timed out, while it waits for the transmission query to finish
+    ecus = {(0, 0x7e0, None): {TOYOTA_VERSION_REQUEST: TOYOTA_VERSION_RESPONSE + b"late",
+                               UDS_VERSION_REQUEST: UDS_VERSION_RESPONSE + b"engine"}}
+    delays = {(0, 0x7e0, None, TOYOTA_VERSION_REQUEST): 0.15}
+    queries = [
+      (0, [0x7e0], [TOYOTA_VERSION_REQUEST], [TOYOTA_VERSION_RESPONSE], 0x8, 0.1),
+      (0, [0x7e1], [UDS_VERSION_REQUEST], [UDS_VERSION_RESPONSE], 0x8, 0.1),
+      (0, [0x7e0], [UDS_VERSION_REQUEST], [UDS_VERSION_RESPONSE], 0x8, 0.1),
+    ]
+    results, _, _ = self._run(ecus, queries, delays=delays, max_in_flight=1)
+    self.assertEqual(results, [{}, {}, {(0x7e0, None): b"engine"}])
+
+
+if __name__ == "__main__":
+  unittest.main()
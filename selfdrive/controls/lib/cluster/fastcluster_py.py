@@ -19,10 +19,12 @@ hclust = ffi.dlopen(cluster_fn)
 
 
 def cluster_points_centroid(pts, dist):
+  """Clusters the rows of an (n, m) array of points, returns an array of cluster labels"""
   pts = np.ascontiguousarray(pts, dtype=np.float64)
-  pts_ptr = ffi.cast("double *", pts.ctypes.data)
   n, m = pts.shape
 
-  labels_ptr = ffi.new("int[]", n)
-  hclust.cluster_points_centroid(n, m, pts_ptr, dist**2, labels_ptr)
-  return list(labels_ptr)
+  # hclust hangs forever on a single point
+  labels = np.zeros(n, dtype=np.int32)
+  if n > 1:
+    hclust.cluster_points_centroid(n, m, ffi.cast("double *", pts.ctypes.data), dist**2, ffi.cast("int *", labels.ctypes.data))
+  return labels
@@ -1,4 +1,6 @@
 import math
+import numpy as np
+
 from cereal import car
 from common.numpy_fast import clip, interp
 from common.realtime import DT_MDL
@@ -16,6 +18,9 @@ LON_MPC_N = 32
 CONTROL_N = 17
 CAR_ROTATION_RADIUS = 0.0
 
+# upper edges in seconds of the MPC solver time histogram buckets, the last bucket has no upper edge
+MPC_TIME_BUCKETS = np.array([0.0002, 0.0005, 0.001, 0.002, 0.005, 0.01, 0.02, 0.05])
+
 # EU guidelines
 MAX_LATERAL_JERK = 5.0
 
@@ -112,3 +117,59 @@ def get_lag_adjusted_curvature(CP, v_ego, psis, curvatures, curvature_rates):
                                      current_curvature + max_curvature_rate * DT_MDL)
 
   return safe_desired_curvature, safe_desired_curvature_rate
+
+
+def shift_trajectory(t_idxs, traj, dt=DT_MDL, pose_idxs=()):
+  """Moves a (len(t_idxs), n) trajectory dt forward in time, holding its last value,
+  so the previous MPC solution can be used as the initial guess of the next run.
+
+  pose_idxs are the columns of states measured from the ego pose, which x0 resets every run:
+  (x,) or (x, y, psi). They are moved into the frame of the shifted first state."""
+  t_idxs = np.asarray(t_idxs)
+  ret = np.column_stack([np.interp(t_idxs + dt, t_idxs, traj[:, i]) for i in range(traj.shape[1])])
+
+  if len(pose_idxs) == 1:
+    ret[:, pose_idxs[0]] -= ret[0, pose_idxs[0]]
+  elif len(pose_idxs) == 3:
+    x, y, psi = pose_idxs
+    dx, dy, psi0 = ret[:, x] - ret[0, x], ret[:, y] - ret[0, y], ret[0, psi]
+    ret[:, x] = np.cos(psi0) * dx + np.sin(psi0) * dy
+    ret[:, y] = -np.sin(psi0) * dx + np.cos(psi0) * dy
+    ret[:, psi] -= psi0
+  return ret
+
+
+class MpcSolverStats:
+  """Iteration counts and timings of the last MPC run, with histograms of the timings of every run."""
+  def __init__(self):
+    self.warm_start = False
+    self.sqp_iter = 0
+    self.qp_iter = 0
+    self.solve_time = 0.0
+    self.time_qp_solution = 0.0
+    self.time_linearization = 0.0
+    self.solve_time_hist = np.zeros(len(MPC_TIME_BUCKETS) + 1, dtype=np.uint32)
+    self.qp_solution_time_hist = np.zeros_like(self.solve_time_hist)
+    self.linearization_time_hist = np.zeros_like(self.solve_time_hist)
+
+  def update(self, solver, warm_start):
+    self.warm_start = warm_start
+    self.sqp_iter = int(solver.get_stats('sqp_iter'))
+    self.qp_iter = int(np.sum(solver.get_stats('qp_iter')))
+    self.solve_time = float(solver.get_stats('time_tot')[0])
+    self.time_qp_solution = float(solver.get_stats('time_qp')[0])
+    self.time_linearization = float(solver.get_stats('time_lin')[0])
+
+    self.solve_time_hist[np.searchsorted(MPC_TIME_BUCKETS, self.solve_time)] += 1
+    self.qp_solution_time_hist[np.searchsorted(MPC_TIME_BUCKETS, self.time_qp_solution)] += 1
+    self.linearization_time_hist[np.searchsorted(MPC_TIME_BUCKETS, self.time_linearization)] += 1
+
+  def to_msg(self, msg):
+    msg.warmStart = self.warm_start
+    msg.sqpIterations = self.sqp_iter
+    msg.qpIterations = self.qp_iter
+    msg.timeQpSolution = self.time_qp_solution
+    msg.timeLinearization = self.time_linearization
+    msg.solveTimeHistogram = self.solve_time_hist.tolist()
+    msg.qpSolutionTimeHistogram = self.qp_solution_time_hist.tolist()
+    msg.linearizationTimeHistogram = self.linearization_time_hist.tolist()
@@ -1,6 +1,7 @@
 ﻿import os
+from collections import defaultdict
 from enum import IntEnum
-from typing import Dict, Union, Callable, List, Optional
+from typing import Dict, Union, Callable, List, Optional, Tuple
 
 from cereal import log, car
 import cereal.messaging as messaging
@@ -47,7 +48,11 @@ class Events:
   def __init__(self):
     self.events: List[int] = []
     self.static_events: List[int] = []
-    self.events_prev = dict.fromkeys(EVENTS.keys(), 0)
+    # bitsets of the events above, indexed by event name
+    self.event_mask = 0
+    self.static_event_mask = 0
+    # number of consecutive frames each event of the previous frame has been active
+    self.events_prev: Dict[int, int] = {}
 
   @property
   def names(self) -> List[int]:
@@ -59,14 +64,17 @@ class Events:
   def add(self, event_name: int, static: bool=False) -> None:
     if static:
       self.static_events.append(event_name)
+      self.static_event_mask |= 1 << event_name
     self.events.append(event_name)
+    self.event_mask |= 1 << event_name
 
   def clear(self) -> None:
-    self.events_prev = {k: (v + 1 if k in self.events else 0) for k, v in self.events_prev.items()}
+    self.events_prev = {e: self.events_prev.get(e, 0) + 1 for e in self.events}
     self.events = self.static_events.copy()
+    self.event_mask = self.static_event_mask
 
   def any(self, event_type: str) -> bool:
-    return any(event_type in EVENTS.get(e, {}) for e in self.events)
+    return bool(self.event_mask & EVENT_TYPE_MASKS.get(event_type, 0))
 
   def create_alerts(self, event_types: List[str], callback_args=None):
     if callback_args is None:
@@ -74,32 +82,25 @@ class Events:
 
     ret = []
     for e in self.events:
-      types = EVENTS[e].keys()
+      alerts = EVENTS[e]
       for et in event_types:
-        if et in types:
-          alert = EVENTS[e][et]
+        alert = alerts.get(et)
+        if alert is not None:
           if not isinstance(alert, Alert):
             alert = alert(*callback_args)
 
-          if DT_CTRL * (self.events_prev[e] + 1) >= alert.creation_delay:
-            alert.alert_type = f"{EVENT_NAME[e]}/{et}"
+          if DT_CTRL * (self.events_prev.get(e, 0) + 1) >= alert.creation_delay:
+            alert.alert_type = ALERT_TYPES[(e, et)]
             alert.event_type = et
             ret.append(alert)
     return ret
 
   def add_from_msg(self, events):
     for e in events:
-      self.events.append(e.name.raw)
+      self.add(e.name.raw)
 
   def to_msg(self):
-    ret = []
-    for event_name in self.events:
-      event = car.CarEvent.new_message()
-      event.name = event_name
-      for event_type in EVENTS.get(event_name, {}):
-        setattr(event, event_type, True)
-      ret.append(event)
-    return ret
+    return [get_event_msg(event_name) for event_name in self.events]
 
 
 class Alert:
@@ -842,3 +843,30 @@ EVENTS: Dict[int, Dict[str, Union[Alert, AlertCallbackType]]] = {
   },
 
 }
+
+
+def build_event_type_masks():
+  # bitsets of the events that have an alert of each event type
+  masks: Dict[str, int] = defaultdict(int)
+  for e, alerts in EVENTS.items():
+    for et in alerts:
+      masks[et] |= 1 << e
+  return dict(masks)
+
+
+EVENT_TYPE_MASKS = build_event_type_masks()
+ALERT_TYPES: Dict[Tuple[int, str], str] = {(e, et): f"{EVENT_NAME[e]}/{et}" for e, alerts in EVENTS.items() for et in alerts}
+
+EVENT_MSGS: Dict[int, car.CarEvent] = {}
+
+
+def get_event_msg(event_name: int) -> car.CarEvent:
+  """Returns a read-only CarEvent for an event name, these are built once and reused."""
+  msg = EVENT_MSGS.get(event_name)
+  if msg is None:
+    event = car.CarEvent.new_message()
+    event.name = event_name
+    for event_type in EVENTS.get(event_name, {}):
+      setattr(event, event_type, True)
+    msg = EVENT_MSGS[event_name] = event.as_reader()
+  return msg
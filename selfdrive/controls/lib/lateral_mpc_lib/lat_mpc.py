@@ -6,6 +6,7 @@ from casadi import SX, vertcat, sin, cos
 
 from common.realtime import sec_since_boot
 from selfdrive.controls.lib.drive_helpers import LAT_MPC_N as N
+from selfdrive.controls.lib.drive_helpers import MpcSolverStats, shift_trajectory
 from selfdrive.modeld.constants import T_IDXS
 
 if __name__ == '__main__':  # generating code
@@ -18,6 +19,7 @@ EXPORT_DIR = os.path.join(LAT_MPC_DIR, "c_generated_code")
 JSON_FILE = os.path.join(LAT_MPC_DIR, "acados_ocp_lat.json")
 X_DIM = 4
 P_DIM = 2
+LAT_T_IDXS = np.array(T_IDXS[:N+1])
 MODEL_NAME = 'lat'
 ACADOS_SOLVER_TYPE = 'SQP_RTI'
 
@@ -110,34 +112,38 @@ def gen_lat_ocp():
 
   # set prediction horizon
   ocp.solver_options.tf = Tf
-  ocp.solver_options.shooting_nodes = np.array(T_IDXS)[:N+1]
+  ocp.solver_options.shooting_nodes = LAT_T_IDXS
 
   ocp.code_export_directory = EXPORT_DIR
   return ocp
 
 
 class LateralMpc():
-  def __init__(self, x0=np.zeros(X_DIM)):
+  def __init__(self, x0=np.zeros(X_DIM), warm_start=True):
+    self.warm_start = warm_start
     self.solver = AcadosOcpSolverCython(MODEL_NAME, ACADOS_SOLVER_TYPE, N)
+    self.stats = MpcSolverStats()
     self.reset(x0)
 
   def reset(self, x0=np.zeros(X_DIM)):
     self.x_sol = np.zeros((N+1, X_DIM))
     self.u_sol = np.zeros((N, 1))
     self.yref = np.zeros((N+1, 3))
-    for i in range(N):
-      self.solver.cost_set(i, "yref", self.yref[i])
-    self.solver.cost_set(N, "yref", self.yref[N][:2])
+    self.params = np.zeros((N+1, P_DIM))
+    self.solver.set_all("yref", self.yref)
 
     # Somehow needed for stable init
-    for i in range(N+1):
-      self.solver.set(i, 'x', np.zeros(X_DIM))
-      self.solver.set(i, 'p', np.zeros(P_DIM))
+    self.solver.set_all('x', self.x_sol)
+    self.solver.set_all('p', self.params)
     self.solver.constraints_set(0, "lbx", x0)
     self.solver.constraints_set(0, "ubx", x0)
     self.solver.solve()
+    # x_sol and u_sol hold a solution that can be shifted into the initial guess
+    self.solution_valid = False
     self.solution_status = 0
     self.solve_time = 0.0
+    self.time_qp_solution = 0.0
+    self.time_linearization = 0.0
     self.cost = 0
 
   def set_weights(self, path_weight, heading_weight, steer_rate_weight):
@@ -156,21 +162,28 @@ class LateralMpc():
     v_ego = p_cp[0]
     # rotation_radius = p_cp[1]
     self.yref[:,1] = heading_pts*(v_ego+5.0)
-    for i in range(N):
-      self.solver.cost_set(i, "yref", self.yref[i])
-      self.solver.set(i, "p", p_cp)
-    self.solver.set(N, "p", p_cp)
-    self.solver.cost_set(N, "yref", self.yref[N][:2])
+    self.params[:] = p_cp
+    # the terminal cost only uses the first 2 values of its row
+    self.solver.set_all("yref", self.yref)
+    self.solver.set_all("p", self.params)
+
+    # start from the previous solution, one DT_MDL later. Like x0, x_ego, y_ego and psi_ego start at 0 again
+    warm_start = self.warm_start and self.solution_valid
+    if warm_start:
+      self.solver.set_all('x', shift_trajectory(LAT_T_IDXS, self.x_sol, pose_idxs=(0, 1, 2)))
+      self.solver.set_all('u', shift_trajectory(LAT_T_IDXS[:-1], self.u_sol))
 
     t = sec_since_boot()
     self.solution_status = self.solver.solve()
     self.solve_time = sec_since_boot() - t
+    self.stats.update(self.solver, warm_start)
+    self.time_qp_solution = self.stats.time_qp_solution
+    self.time_linearization = self.stats.time_linearization
 
-    for i in range(N+1):
-      self.x_sol[i] = self.solver.get(i, 'x')
-    for i in range(N):
-      self.u_sol[i] = self.solver.get(i, 'u')
+    self.solver.get_all('x', self.x_sol)
+    self.solver.get_all('u', self.u_sol)
     self.cost = self.solver.get_cost()
+    self.solution_valid = self.solution_status == 0
 
 
 if __name__ == "__main__":
@@ -115,6 +115,7 @@ class LateralPlanner:
 
     lateralPlan.mpcSolutionValid = bool(plan_solution_valid)
     lateralPlan.solverExecutionTime = self.lat_mpc.solve_time
+    self.lat_mpc.stats.to_msg(lateralPlan.solverStats)
 
     lateralPlan.desire = self.DH.desire
     lateralPlan.useLaneLines = self.use_lanelines
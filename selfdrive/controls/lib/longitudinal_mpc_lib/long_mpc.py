@@ -5,6 +5,7 @@ import numpy as np
 from common.realtime import sec_since_boot
 from common.numpy_fast import clip, interp
 from selfdrive.swaglog import cloudlog
+from selfdrive.controls.lib.drive_helpers import MpcSolverStats, shift_trajectory
 from selfdrive.modeld.constants import index_function
 from selfdrive.controls.lib.radar_helpers import _LEAD_ACCEL_TAU
 
@@ -190,9 +191,11 @@ def gen_long_ocp():
 
 
 class LongitudinalMpc:
-  def __init__(self, e2e=False):
+  def __init__(self, e2e=False, warm_start=True):
     self.e2e = e2e
+    self.warm_start = warm_start
     self.solver = AcadosOcpSolverCython(MODEL_NAME, ACADOS_SOLVER_TYPE, N)
+    self.stats = MpcSolverStats()
     self.reset()
     self.source = SOURCES[2]
 
@@ -205,14 +208,13 @@ class LongitudinalMpc:
     self.prev_a = np.array(self.a_solution)
     self.j_solution = np.zeros(N)
     self.yref = np.zeros((N+1, COST_DIM))
-    for i in range(N):
-      self.solver.cost_set(i, "yref", self.yref[i])
-    self.solver.cost_set(N, "yref", self.yref[N][:COST_E_DIM])
+    self.solver.set_all("yref", self.yref)
     self.x_sol = np.zeros((N+1, X_DIM))
     self.u_sol = np.zeros((N,1))
     self.params = np.zeros((N+1, PARAM_DIM))
-    for i in range(N+1):
-      self.solver.set(i, 'x', np.zeros(X_DIM))
+    self.solver.set_all('x', self.x_sol)
+    # x_sol and u_sol hold a solution that can be shifted into the initial guess
+    self.solution_valid = False
     self.last_cloudlog_t = 0
     self.status = False
     self.crash_cnt = 0.0
@@ -268,8 +270,8 @@ class LongitudinalMpc:
     self.x0[1] = v
     self.x0[2] = a
     if abs(v_prev - v) > 2.: # probably only helps if v < v_prev
-      for i in range(0, N+1):
-        self.solver.set(i, 'x', self.x0)
+      self.solver.set_all('x', np.tile(self.x0, (N+1, 1)))
+      self.solution_valid = False
 
   @staticmethod
   def extrapolate_lead(x_lead, v_lead, a_lead, a_lead_tau):
@@ -348,42 +350,45 @@ class LongitudinalMpc:
     self.yref[:,1] = x
     self.yref[:,2] = v
     self.yref[:,3] = a
-    for i in range(N):
-      self.solver.cost_set(i, "yref", self.yref[i])
-    self.solver.cost_set(N, "yref", self.yref[N][:COST_E_DIM])
+    # the terminal cost only uses the first COST_E_DIM values of its row
+    self.solver.set_all("yref", self.yref)
     self.params[:,3] = np.copy(self.prev_a)
     self.run()
 
   def run(self):
     # t0 = sec_since_boot()
     # reset = 0
-    for i in range(N+1):
-      self.solver.set(i, 'p', self.params[i])
+    self.solver.set_all('p', self.params)
     self.solver.constraints_set(0, "lbx", self.x0)
     self.solver.constraints_set(0, "ubx", self.x0)
 
+    # start from the previous solution, one DT_MDL later. Like x0, x_ego starts at 0 again
+    warm_start = self.warm_start and self.solution_valid
+    if warm_start:
+      self.solver.set_all('x', shift_trajectory(T_IDXS, self.x_sol, pose_idxs=(0,)))
+      self.solver.set_all('u', shift_trajectory(T_IDXS[:-1], self.u_sol))
+
     self.solution_status = self.solver.solve()
-    self.solve_time = float(self.solver.get_stats('time_tot')[0])
-    self.time_qp_solution = float(self.solver.get_stats('time_qp')[0])
-    self.time_linearization = float(self.solver.get_stats('time_lin')[0])
+    self.stats.update(self.solver, warm_start)
+    self.solve_time = self.stats.solve_time
+    self.time_qp_solution = self.stats.time_qp_solution
+    self.time_linearization = self.stats.time_linearization
     self.time_integrator = float(self.solver.get_stats('time_sim')[0])
 
-    # qp_iter = self.solver.get_stats('statistics')[-1][-1] # SQP_RTI specific
-    # print(f"long_mpc timings: tot {self.solve_time:.2e}, qp {self.time_qp_solution:.2e}, lin {self.time_linearization:.2e}, integrator {self.time_integrator:.2e}, qp_iter {qp_iter}")
+    # print(f"long_mpc timings: tot {self.solve_time:.2e}, qp {self.time_qp_solution:.2e}, lin {self.time_linearization:.2e}, integrator {self.time_integrator:.2e}, qp_iter {self.stats.qp_iter}")
     # res = self.solver.get_residuals()
     # print(f"long_mpc residuals: {res[0]:.2e}, {res[1]:.2e}, {res[2]:.2e}, {res[3]:.2e}")
     # self.solver.print_statistics()
 
-    for i in range(N+1):
-      self.x_sol[i] = self.solver.get(i, 'x')
-    for i in range(N):
-      self.u_sol[i] = self.solver.get(i, 'u')
+    self.solver.get_all('x', self.x_sol)
+    self.solver.get_all('u', self.u_sol)
 
     self.v_solution = self.x_sol[:,1]
     self.a_solution = self.x_sol[:,2]
     self.j_solution = self.u_sol[:,0]
 
     self.prev_a = np.interp(T_IDXS + 0.05, T_IDXS, self.a_solution)
+    self.solution_valid = self.solution_status == 0
 
     t = sec_since_boot()
     if self.solution_status != 0:
@@ -392,7 +397,7 @@ class LongitudinalMpc:
         cloudlog.warning(f"Long mpc reset, solution_status: {self.solution_status}")
       self.reset()
       # reset = 1
-    # print(f"long_mpc timings: total internal {self.solve_time:.2e}, external: {(sec_since_boot() - t0):.2e} qp {self.time_qp_solution:.2e}, lin {self.time_linearization:.2e} qp_iter {qp_iter}, reset {reset}")
+    # print(f"long_mpc timings: total internal {self.solve_time:.2e}, external: {(sec_since_boot() - t0):.2e} qp {self.time_qp_solution:.2e}, lin {self.time_linearization:.2e} qp_iter {self.stats.qp_iter}, reset {reset}")
 
 
 if __name__ == "__main__":
@@ -129,5 +129,6 @@ class Planner:
     longitudinalPlan.fcw = self.fcw
 
     longitudinalPlan.solverExecutionTime = self.mpc.solve_time
+    self.mpc.stats.to_msg(longitudinalPlan.solverStats)
 
     pm.send('longitudinalPlan', plan_send)
@@ -1,5 +1,4 @@
-from common.numpy_fast import mean
-from common.kalman.simple_kalman import KF1D
+import numpy as np
 
 
 # the longer lead decels, the more likely it will keep decelerating
@@ -15,106 +14,88 @@ v_ego_stationary = 4.   # no stationary object flag below this speed
 RADAR_TO_CENTER = 2.7   # (deprecated) RADAR is ~ 2.7m ahead from center of car
 RADAR_TO_CAMERA = 1.52   # RADAR is ~ 1.5m ahead from center of mesh frame
 
-class Track():
-  def __init__(self, v_lead, kalman_params):
-    self.cnt = 0
-    self.aLeadTau = _LEAD_ACCEL_TAU
-    self.K_A = kalman_params.A
-    self.K_C = kalman_params.C
-    self.K_K = kalman_params.K
-    self.kf = KF1D([[v_lead], [0.0]], self.K_A, self.K_C, self.K_K)
-
-  def update(self, d_rel, y_rel, v_rel, v_lead, measured):
-    # relative values, copy
-    self.dRel = d_rel   # LONG_DIST
-    self.yRel = y_rel   # -LAT_DIST
-    self.vRel = v_rel   # REL_SPEED
+class Tracks():
+  """All radar tracks as arrays sorted by track id. The Kalman filters of the
+  tracks share their gain, so they are all updated at once."""
+  def __init__(self, kalman_params):
+    A, C, K = kalman_params.A, kalman_params.C, kalman_params.K
+    self.K0, self.K1 = K[0][0], K[1][0]
+    self.A_K = [[A[0][0] - self.K0 * C[0], A[0][1] - self.K0 * C[1]],
+                [A[1][0] - self.K1 * C[0], A[1][1] - self.K1 * C[1]]]
+
+    self.ids = np.zeros(0, dtype=np.int64)
+    self.dRel = np.zeros(0)      # LONG_DIST
+    self.yRel = np.zeros(0)      # -LAT_DIST
+    self.vRel = np.zeros(0)      # REL_SPEED
+    self.vLead = np.zeros(0)
+    self.measured = np.zeros(0, dtype=bool)  # measured or estimate
+    self.x = np.zeros((0, 2))    # Kalman filter states
+    self.vLeadK = np.zeros(0)
+    self.aLeadK = np.zeros(0)
+    self.aLeadTau = np.zeros(0)
+    self.cnt = np.zeros(0, dtype=np.int64)
+
+  def __len__(self):
+    return len(self.ids)
+
+  def update(self, ids, d_rel, y_rel, v_rel, v_lead, measured):
+    """Replaces the tracks with the given points, which are sorted by track id. Tracks
+    that are still around keep their filter state, missing ones are removed."""
+    x = np.zeros((len(ids), 2))
+    x[:, SPEED] = v_lead
+    cnt = np.zeros(len(ids), dtype=np.int64)
+    a_lead_tau = np.full(len(ids), _LEAD_ACCEL_TAU)
+
+    idxs = np.searchsorted(self.ids, ids)
+    existing = idxs < len(self.ids)
+    existing[existing] = self.ids[idxs[existing]] == ids[existing]
+    x[existing] = self.x[idxs[existing]]
+    cnt[existing] = self.cnt[idxs[existing]]
+    a_lead_tau[existing] = self.aLeadTau[idxs[existing]]
+
+    self.ids = ids
+    self.dRel = d_rel
+    self.yRel = y_rel
+    self.vRel = v_rel
     self.vLead = v_lead
-    self.measured = measured   # measured or estimate
+    self.measured = measured
 
     # computed velocity and accelerations
-    if self.cnt > 0:
-      self.kf.update(self.vLead)
+    upd = cnt > 0
+    x0, x1, meas = x[upd, SPEED], x[upd, ACCEL], v_lead[upd]
+    x[upd, SPEED] = self.A_K[0][0] * x0 + self.A_K[0][1] * x1 + self.K0 * meas
+    x[upd, ACCEL] = self.A_K[1][0] * x0 + self.A_K[1][1] * x1 + self.K1 * meas
+    self.x = x
 
-    self.vLeadK = float(self.kf.x[SPEED][0])
-    self.aLeadK = float(self.kf.x[ACCEL][0])
+    self.vLeadK = x[:, SPEED].copy()
+    self.aLeadK = x[:, ACCEL].copy()
 
     # Learn if constant acceleration
-    if abs(self.aLeadK) < 0.5:
-      self.aLeadTau = _LEAD_ACCEL_TAU
-    else:
-      self.aLeadTau *= 0.9
+    self.aLeadTau = np.where(np.abs(self.aLeadK) < 0.5, _LEAD_ACCEL_TAU, a_lead_tau * 0.9)
 
-    self.cnt += 1
+    self.cnt = cnt + 1
 
-  def get_key_for_cluster(self):
+  def get_keys_for_cluster(self):
     # Weigh y higher since radar is inaccurate in this dimension
-    return [self.dRel, self.yRel*2, self.vRel]
+    return np.column_stack((self.dRel, self.yRel*2, self.vRel))
 
-  def reset_a_lead(self, aLeadK, aLeadTau):
-    self.kf = KF1D([[self.vLead], [aLeadK]], self.K_A, self.K_C, self.K_K)
-    self.aLeadK = aLeadK
-    self.aLeadTau = aLeadTau
+  def reset_a_lead(self, idxs, aLeadK, aLeadTau):
+    self.x[idxs, SPEED] = self.vLead[idxs]
+    self.x[idxs, ACCEL] = aLeadK
+    self.aLeadK[idxs] = aLeadK
+    self.aLeadTau[idxs] = aLeadTau
 
 
 class Cluster():
-  def __init__(self):
-    self.tracks = set()
-
-  def add(self, t):
-    # add the first track
-    self.tracks.add(t)
-
-  # TODO: make generic
-  @property
-  def dRel(self):
-    return mean([t.dRel for t in self.tracks])
-
-  @property
-  def yRel(self):
-    return mean([t.yRel for t in self.tracks])
-
-  @property
-  def vRel(self):
-    return mean([t.vRel for t in self.tracks])
-
-  @property
-  def aRel(self):
-    return mean([t.aRel for t in self.tracks])
-
-  @property
-  def vLead(self):
-    return mean([t.vLead for t in self.tracks])
-
-  @property
-  def dPath(self):
-    return mean([t.dPath for t in self.tracks])
-
-  @property
-  def vLat(self):
-    return mean([t.vLat for t in self.tracks])
-
-  @property
-  def vLeadK(self):
-    return mean([t.vLeadK for t in self.tracks])
-
-  @property
-  def aLeadK(self):
-    if all(t.cnt <= 1 for t in self.tracks):
-      return 0.
-    else:
-      return mean([t.aLeadK for t in self.tracks if t.cnt > 1])
-
-  @property
-  def aLeadTau(self):
-    if all(t.cnt <= 1 for t in self.tracks):
-      return _LEAD_ACCEL_TAU
-    else:
-      return mean([t.aLeadTau for t in self.tracks if t.cnt > 1])
-
-  @property
-  def measured(self):
-    return any(t.measured for t in self.tracks)
+  def __init__(self, dRel=0., yRel=0., vRel=0., vLead=0., vLeadK=0., aLeadK=0., aLeadTau=_LEAD_ACCEL_TAU, measured=False):
+    self.dRel = dRel
+    self.yRel = yRel
+    self.vRel = vRel
+    self.vLead = vLead
+    self.vLeadK = vLeadK
+    self.aLeadK = aLeadK
+    self.aLeadTau = aLeadTau
+    self.measured = measured
 
   def get_RadarState(self, model_prob=0.0):
     return {
@@ -156,3 +137,28 @@ class Cluster():
 
   def is_potential_fcw(self, model_prob):
     return model_prob > .9
+
+
+def get_clusters(tracks, labels):
+  """Averages the tracks by cluster label. The acceleration of a cluster only
+  comes from tracks that were seen before, new tracks get theirs reset to it."""
+  if len(tracks) == 0:
+    return [], np.zeros(0), np.zeros(0)
+
+  n = labels.max() + 1
+  count = np.bincount(labels, minlength=n)
+
+  def cluster_sum(v):
+    return np.bincount(labels, weights=v, minlength=n)
+
+  old = tracks.cnt > 1
+  old_count = cluster_sum(old)
+  has_old = old_count > 0
+  old_count[~has_old] = 1.
+  aLeadK = np.where(has_old, cluster_sum(tracks.aLeadK * old) / old_count, 0.)
+  aLeadTau = np.where(has_old, cluster_sum(tracks.aLeadTau * old) / old_count, _LEAD_ACCEL_TAU)
+  measured = cluster_sum(tracks.measured) > 0
+
+  means = [cluster_sum(v) / count for v in (tracks.dRel, tracks.yRel, tracks.vRel, tracks.vLead, tracks.vLeadK)]
+  stats = zip(*[m.tolist() for m in means], aLeadK.tolist(), aLeadTau.tolist(), measured.tolist())
+  return [Cluster(*s) for s in stats], aLeadK, aLeadTau
@@ -0,0 +1,38 @@
+#!/usr/bin/env python3
+import unittest
+
+import numpy as np
+
+from selfdrive.controls.lib.drive_helpers import shift_trajectory
+
+DT = 0.05
+T_IDXS = np.arange(0., 2. + DT / 2, DT)
+
+
+class TestShiftTrajectory(unittest.TestCase):
+  def test_shift(self):
+    traj = np.column_stack([T_IDXS, T_IDXS ** 2])
+    shifted = shift_trajectory(T_IDXS, traj, DT)
+    np.testing.assert_allclose(shifted[:-1], traj[1:])
+    # the last value is held
+    np.testing.assert_allclose(shifted[-1], traj[-1])
+
+  def test_longitudinal_pose(self):
+    # x_ego, v_ego, a_ego at constant speed, x_ego starts at 0 again like x0
+    v = 20.
+    traj = np.column_stack([v * T_IDXS, np.full_like(T_IDXS, v), np.zeros_like(T_IDXS)])
+    shifted = shift_trajectory(T_IDXS, traj, DT, pose_idxs=(0,))
+    np.testing.assert_allclose(shifted[:-1], traj[:-1])
+
+  def test_lateral_pose(self):
+    # x_ego, y_ego, psi_ego, curv_ego on a circle, which looks the same from every point on it
+    v, curv = 20., 0.02
+    s = v * T_IDXS
+    traj = np.column_stack([np.sin(curv * s) / curv, (1 - np.cos(curv * s)) / curv, curv * s, np.full_like(s, curv)])
+    shifted = shift_trajectory(T_IDXS, traj, DT, pose_idxs=(0, 1, 2))
+    np.testing.assert_allclose(shifted[:-1], traj[:-1], atol=1e-9)
+    np.testing.assert_allclose(shifted[0, :3], 0., atol=1e-9)
+
+
+if __name__ == "__main__":
+  unittest.main()
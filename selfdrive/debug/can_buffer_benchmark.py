@@ -0,0 +1,21 @@
+#!/usr/bin/env python3
+import argparse
+import random
+import timeit
+
+from panda import pack_can_buffer, unpack_can_buffer
+
+
+if __name__ == "__main__":
+  parser = argparse.ArgumentParser(description="Measure panda USB CAN packing and unpacking throughput")
+  parser.add_argument("--frames", type=int, default=10000)
+  parser.add_argument("--len", type=int, default=8, help="CAN data length")
+  args = parser.parse_args()
+
+  msgs = [(random.randint(1, 0x7FF), 0, bytes(args.len), random.randint(0, 2)) for _ in range(args.frames)]
+  t = min(timeit.repeat(lambda: pack_can_buffer(msgs), number=1, repeat=5))
+  print(f"pack:   {args.frames / t:12.0f} frames/s")
+
+  snds = pack_can_buffer(msgs)
+  t = min(timeit.repeat(lambda: [unpack_can_buffer(tx) for tx in snds], number=1, repeat=5))
+  print(f"unpack: {args.frames / t:12.0f} frames/s")
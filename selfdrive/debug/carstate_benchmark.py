@@ -0,0 +1,67 @@
+#!/usr/bin/env python3
+import argparse
+import itertools
+import os
+import timeit
+
+from cereal import car
+from opendbc import DBC_PATH
+from opendbc.can.dbc import dbc
+from opendbc.can.packer import CANPacker
+from selfdrive.boardd.boardd import can_list_to_can_capnp
+from selfdrive.car.car_helpers import interfaces
+from selfdrive.car.fingerprints import all_known_cars
+from selfdrive.car.fingerprints import _FINGERPRINTS as FINGERPRINTS
+
+COUNTER_PERIOD = 256  # a multiple of every counter's period, so the ticks can be replayed in a loop
+
+
+def can_ticks(parsers):
+  """Returns a can string per 10ms tick with every message the parsers read, with valid counters and checksums"""
+  msgs = {}
+  for cp in parsers:
+    dbc_name = cp.dbc_name.decode()
+    packer = CANPacker(dbc_name)
+    get_signals = dbc(os.path.join(DBC_PATH, dbc_name + ".dbc")).get_signals
+    for addr in cp.vl_array:
+      if isinstance(addr, int):
+        msgs[(cp.bus, addr)] = (packer, "COUNTER" in get_signals(addr))
+
+  return [can_list_to_can_capnp([packer.make_can_msg(addr, bus, {}, counter=t if counter else -1)
+                                 for (bus, addr), (packer, counter) in msgs.items()])
+          for t in range(COUNTER_PERIOD)], len(msgs)
+
+
+def bench(car_name, frames):
+  CarInterface, CarController, CarState = interfaces[car_name]
+  fingerprint = FINGERPRINTS[car_name][0] if car_name in FINGERPRINTS else {}
+  CP = CarInterface.get_params(car_name, {0: fingerprint, 1: fingerprint, 2: fingerprint}, [])
+  CI = CarInterface(CP, CarController, CarState)
+
+  parsers = [cp for cp in (CI.cp, CI.cp_cam, CI.cp_body, CI.cp_loopback) if cp is not None]
+  ticks, msg_count = can_ticks(parsers)
+  can_strings = itertools.cycle(ticks)
+
+  CC = car.CarControl.new_message()
+  for _ in range(COUNTER_PERIOD):
+    CI.update(CC, [next(can_strings)])
+  return min(timeit.repeat(lambda: CI.update(CC, [next(can_strings)]), number=frames, repeat=5)) / frames, msg_count
+
+
+if __name__ == "__main__":
+  parser = argparse.ArgumentParser(description="Measure the per-tick cost of CarInterface.update, parsing a 10ms tick of CAN "
+                                               "that has every message its CANParsers read, and running CarState.update")
+  parser.add_argument("cars", nargs="*", help="car fingerprints, defaults to one car per brand")
+  parser.add_argument("--frames", type=int, default=1000)
+  args = parser.parse_args()
+
+  cars = args.cars
+  if not cars:
+    brands = {}
+    for car_name in sorted(all_known_cars()):
+      brands.setdefault(interfaces[car_name][0].__module__.split(".")[2], car_name)
+    cars = list(brands.values())
+
+  for car_name in cars:
+    t, msg_count = bench(car_name, args.frames)
+    print(f"{car_name:45} {t * 1e6:8.1f} us/update ({msg_count} msgs/tick)")
@@ -0,0 +1,62 @@
+#!/usr/bin/env python3
+import argparse
+import time
+
+import numpy as np
+
+from cereal import log
+from selfdrive.controls.lib.drive_helpers import LAT_MPC_N
+from selfdrive.controls.lib.lateral_mpc_lib.lat_mpc import LateralMpc
+from selfdrive.controls.lib.longitudinal_mpc_lib.long_mpc import LongitudinalMpc
+
+
+def long_cycle(mpc, v_ego):
+  radarstate = log.RadarState.new_message()
+  radarstate.leadOne.status = True
+  radarstate.leadOne.dRel = 2. * v_ego + 10.
+  radarstate.leadOne.vLead = v_ego - 2.
+  radarstate.leadOne.aLeadTau = 1.5
+
+  mpc.set_weights()
+  mpc.set_accel_limits(-3.5, 2.)
+  def cycle():
+    mpc.set_cur_state(v_ego, 0.)
+    mpc.update(None, radarstate, v_ego + 5.)
+  return cycle
+
+
+def lat_cycle(mpc, v_ego):
+  x0 = np.zeros(4)
+  p = np.array([v_ego, 0.])
+  t = np.linspace(0., 2.5, LAT_MPC_N + 1)
+  y_pts = 0.5 * np.sin(t)
+  heading_pts = 0.5 * np.cos(t) / max(v_ego, 1.)
+
+  mpc.set_weights(1., 1., 1.)
+  return lambda: mpc.run(x0, p, y_pts, heading_pts)
+
+
+def bench(cycle, solver, frames):
+  """Returns the minimum and median wall time per cycle, and the median solver time_tot"""
+  cycle()
+  wall, solver_time = [], []
+  for _ in range(frames):
+    t = time.perf_counter()
+    cycle()
+    wall.append(time.perf_counter() - t)
+    solver_time.append(float(solver.get_stats('time_tot')[0]))
+  return min(wall), np.median(wall), np.median(solver_time)
+
+
+if __name__ == "__main__":
+  parser = argparse.ArgumentParser(description="Measure the per-cycle cost of the plannerd MPCs, split into acados time_tot and Python overhead")
+  parser.add_argument("--frames", type=int, default=1000)
+  parser.add_argument("--v-ego", type=float, default=20.)
+  args = parser.parse_args()
+
+  long_mpc, lat_mpc = LongitudinalMpc(), LateralMpc()
+  for name, mpc, cycle in (("long", long_mpc, long_cycle(long_mpc, args.v_ego)),
+                           ("lat", lat_mpc, lat_cycle(lat_mpc, args.v_ego))):
+    best, wall, solver_time = bench(cycle, mpc.solver, args.frames)
+    print(f"{name:4} wall {wall * 1e6:8.1f} us (min {best * 1e6:8.1f} us), "
+          f"time_tot {solver_time * 1e6:8.1f} us, python overhead {(wall - solver_time) * 1e6:8.1f} us")
@@ -0,0 +1,48 @@
+#!/usr/bin/env python3
+import argparse
+import threading
+import time
+import timeit
+
+from common.params import CachedParams, Params
+
+
+def reads_per_second(f, reads):
+  return reads / min(timeit.repeat(f, number=reads, repeat=5))
+
+
+def change_latency(params, cached, key, changes):
+  """Returns the mean time from a put to the subscription callback of a CachedParams"""
+  changed = threading.Event()
+  cached.subscribe(key, lambda k, v: changed.set())
+
+  latencies = []
+  for i in range(changes):
+    changed.clear()
+    t = time.monotonic()
+    params.put_bool(key, i % 2 == 0)
+    if changed.wait(1.):
+      latencies.append(time.monotonic() - t)
+  return sum(latencies) / max(len(latencies), 1), len(latencies)
+
+
+if __name__ == "__main__":
+  parser = argparse.ArgumentParser(description="Compare reads per second of Params and CachedParams")
+  parser.add_argument("--key", default="DisengageOnAccelerator")
+  parser.add_argument("--reads", type=int, default=100000)
+  parser.add_argument("--changes", type=int, default=100)
+  args = parser.parse_args()
+
+  params = Params()
+  cached = CachedParams()
+  if params.get(args.key) is None:
+    params.put_bool(args.key, False)
+
+  print(f"Params.get_bool        {reads_per_second(lambda: params.get_bool(args.key), args.reads):12.0f} reads/s")
+  print(f"CachedParams.get_bool  {reads_per_second(lambda: cached.get_bool(args.key), args.reads):12.0f} reads/s")
+
+  value = params.get_bool(args.key)
+  latency, received = change_latency(params, cached, args.key, args.changes)
+  params.put_bool(args.key, value)
+  print(f"put to callback        {latency * 1e6:12.1f} us ({received}/{args.changes} changes seen)")
+  cached.close()
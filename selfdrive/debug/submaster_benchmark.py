@@ -0,0 +1,45 @@
+#!/usr/bin/env python3
+import argparse
+import timeit
+
+import capnp
+
+import cereal.messaging as messaging
+from cereal.services import service_list
+
+
+def new_message(s):
+  try:
+    dat = messaging.new_message(s)
+  except capnp.lib.capnp.KjException:  # pylint: disable=c-extension-no-member
+    dat = messaging.new_message(s, 0)  # lists
+  return dat.as_reader()
+
+
+def bench(num_services, frames):
+  services = [s for s in service_list if service_list[s].frequency > 0][:num_services]
+  sm = messaging.SubMaster(services, addr=None)
+
+  # every service is received at its own rate relative to a 100Hz loop
+  msgs = {s: new_message(s) for s in services}
+  intervals = {s: max(1, round(100. / service_list[s].frequency)) for s in services}
+  ticks = [[msgs[s] for s in services if i % intervals[s] == 0] for i in range(100)]
+
+  t = 0.
+  def update():
+    nonlocal t
+    t += 0.01
+    sm.update_msgs(t, ticks[sm.frame % 100])
+
+  return min(timeit.repeat(update, number=frames, repeat=5)) / frames
+
+
+if __name__ == "__main__":
+  parser = argparse.ArgumentParser(description="Measure the cost of SubMaster.update_msgs as the number of services grows")
+  parser.add_argument("--frames", type=int, default=10000)
+  args = parser.parse_args()
+
+  max_services = len([s for s in service_list if service_list[s].frequency > 0])
+  for n in sorted({1, 5, 10, 15, 20, 40, max_services}):
+    if n <= max_services:
+      print(f"{n:3d} services: {bench(n, args.frames) * 1e6:8.2f} us/update")
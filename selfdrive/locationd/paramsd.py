@@ -7,7 +7,7 @@ import numpy as np
 
 import cereal.messaging as messaging
 from cereal import car
-from common.params import Params, put_nonblocking
+from common.params import CachedParams, put_nonblocking
 from common.realtime import set_realtime_priority, DT_MDL
 from common.numpy_fast import clip
 from selfdrive.locationd.models.car_kf import CarKalman, ObservationKind, States
@@ -111,7 +111,7 @@ def main(sm=None, pm=None):
   if pm is None:
     pm = messaging.PubMaster(['liveParameters'])
 
-  params_reader = Params()
+  params_reader = CachedParams()
   # wait for stats about the car to come in from controls
   cloudlog.info("paramsd is waiting for CarParams")
   CP = car.CarParams.from_bytes(params_reader.get("CarParams", block=True))
@@ -186,8 +186,7 @@ def main(sm=None, pm=None):
       liveParameters.posenetValid = True
       liveParameters.sensorValid = True
 
-      params = Params()
-      if params.get_bool("DisengageOnAccelerator"):
+      if params_reader.get_bool("DisengageOnAccelerator"):
         #liveParameters.steerRatio = float(17)  # float(x[States.STEER_RATIO])
         #liveParameters.stiffnessFactor = float(0.45)  # float(x[States.STIFFNESS]) disengage on accelerator
         liveParameters.steerRatio = sm['carState'].yawRate
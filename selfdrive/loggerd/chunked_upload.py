@@ -0,0 +1,169 @@
+import base64
+import io
+import os
+import threading
+from concurrent.futures import ThreadPoolExecutor
+from urllib.parse import quote
+
+import requests
+
+from common.file_helpers import CallbackReader
+
+CHUNK_SIZE = 4 * 1024 * 1024
+UPLOAD_PARALLELISM = int(os.getenv("UPLOAD_PARALLELISM", "4"))
+
+
+def supports_chunks(headers):
+  # upload urls are azure blob SAS urls, blocks are staged one by one and then committed as a list
+  return headers.get("x-ms-blob-type") == "BlockBlob"
+
+
+def block_id(idx):
+  # block ids of a blob must all have the same length
+  return base64.b64encode(f"{idx:08d}".encode()).decode()
+
+
+def with_query(url, query):
+  return url + ("&" if "?" in url else "?") + query
+
+
+class ChunkedUpload:
+  """Uploads a file to an upload url as blocks of chunk_size, over up to parallelism connections.
+
+  done_chunks are the indices of blocks uploaded by an earlier attempt, they are skipped and the
+  blob is committed with the full block list once every block is up. chunk_callback(idx) is called
+  as blocks finish, so callers can persist them and resume after a network flap or a restart.
+  progress_callback(size, uploaded) works like the callback of a CallbackReader, an exception
+  it raises aborts the whole upload. Files that fit in one chunk, and urls that don't take
+  blocks, are sent with a single PUT.
+  """
+  def __init__(self, path, url, headers, done_chunks=(), progress_callback=None, chunk_callback=None,
+               parallelism=UPLOAD_PARALLELISM, chunk_size=CHUNK_SIZE, timeout=30):
+    self.path = path
+    self.url = url
+    self.headers = {k: v for k, v in headers.items() if k.lower() != "content-length"}
+    self.progress_callback = progress_callback
+    self.chunk_callback = chunk_callback
+    self.parallelism = max(1, parallelism)
+    self.chunk_size = chunk_size
+    self.timeout = timeout
+
+    self.size = os.path.getsize(path)
+    self.chunk_count = max(1, -(-self.size // chunk_size))
+    self.chunked = supports_chunks(headers) and self.chunk_count > 1
+    self.done_chunks = {i for i in done_chunks if 0 <= i < self.chunk_count} if self.chunked else set()
+
+    self.resumed = sum(self._chunk_length(i) for i in self.done_chunks)  # bytes uploaded by earlier attempts
+    self.sent = 0  # bytes sent by this attempt
+    self._chunk_sent = {}
+    self._lock = threading.Lock()
+    self._callback_lock = threading.Lock()  # callbacks are called from the workers, one at a time
+    self._abort = threading.Event()
+    self._error = None
+    self._local = threading.local()
+    self._sessions = []
+
+  def _chunk_length(self, idx):
+    return min(self.chunk_size, self.size - idx * self.chunk_size)
+
+  def _session(self):
+    # a session per worker keeps one connection alive per worker across its chunks
+    if not hasattr(self._local, "session"):
+      self._local.session = requests.Session()
+      with self._lock:
+        self._sessions.append(self._local.session)
+    return self._local.session
+
+  def _close_sessions(self):
+    # closing the connections also stops block PUTs left half sent by an abort
+    with self._lock:
+      sessions, self._sessions = self._sessions, []
+    for session in sessions:
+      session.close()
+    self._local = threading.local()
+
+  def _progress(self, idx, sent):
+    with self._lock:
+      self.sent += sent - self._chunk_sent.get(idx, 0)
+      self._chunk_sent[idx] = sent
+      uploaded = self.resumed + self.sent
+
+    if self._abort.is_set():
+      raise requests.exceptions.ConnectionError("upload aborted")
+    if self.progress_callback is not None:
+      with self._callback_lock:
+        self.progress_callback(self.size, uploaded)
+
+  def _put(self, url, f, size, headers, idx=-1):
+    body = CallbackReader(f, self._progress, idx)
+    return self._session().put(url, data=body, headers={**headers, "Content-Length": str(size)}, timeout=self.timeout)
+
+  def _upload_chunk(self, f, idx):
+    if self._abort.is_set():
+      return None
+
+    dat = os.pread(f.fileno(), self.chunk_size, idx * self.chunk_size)
+    headers = {k: v for k, v in self.headers.items() if k.lower() != "x-ms-blob-type"}
+    url = with_query(self.url, "comp=block&blockid=" + quote(block_id(idx), safe=""))
+    try:
+      resp = self._put(url, io.BytesIO(dat), len(dat), headers, idx)
+    except Exception as e:
+      with self._lock:
+        if self._error is None:
+          self._error = e
+      self._abort.set()
+      raise
+
+    if resp.status_code not in (200, 201):
+      self._abort.set()
+      return resp
+
+    with self._lock:
+      self.done_chunks.add(idx)
+    if self.chunk_callback is not None:
+      with self._callback_lock:
+        self.chunk_callback(idx)
+    return None
+
+  def _commit(self):
+    block_list = "".join(f"<Latest>{block_id(i)}</Latest>" for i in range(self.chunk_count))
+    dat = f'<?xml version="1.0" encoding="utf-8"?><BlockList>{block_list}</BlockList>'.encode()
+    headers = {k: v for k, v in self.headers.items() if k.lower() != "x-ms-blob-type"}
+    return self._put(with_query(self.url, "comp=blocklist"), io.BytesIO(dat), len(dat), headers)
+
+  def run(self):
+    """Returns the response of the single PUT, of the block list commit, or of the first failed block"""
+    try:
+      return self._run()
+    finally:
+      self._close_sessions()
+
+  def _run(self):
+    if not self.chunked:
+      with open(self.path, "rb") as f:
+        return self._put(self.url, f, self.size, self.headers)
+
+    todo = [i for i in range(self.chunk_count) if i not in self.done_chunks]
+    if todo:
+      with open(self.path, "rb") as f, ThreadPoolExecutor(max_workers=min(self.parallelism, len(todo))) as pool:
+        futures = [pool.submit(self._upload_chunk, f, i) for i in todo]
+        for future in futures:
+          future.exception()  # wait for every chunk, in flight ones stop early after a failure
+
+      # the first error, not the ones of the chunks it stopped
+      if self._error is not None:
+        raise self._error
+      for future in futures:
+        if future.result() is not None:
+          return future.result()
+
+    resume = len(todo) < self.chunk_count
+    resp = self._commit()
+    if resp.status_code == 400 and resume:
+      # uncommitted blocks are dropped by the server after a while, start over
+      self.done_chunks = set()
+      self._chunk_sent = {}
+      self.resumed = 0
+      self._abort.clear()
+      return self._run()
+    return resp
@@ -21,6 +21,11 @@ else:
   STATS_DIR = "/data/stats/"
 STATS_FLUSH_TIME_S = 60
 
+if PC:
+  UPLOAD_INDEX_FILE = os.path.join(str(Path.home()), ".comma", "upload_index.json")
+else:
+  UPLOAD_INDEX_FILE = "/data/upload_index.json"
+
 def get_available_percent(default=None):
   try:
     statvfs = os.statvfs(ROOT)
@@ -0,0 +1,182 @@
+#!/usr/bin/env python3
+import os
+import re
+import tempfile
+import threading
+import time
+import unittest
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from urllib.parse import parse_qs, unquote, urlparse
+
+from selfdrive.loggerd.chunked_upload import ChunkedUpload
+
+CHUNK_SIZE = 1024
+BLOB_HEADERS = {"x-ms-blob-type": "BlockBlob"}
+
+
+class BlobPutHandler(BaseHTTPRequestHandler):
+  """Stands in for a blob upload url: whole blob PUTs, block PUTs and block list commits"""
+  protocol_version = "HTTP/1.1"
+  blobs = {}
+  blocks = {}
+  requests = []
+  fail_blocks = set()
+  in_flight = 0
+  max_in_flight = 0
+  lock = threading.Lock()
+
+  def log_message(self, *args):
+    pass
+
+  def _respond(self, code):
+    self.send_response(code)
+    self.send_header("Content-Length", "0")
+    self.end_headers()
+
+  def do_PUT(self):
+    cls = type(self)
+    with cls.lock:
+      cls.in_flight += 1
+      cls.max_in_flight = max(cls.max_in_flight, cls.in_flight)
+    try:
+      code = self._put()
+    finally:
+      with cls.lock:
+        cls.in_flight -= 1
+    # a client can send its next request as soon as it has the response
+    self._respond(code)
+
+  def _put(self):
+    cls = type(self)
+    dat = self.rfile.read(int(self.headers["Content-Length"]))
+    time.sleep(0.01)  # long enough for requests to overlap
+
+    url = urlparse(self.path)
+    query = parse_qs(url.query)
+    comp = query.get("comp", [None])[0]
+    with cls.lock:
+      cls.requests.append((url.path, comp, query.get("blockid", [None])[0]))
+      if comp == "block":
+        block_id = query["blockid"][0]
+        if block_id in cls.fail_blocks:
+          cls.fail_blocks.remove(block_id)
+          return 500
+        cls.blocks.setdefault(url.path, {})[block_id] = dat
+      elif comp == "blocklist":
+        staged = cls.blocks.get(url.path, {})
+        ids = [unquote(i) for i in re.findall(r"<Latest>(.*?)</Latest>", dat.decode())]
+        if any(i not in staged for i in ids):
+          return 400
+        cls.blobs[url.path] = b"".join(staged[i] for i in ids)
+        cls.blocks.pop(url.path)
+      else:
+        cls.blobs[url.path] = dat
+    return 201
+
+
+class TestChunkedUpload(unittest.TestCase):
+  @classmethod
+  def setUpClass(cls):
+    cls.server = ThreadingHTTPServer(("127.0.0.1", 0), BlobPutHandler)
+    cls.server_thread = threading.Thread(target=cls.server.serve_forever, daemon=True)
+    cls.server_thread.start()
+    cls.host = f"http://127.0.0.1:{cls.server.server_port}"
+
+  @classmethod
+  def tearDownClass(cls):
+    cls.server.shutdown()
+    cls.server.server_close()
+
+  def setUp(self):
+    # a blob per test, requests of an aborted upload can still arrive during the next test
+    self.path = f"/{self.id()}/fcamera.hevc"
+    self.url = f"{self.host}{self.path}?sig=abc"
+    BlobPutHandler.in_flight = 0
+    BlobPutHandler.max_in_flight = 0
+
+  def _requests(self, comp):
+    return [block_id for path, c, block_id in BlobPutHandler.requests if path == self.path and c == comp]
+
+  def _file(self, size):
+    f = tempfile.NamedTemporaryFile()
+    f.write(os.urandom(size))
+    f.flush()
+    self.addCleanup(f.close)
+    return f.name, open(f.name, "rb").read()
+
+  def test_single_put(self):
+    # small files, and urls that don't take blocks, are sent whole
+    for size, headers in ((CHUNK_SIZE // 2, BLOB_HEADERS), (CHUNK_SIZE * 5, {})):
+      fn, dat = self._file(size)
+      resp = ChunkedUpload(fn, self.url, headers, chunk_size=CHUNK_SIZE).run()
+      self.assertEqual(resp.status_code, 201)
+      self.assertEqual(BlobPutHandler.blobs[self.path], dat)
+      self.assertEqual(BlobPutHandler.requests[-1], (self.path, None, None))
+
+  def test_parallel_blocks(self):
+    fn, dat = self._file(int(CHUNK_SIZE * 10.5))
+    progress = []
+    upload = ChunkedUpload(fn, self.url, BLOB_HEADERS, chunk_size=CHUNK_SIZE, parallelism=4,
+                           progress_callback=lambda sz, cur: progress.append((sz, cur)))
+    resp = upload.run()
+
+    self.assertEqual(resp.status_code, 201)
+    self.assertEqual(BlobPutHandler.blobs[self.path], dat)
+    self.assertEqual(upload.chunk_count, 11)
+    self.assertEqual(len(self._requests("block")), 11)
+    self.assertGreater(BlobPutHandler.max_in_flight, 1)
+    self.assertLessEqual(BlobPutHandler.max_in_flight, 4)
+    self.assertIn((len(dat), len(dat)), progress)
+
+  def test_resume(self):
+    fn, dat = self._file(CHUNK_SIZE * 8)
+    done = []
+    BlobPutHandler.fail_blocks.add("MDAwMDAwMDU=")  # block 5
+
+    first = ChunkedUpload(fn, self.url, BLOB_HEADERS, chunk_size=CHUNK_SIZE, parallelism=1, chunk_callback=done.append)
+    self.assertEqual(first.run().status_code, 500)
+    self.assertNotIn(self.path, BlobPutHandler.blobs)
+    self.assertEqual(done, [0, 1, 2, 3, 4])
+
+    # only the missing blocks are sent again
+    sent = len(self._requests("block"))
+    second = ChunkedUpload(fn, self.url, BLOB_HEADERS, done_chunks=done, chunk_size=CHUNK_SIZE, chunk_callback=done.append)
+    self.assertEqual(second.run().status_code, 201)
+    self.assertEqual(BlobPutHandler.blobs[self.path], dat)
+    self.assertEqual(sorted(self._requests("block")[sent:]), ["MDAwMDAwMDU=", "MDAwMDAwMDY=", "MDAwMDAwMDc="])
+    self.assertEqual(second.resumed, CHUNK_SIZE * 5)
+
+  def test_resume_expired_blocks(self):
+    # the server dropped the staged blocks, the upload starts over
+    fn, dat = self._file(CHUNK_SIZE * 3)
+    upload = ChunkedUpload(fn, self.url, BLOB_HEADERS, done_chunks=[0, 1], chunk_size=CHUNK_SIZE)
+    self.assertEqual(upload.run().status_code, 201)
+    self.assertEqual(BlobPutHandler.blobs[self.path], dat)
+
+    # block 2 was sent twice
+    self.assertGreaterEqual(upload.sent, len(dat) + CHUNK_SIZE)
+
+  def test_abort(self):
+    fn, _ = self._file(CHUNK_SIZE * 8)
+
+    class Abort(Exception):
+      pass
+
+    def cb(sz, cur):
+      if cur > CHUNK_SIZE * 2:
+        raise Abort
+
+    with self.assertRaises(Abort):
+      ChunkedUpload(fn, self.url, BLOB_HEADERS, chunk_size=CHUNK_SIZE, parallelism=2, progress_callback=cb).run()
+    self.assertNotIn(self.path, BlobPutHandler.blobs)
+
+    # the half sent blocks are closed, not left for the server to wait on
+    for _ in range(100):
+      if BlobPutHandler.in_flight == 0:
+        break
+      time.sleep(0.01)
+    self.assertEqual(BlobPutHandler.in_flight, 0)
+
+
+if __name__ == "__main__":
+  unittest.main()
@@ -0,0 +1,192 @@
+#!/usr/bin/env python3
+import os
+import random
+import shutil
+import tempfile
+import time
+import unittest
+from unittest import mock
+
+from common import inotify
+from common.xattr import getxattr, setxattr
+from selfdrive.loggerd import uploader
+from selfdrive.loggerd.uploader import UPLOAD_ATTR_NAME, UPLOAD_ATTR_VALUE, UploadQueue, listdir_by_creation
+
+IMMEDIATE_FOLDERS = ["crash/", "boot/"]
+IMMEDIATE_PRIORITY = {"qlog.bz2": 0, "qcamera.ts": 1}
+SEGMENT_FILES = ["rlog.bz2", "qlog.bz2", "qcamera.ts", "fcamera.hevc"]
+
+
+def list_upload_files(root):
+  """The uploader's picker before UploadQueue: lists every unlocked segment on every call"""
+  files = []
+  count, size = 0, 0
+  for logname in listdir_by_creation(root):
+    path = os.path.join(root, logname)
+    try:
+      names = os.listdir(path)
+    except OSError:
+      continue
+
+    if any(name.endswith(".lock") for name in names):
+      continue
+
+    for name in sorted(names, key=lambda n: (IMMEDIATE_PRIORITY.get(n, 1000), n)):
+      fn = os.path.join(path, name)
+      try:
+        if getxattr(fn, UPLOAD_ATTR_NAME):
+          continue
+      except OSError:
+        continue
+
+      if name in IMMEDIATE_PRIORITY:
+        count += 1
+        size += os.path.getsize(fn)
+      files.append((logname, name, fn))
+  return files, count, size
+
+
+def next_file_to_upload(root):
+  files, count, size = list_upload_files(root)
+  for logname, name, fn in files:
+    if logname + "/" in IMMEDIATE_FOLDERS:
+      return (logname, name, fn), count, size
+  for logname, name, fn in files:
+    if name in IMMEDIATE_PRIORITY:
+      return (logname, name, fn), count, size
+  return None, count, size
+
+
+class TestUploadQueue(unittest.TestCase):
+  def setUp(self):
+    self.root = tempfile.mkdtemp()
+    self.index_file = os.path.join(tempfile.mkdtemp(), "upload_index.json")
+    self.addCleanup(shutil.rmtree, self.root)
+    self.addCleanup(shutil.rmtree, os.path.dirname(self.index_file), ignore_errors=True)
+    self.segments = []
+    self.rand = random.Random(0)
+
+  def _write(self, fn, size):
+    with open(fn, "wb") as f:
+      f.write(b"\0" * size)
+
+  def _segment(self, locked=False):
+    logname = f"2021-06-01--12-00-00--{len(self.segments)}"
+    os.mkdir(os.path.join(self.root, logname))
+    if locked:
+      self._write(os.path.join(self.root, logname, "rlog.lock"), 0)
+    for name in SEGMENT_FILES:
+      self._write(os.path.join(self.root, logname, name), self.rand.randint(1, 100))
+    self.segments.append(logname)
+    return logname
+
+  def _queue(self):
+    q = UploadQueue(self.root, self.index_file, IMMEDIATE_FOLDERS, IMMEDIATE_PRIORITY)
+    self.addCleanup(q._clear)
+    return q
+
+  def _check(self, q):
+    q.update()
+    expected, count, size = next_file_to_upload(self.root)
+    self.assertEqual(q.peek(), expected)
+
+    # the running totals follow the pending files, and match the picker once uploads by others are rechecked
+    sizes = [sz for _, name, sz in q.pending.values() if name in IMMEDIATE_PRIORITY]
+    self.assertEqual(q.immediate_stats(), (len(sizes), sum(sizes)))
+    q.recheck_immediate()
+    self.assertEqual(q.immediate_stats(), (count, size))
+    return expected
+
+  def test_upload_order(self):
+    for _ in range(3):
+      self._segment()
+    os.mkdir(os.path.join(self.root, "boot"))
+    self._write(os.path.join(self.root, "boot", "b"), 10)
+
+    q = self._queue()
+    order = []
+    d = self._check(q)
+    while d is not None:
+      order.append(d[:2])
+      setxattr(d[2], UPLOAD_ATTR_NAME, UPLOAD_ATTR_VALUE)
+      q.mark_uploaded(d[2])
+      d = self._check(q)
+
+    self.assertEqual(order, [("boot", "b")] + [(s, n) for s in self.segments for n in ("qlog.bz2", "qcamera.ts")])
+
+  def test_uploaded_elsewhere(self):
+    logname = self._segment()
+    q = self._queue()
+    self._check(q)
+
+    # athenad uploads the qcamera without the uploader seeing an event, it's counted until the next recheck
+    setxattr(os.path.join(self.root, logname, "qcamera.ts"), UPLOAD_ATTR_NAME, UPLOAD_ATTR_VALUE)
+    self.assertEqual(q.immediate_stats()[0], 2)
+    with mock.patch.object(uploader.time, "monotonic", return_value=time.monotonic() + uploader.IMMEDIATE_RECHECK_INTERVAL):
+      self.assertEqual(q.immediate_stats()[0], 1)
+
+    # and the qlog, which peek() notices right away
+    setxattr(os.path.join(self.root, logname, "qlog.bz2"), UPLOAD_ATTR_NAME, UPLOAD_ATTR_VALUE)
+    self.assertIsNone(q.peek())
+    self.assertEqual(q.immediate_stats(), (0, 0))
+    self.assertIsNone(self._check(q))
+
+  def test_restart_from_index(self):
+    for _ in range(3):
+      self._segment()
+    q = self._queue()
+    d = self._check(q)
+    setxattr(d[2], UPLOAD_ATTR_NAME, UPLOAD_ATTR_VALUE)
+    q.mark_uploaded(d[2])
+    setxattr(os.path.join(self.root, self.segments[2], "qcamera.ts"), UPLOAD_ATTR_NAME, UPLOAD_ATTR_VALUE)
+    q._clear()
+
+    self.assertTrue(os.path.isfile(self.index_file))
+    self._check(self._queue())
+
+  def _random_walk(self, steps):
+    for _ in range(5):
+      self._segment()
+    for folder in ("boot", "crash"):
+      os.mkdir(os.path.join(self.root, folder))
+
+    q = self._queue()
+    for step in range(steps):
+      live = [s for s in self.segments if os.path.isdir(os.path.join(self.root, s))]
+      locked = [s for s in live if os.path.exists(os.path.join(self.root, s, "rlog.lock"))]
+      op = self.rand.random()
+      if op < 0.35:
+        d = q.peek()
+        if d is not None:
+          setxattr(d[2], UPLOAD_ATTR_NAME, UPLOAD_ATTR_VALUE)
+          q.mark_uploaded(d[2])
+      elif op < 0.45:
+        self._segment(locked=True)
+      elif op < 0.55 and locked:
+        os.unlink(os.path.join(self.root, self.rand.choice(locked), "rlog.lock"))
+      elif op < 0.62 and live:
+        shutil.rmtree(os.path.join(self.root, live[0]))  # deleter
+      elif op < 0.68:
+        self._write(os.path.join(self.root, self.rand.choice(["boot", "crash"]), f"{step}"), 10)
+      elif op < 0.72 and live:
+        # athenad uploads a qlog
+        fn = os.path.join(self.root, self.rand.choice(live), "qlog.bz2")
+        if os.path.exists(fn):
+          setxattr(fn, UPLOAD_ATTR_NAME, UPLOAD_ATTR_VALUE)
+      elif op < 0.75:
+        q._clear()
+        q = self._queue()  # uploader restart
+
+      with self.subTest(step=step):
+        self._check(q)
+
+  def test_random_walk(self):
+    self._random_walk(300)
+
+  @mock.patch.object(inotify, "available", return_value=False)
+  def test_random_walk_without_inotify(self, _):
+    self._random_walk(100)
+
+
+if __name__ == "__main__":
+  unittest.main()
@@ -1,8 +1,8 @@
 #!/usr/bin/env python3
+import heapq
 import json
 import os
 import random
-import requests
 import threading
 import time
 import traceback
@@ -10,11 +10,15 @@ from pathlib import Path
 
 from cereal import log
 import cereal.messaging as messaging
+from common import inotify
 from common.api import Api
+from common.file_helpers import atomic_write_in_dir, mkdirs_exists_ok
 from common.params import Params
+from common.xattr import getxattr
 from selfdrive.hardware import TICI
-from selfdrive.loggerd.xattr_cache import getxattr, setxattr
-from selfdrive.loggerd.config import ROOT
+from selfdrive.loggerd.chunked_upload import ChunkedUpload
+from selfdrive.loggerd.xattr_cache import setxattr
+from selfdrive.loggerd.config import ROOT, UPLOAD_INDEX_FILE
 from selfdrive.swaglog import cloudlog
 
 NetworkType = log.DeviceState.NetworkType
@@ -25,6 +29,12 @@ allow_sleep = bool(os.getenv("UPLOADER_SLEEP", "1"))
 force_wifi = os.getenv("FORCEWIFI") is not None
 fake_upload = os.getenv("FAKEUPLOAD") is not None
 
+ROOT_EVENTS = inotify.IN_CREATE | inotify.IN_MOVED_TO | inotify.IN_DELETE | inotify.IN_MOVED_FROM | inotify.IN_ONLYDIR
+DIR_EVENTS = ROOT_EVENTS | inotify.IN_CLOSE_WRITE
+
+# seconds between checks of the pending qlogs and qcameras for uploads by others, like athenad
+IMMEDIATE_RECHECK_INTERVAL = 30
+
 
 def get_directory_sort(d):
   return list(map(lambda s: s.rjust(10, '0'), d.rsplit('--', 1)))
@@ -49,83 +59,282 @@ def clear_locks(root):
       cloudlog.exception("clear_locks failed")
 
 
-class Uploader():
-  def __init__(self, dongle_id, root):
-    self.dongle_id = dongle_id
-    self.api = Api(dongle_id)
+class UploadQueue:
+  """Index of the files waiting for upload, ordered by upload priority.
+
+  The log directory is scanned once and then kept current with inotify events on the root,
+  on the immediate folders and on segments that are still locked by loggerd. The pending files
+  of finished segments are saved to index_file, so after a restart only new segments are listed.
+  Without inotify the index is rebuilt from index_file and the unfinished segments on every update.
+  """
+  def __init__(self, root, index_file, immediate_folders, immediate_priority):
     self.root = root
+    self.index_file = index_file
+    self.immediate_folders = immediate_folders
+    self.immediate_priority = immediate_priority
+
+    self.inotify = inotify.Inotify() if inotify.available() else None
+    self.seeded = False
+    self.dirty = False
+    self.watches = {}  # wd -> logname, None for the root
+    self.last_recheck = time.monotonic()
+    self._clear()
+
+  def _clear(self):
+    if self.inotify is not None:
+      for wd in self.watches:
+        self.inotify.rm_watch(wd)
+    self.watches = {}
+    self.heap = []  # (priority, fn), entries not in pending are stale
+    self.pending = {}  # fn -> (logname, name, size)
+    self.segments = {}  # logname -> pending names, of unlocked directories
+    self.locked = set()
+    self.immediate_count = 0
+    self.immediate_size = 0
 
-    self.upload_thread = None
+  def _is_immediate_folder(self, logname):
+    return logname + "/" in self.immediate_folders
 
-    self.last_resp = None
-    self.last_exc = None
+  def _priority(self, logname, name):
+    name_sort = self.immediate_priority.get(name, 1000)
+    return (not self._is_immediate_folder(logname), get_directory_sort(logname), name_sort)
 
-    self.immediate_size = 0
-    self.immediate_count = 0
+  def _load_index(self):
+    try:
+      with open(self.index_file) as f:
+        index = json.load(f)
+      if index["root"] == self.root:
+        return index["segments"]
+    except FileNotFoundError:
+      pass
+    except Exception:
+      cloudlog.exception("uploader index load failed")
+    return {}
 
-    # stats for last successfully uploaded file
-    self.last_time = 0
-    self.last_speed = 0
-    self.last_filename = ""
+  def _finished_segments(self):
+    return {logname: names for logname, names in self.segments.items() if not self._is_immediate_folder(logname)}
 
-    self.immediate_folders = ["crash/", "boot/"]
-    self.immediate_priority = {"qlog.bz2": 0, "qcamera.ts": 1}
+  def save(self):
+    if not self.dirty:
+      return
 
-  def get_upload_sort(self, name):
-    if name in self.immediate_priority:
-      return self.immediate_priority[name]
-    return 1000
+    segments = {logname: sorted(names) for logname, names in self._finished_segments().items()}
+    try:
+      mkdirs_exists_ok(os.path.dirname(self.index_file))
+      with atomic_write_in_dir(self.index_file, overwrite=True) as f:
+        json.dump({"root": self.root, "segments": segments}, f)
+      self.dirty = False
+    except OSError:
+      cloudlog.exception("uploader index save failed")
 
-  def list_upload_files(self):
+  def seed(self):
+    self._clear()
     if not os.path.isdir(self.root):
       return
 
-    self.immediate_size = 0
-    self.immediate_count = 0
+    if self.inotify is not None:
+      self.watches[self.inotify.add_watch(self.root, ROOT_EVENTS)] = None
 
+    index = self._load_index()
     for logname in listdir_by_creation(self.root):
-      path = os.path.join(self.root, logname)
+      if logname in index and not self._is_immediate_folder(logname):
+        self.segments[logname] = set()
+        for name in index[logname]:
+          self._add(logname, name)
+      else:
+        self._scan_dir(logname)
+
+    self.dirty = self._finished_segments() != {logname: set(names) for logname, names in index.items()}
+    self.seeded = self.inotify is not None
+    self.save()
+
+  def _add(self, logname, name):
+    if name not in self.immediate_priority and not self._is_immediate_folder(logname):
+      return
+
+    fn = os.path.join(self.root, logname, name)
+    if fn in self.pending:
+      return
+
+    try:
+      # skip files already uploaded
+      if getxattr(fn, UPLOAD_ATTR_NAME):
+        return
+      size = os.path.getsize(fn)
+    except OSError:
+      return  # deleter could have deleted
+
+    self.pending[fn] = (logname, name, size)
+    self.segments[logname].add(name)
+    if name in self.immediate_priority:
+      self.immediate_count += 1
+      self.immediate_size += size
+    self.dirty = True
+    heapq.heappush(self.heap, (self._priority(logname, name), fn))
+
+  def _remove(self, fn):
+    logname, name, size = self.pending.pop(fn)
+    self.segments[logname].discard(name)
+    if name in self.immediate_priority:
+      self.immediate_count -= 1
+      self.immediate_size -= size
+    self.dirty = True
+
+  def _drop_dir(self, logname):
+    for name in list(self.segments.get(logname, ())):
+      self._remove(os.path.join(self.root, logname, name))
+    if self.segments.pop(logname, None) is not None:
+      self.dirty = True
+    self.locked.discard(logname)
+
+  def _scan_dir(self, logname):
+    path = os.path.join(self.root, logname)
+
+    # watch before listing, so nothing written in between is missed
+    wd = None
+    if self.inotify is not None:
       try:
-        names = os.listdir(path)
+        wd = self.inotify.add_watch(path, DIR_EVENTS)
       except OSError:
+        return  # not a directory, or already deleted
+      self.watches[wd] = logname
+
+    try:
+      names = os.listdir(path)
+    except OSError:
+      return
+
+    # loggerd is still writing this segment, it is scanned again once its locks are gone
+    if any(name.endswith(".lock") for name in names):
+      self.locked.add(logname)
+      return
+
+    self.locked.discard(logname)
+    self.segments[logname] = set()
+    self.dirty = True
+    for name in names:
+      self._add(logname, name)
+
+    if wd is not None and not self._is_immediate_folder(logname):
+      del self.watches[wd]
+      self.inotify.rm_watch(wd)
+
+  def update(self):
+    if not self.seeded:
+      self.seed()
+      return
+
+    changed = set()
+    for wd, mask, name in self.inotify.read(timeout=0):
+      if mask & inotify.IN_Q_OVERFLOW:
+        # events were lost, start over
+        self.seed()
+        return
+
+      if mask & inotify.IN_IGNORED:
+        if self.watches.pop(wd, "") is None:
+          # the root is gone
+          self.seeded = False
         continue
 
-      if any(name.endswith(".lock") for name in names):
+      if wd not in self.watches:
         continue
 
-      for name in sorted(names, key=self.get_upload_sort):
-        key = os.path.join(logname, name)
-        fn = os.path.join(path, name)
-        # skip files already uploaded
-        try:
-          is_uploaded = getxattr(fn, UPLOAD_ATTR_NAME)
-        except OSError:
-          cloudlog.event("uploader_getxattr_failed", exc=self.last_exc, key=key, fn=fn)
-          is_uploaded = True  # deleter could have deleted
-        if is_uploaded:
-          continue
+      logname = self.watches[wd]
+      if logname is None:
+        if mask & (inotify.IN_DELETE | inotify.IN_MOVED_FROM):
+          self._drop_dir(name)
+          changed.discard(name)
+        else:
+          changed.add(name)
+      else:
+        changed.add(logname)
 
-        try:
-          if name in self.immediate_priority:
-            self.immediate_count += 1
-            self.immediate_size += os.path.getsize(fn)
-        except OSError:
-          pass
+    for logname in changed:
+      self._drop_dir(logname)
+      self._scan_dir(logname)
 
-        yield (name, key, fn)
+    self.save()
 
-  def next_file_to_upload(self):
-    upload_files = list(self.list_upload_files())
+  def _uploaded(self, fn):
+    # files can be uploaded by others, like athenad, without an event
+    try:
+      return bool(getxattr(fn, UPLOAD_ATTR_NAME))
+    except OSError:
+      return True  # deleter could have deleted
+
+  def peek(self):
+    """Returns the (logname, name, fn) of the file to upload next, or None"""
+    while self.heap:
+      fn = self.heap[0][1]
+      if fn in self.pending:
+        if not self._uploaded(fn):
+          return self.pending[fn][:2] + (fn,)
+        self._remove(fn)
+      heapq.heappop(self.heap)
+    return None
 
-    for name, key, fn in upload_files:
-      if any(f in fn for f in self.immediate_folders):
-        return (key, fn)
+  def recheck_immediate(self):
+    """Drops the pending qlogs and qcameras uploaded by others. peek() only notices them at the head of the queue."""
+    for fn, (_, name, _) in list(self.pending.items()):
+      if name in self.immediate_priority and self._uploaded(fn):
+        self._remove(fn)
+    self.last_recheck = time.monotonic()
+    self.save()
 
-    for name, key, fn in upload_files:
-      if name in self.immediate_priority:
-        return (key, fn)
+  def immediate_stats(self):
+    """Returns the count and total size of the pending qlogs and qcameras.
+    Uploads by others are counted at most IMMEDIATE_RECHECK_INTERVAL seconds late."""
+    if time.monotonic() - self.last_recheck >= IMMEDIATE_RECHECK_INTERVAL:
+      self.recheck_immediate()
+    return self.immediate_count, self.immediate_size
 
-    return None
+  def mark_uploaded(self, fn):
+    if fn in self.pending:
+      self._remove(fn)
+      self.save()
+
+
+class Uploader():
+  def __init__(self, dongle_id, root, index_file=UPLOAD_INDEX_FILE):
+    self.dongle_id = dongle_id
+    self.api = Api(dongle_id)
+    self.root = root
+
+    self.upload_thread = None
+
+    self.last_resp = None
+    self.last_exc = None
+    self.last_upload = None
+
+    # chunks already uploaded of the file that failed last, to resume on the next attempt
+    self.resume_fn = None
+    self.resume_chunks = set()
+
+    self.immediate_size = 0
+    self.immediate_count = 0
+
+    # stats for last successfully uploaded file
+    self.last_time = 0
+    self.last_speed = 0
+    self.last_chunk_count = 0
+    self.last_filename = ""
+
+    self.immediate_folders = ["crash/", "boot/"]
+    self.immediate_priority = {"qlog.bz2": 0, "qcamera.ts": 1}
+
+    self.upload_queue = UploadQueue(root, index_file, self.immediate_folders, self.immediate_priority)
+
+  def next_file_to_upload(self):
+    self.upload_queue.update()
+    self.immediate_count, self.immediate_size = self.upload_queue.immediate_stats()
+
+    d = self.upload_queue.peek()
+    if d is None:
+      return None
+
+    logname, name, fn = d
+    return (os.path.join(logname, name), fn)
 
   def do_upload(self, key, fn):
     try:
@@ -148,8 +357,11 @@ class Uploader():
 
         self.last_resp = FakeResponse()
       else:
-        with open(fn, "rb") as f:
-          self.last_resp = requests.put(url, data=f, headers=headers, timeout=10)
+        if fn != self.resume_fn:
+          self.resume_fn, self.resume_chunks = fn, set()
+        self.last_upload = ChunkedUpload(fn, url, headers, done_chunks=self.resume_chunks,
+                                         chunk_callback=self.resume_chunks.add, timeout=10)
+        self.last_resp = self.last_upload.run()
     except Exception as e:
       self.last_exc = (e, traceback.format_exc())
       raise
@@ -157,6 +369,7 @@ class Uploader():
   def normal_upload(self, key, fn):
     self.last_resp = None
     self.last_exc = None
+    self.last_upload = None
 
     try:
       self.do_upload(key, fn)
@@ -180,6 +393,7 @@ class Uploader():
         setxattr(fn, UPLOAD_ATTR_NAME, UPLOAD_ATTR_VALUE)
       except OSError:
         cloudlog.event("uploader_setxattr_failed", exc=self.last_exc, key=key, fn=fn, sz=sz)
+      self.upload_queue.mark_uploaded(fn)
       success = True
     else:
       start_time = time.monotonic()
@@ -190,10 +404,16 @@ class Uploader():
           setxattr(fn, UPLOAD_ATTR_NAME, UPLOAD_ATTR_VALUE)
         except OSError:
           cloudlog.event("uploader_setxattr_failed", exc=self.last_exc, key=key, fn=fn, sz=sz)
+        self.upload_queue.mark_uploaded(fn)
+        if fn == self.resume_fn:
+          self.resume_fn, self.resume_chunks = None, set()
 
+        # throughput counts the bytes sent by this attempt, not the ones resumed
+        sent = self.last_upload.sent if self.last_upload is not None else sz
         self.last_filename = fn
         self.last_time = time.monotonic() - start_time
-        self.last_speed = (sz / 1e6) / self.last_time
+        self.last_speed = (sent / 1e6) / self.last_time
+        self.last_chunk_count = self.last_upload.chunk_count if self.last_upload is not None else 1
         success = True
         cloudlog.event("upload_success" if stat.status_code != 412 else "upload_ignored", key=key, fn=fn, sz=sz, network_type=network_type, metered=metered)
       else:
@@ -209,6 +429,7 @@ class Uploader():
     us.immediateQueueCount = self.immediate_count
     us.lastTime = self.last_time
     us.lastSpeed = self.last_speed
+    us.lastChunkCount = self.last_chunk_count
     us.lastFilename = self.last_filename
     return msg
 
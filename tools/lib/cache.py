@@ -5,7 +5,7 @@ from common.file_helpers import mkdirs_exists_ok
 DEFAULT_CACHE_DIR = os.path.expanduser("~/.commacache")
 
 def cache_path_for_file_path(fn, cache_prefix=None):
-  dir_ = os.path.join(DEFAULT_CACHE_DIR, "local")
+  dir_ = cache_prefix if cache_prefix is not None else os.path.join(DEFAULT_CACHE_DIR, "local")
   mkdirs_exists_ok(dir_)
   fn_parsed = urllib.parse.urlparse(fn)
   if fn_parsed.scheme == '':
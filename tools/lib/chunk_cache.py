@@ -0,0 +1,128 @@
+import mmap
+import os
+import sqlite3
+import threading
+import time
+
+from common.file_helpers import mkdirs_exists_ok, atomic_write_in_dir
+
+DB_NAME = "chunks.db"
+# last_access is only written when it's older than this, so cache hits are mostly read-only
+ACCESS_UPDATE_INTERVAL = 60.
+
+
+class ChunkCache:
+  """Size-capped LRU cache of files in a directory, shared between processes.
+
+  Sizes and access times are kept in a sqlite database in the cache directory,
+  so the accounting survives restarts and concurrent writers are serialized by
+  sqlite's locking. Reads return read-only mmaps of the cached files. Access
+  times are kept to within ACCESS_UPDATE_INTERVAL.
+  """
+  def __init__(self, cache_dir, max_size):
+    self.cache_dir = cache_dir
+    self.max_size = max_size
+    self._local = threading.local()
+    self._access_lock = threading.Lock()
+    self._last_access = {}  # last_access of chunks as last read or written by this process
+
+  def _connect(self):
+    # sqlite connections can't be shared between threads, so every thread keeps its own.
+    # It's reopened when the cache directory was removed underneath us.
+    db_path = os.path.join(self.cache_dir, DB_NAME)
+    try:
+      inode = os.stat(db_path).st_ino
+    except FileNotFoundError:
+      inode = None
+
+    conn = getattr(self._local, "conn", None)
+    if conn is not None and inode == self._local.inode:
+      return conn
+
+    if conn is not None:
+      conn.close()
+      with self._access_lock:
+        self._last_access.clear()
+    mkdirs_exists_ok(self.cache_dir)
+    conn = sqlite3.connect(db_path, timeout=60)
+    # readers don't block the writer and commits don't fsync the whole database
+    conn.execute("PRAGMA journal_mode=WAL")
+    conn.execute("PRAGMA synchronous=NORMAL")
+    with conn:
+      conn.execute("CREATE TABLE IF NOT EXISTS chunks (name TEXT PRIMARY KEY, size INTEGER, last_access REAL)")
+      conn.execute("CREATE INDEX IF NOT EXISTS chunks_last_access ON chunks (last_access)")
+
+    self._local.conn = conn
+    self._local.inode = os.stat(db_path).st_ino
+    return conn
+
+  def _path(self, name):
+    return os.path.join(self.cache_dir, name)
+
+  def _touch(self, name, size):
+    now = time.time()
+    with self._access_lock:
+      last_access = self._last_access.get(name)
+    if last_access is not None and now - last_access < ACCESS_UPDATE_INTERVAL:
+      return
+
+    conn = self._connect()
+    row = conn.execute("SELECT last_access FROM chunks WHERE name=?", (name,)).fetchone()
+    if row is None or now - row[0] >= ACCESS_UPDATE_INTERVAL:
+      with conn:
+        conn.execute("INSERT INTO chunks VALUES (?, ?, ?) ON CONFLICT(name) DO UPDATE SET last_access=excluded.last_access",
+                     (name, size, now))
+      last_access = now
+    else:
+      last_access = row[0]
+
+    with self._access_lock:
+      self._last_access[name] = last_access
+
+  def get(self, name):
+    """Returns the contents of a cached file as a read-only buffer, or None on a miss."""
+    try:
+      with open(self._path(name), "rb") as f:
+        size = os.fstat(f.fileno()).st_size
+        dat = mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ) if size > 0 else b""
+    except FileNotFoundError:
+      return None
+
+    self._touch(name, size)
+    return dat
+
+  def put(self, name, dat):
+    conn = self._connect()
+    with atomic_write_in_dir(self._path(name), mode="wb", overwrite=True) as f:
+      f.write(dat)
+
+    now = time.time()
+    with conn:
+      conn.execute("INSERT OR REPLACE INTO chunks VALUES (?, ?, ?)", (name, len(dat), now))
+      evicted = self._evict(conn)
+
+    with self._access_lock:
+      self._last_access[name] = now
+      for n in evicted:
+        self._last_access.pop(n, None)
+
+  def _evict(self, conn):
+    total = conn.execute("SELECT COALESCE(SUM(size), 0) FROM chunks").fetchone()[0]
+    if total <= self.max_size:
+      return []
+
+    evicted = []
+    for name, size in conn.execute("SELECT name, size FROM chunks ORDER BY last_access").fetchall():
+      if total <= self.max_size:
+        break
+      conn.execute("DELETE FROM chunks WHERE name=?", (name,))
+      try:
+        os.remove(self._path(name))
+      except FileNotFoundError:
+        pass
+      total -= size
+      evicted.append(name)
+    return evicted
+
+  def size(self):
+    return self._connect().execute("SELECT COALESCE(SUM(size), 0) FROM chunks").fetchone()[0]
@@ -1,16 +1,22 @@
 # pylint: skip-file
+import itertools
 import json
+import mmap
 import os
-import pickle
 import struct
 import subprocess
 import tempfile
 import threading
+from collections import OrderedDict, defaultdict
+from concurrent.futures import ThreadPoolExecutor
 from enum import IntEnum
-from functools import wraps
 
 import numpy as np
-from lru import LRU
+
+try:
+  import av
+except ImportError:
+  av = None
 
 import _io
 from tools.lib.cache import cache_path_for_file_path
@@ -23,6 +29,10 @@ HEVC_SLICE_B = 0
 HEVC_SLICE_P = 1
 HEVC_SLICE_I = 2
 
+DECODE_THREADS = int(os.getenv("FRAMEREADER_DECODE_THREADS", str(os.cpu_count())))
+# default byte budget of decoded frames per pix_fmt
+FRAME_CACHE_BUDGET = int(os.getenv("FRAMEREADER_CACHE_MB", "256")) * 1024 * 1024
+
 
 class GOPReader:
   def get_gop(self, num):
@@ -76,71 +86,242 @@ def ffprobe(fn, fmt=None):
   return json.loads(ffprobe_output)
 
 
-def vidindex(fn, typ):
-  vidindex_dir = os.path.join(os.path.dirname(os.path.realpath(__file__)), "vidindex")
-  vidindex = os.path.join(vidindex_dir, "vidindex")
+HEVC_NAL_TYPE_BLA_W_LP = 16
+HEVC_NAL_TYPE_RSV_IRAP_VCL23 = 23
+HEVC_NAL_TYPE_VPS_NUT = 32
+HEVC_NAL_TYPE_SPS_NUT = 33
+HEVC_NAL_TYPE_PPS_NUT = 34
+HEVC_NAL_TYPE_SLICES = set(range(0, 10)) | set(range(16, 22))
+HEVC_NAL_TYPE_PARAMETER_SETS = (HEVC_NAL_TYPE_VPS_NUT, HEVC_NAL_TYPE_SPS_NUT, HEVC_NAL_TYPE_PPS_NUT)
+# bytes kept of slice NALs, enough for the start of the slice header
+NAL_HEAD_SIZE = 16
+
+VIDEO_INDEX_MAGIC = b"OPVIDIDX"
+VIDEO_INDEX_VERSION = 1
+VIDEO_INDEX_HEADER = struct.Struct("<8sIIIII")  # magic, version, w, h, prefix size, index entries
+
+
+class BitReader:
+  def __init__(self, dat):
+    self.dat = dat
+    self.pos = 0
+
+  def u(self, n):
+    ret = 0
+    for _ in range(n):
+      byte = self.dat[self.pos >> 3] if (self.pos >> 3) < len(self.dat) else 0
+      ret = (ret << 1) | ((byte >> (7 - (self.pos & 7))) & 1)
+      self.pos += 1
+    return ret
 
-  subprocess.check_call(["make"], cwd=vidindex_dir, stdout=open("/dev/null", "w"))
+  def ue(self):
+    leading_zeros = 0
+    while self.u(1) == 0 and leading_zeros < 32:
+      leading_zeros += 1
+    return (1 << leading_zeros) - 1 + self.u(leading_zeros)
+
+
+def hevc_sps_size(nal):
+  """Returns the (cropped) width and height from an SPS NAL, starting at its 3 byte start code."""
+  bs = BitReader(nal[5:].replace(b"\x00\x00\x03", b"\x00\x00"))  # strip emulation prevention bytes
+
+  bs.u(4)  # sps_video_parameter_set_id
+  max_sub_layers_minus1 = bs.u(3)
+  bs.u(1)  # sps_temporal_id_nesting_flag
+
+  # profile_tier_level
+  bs.u(88 + 8)  # general profile and level
+  sub_layers = [(bs.u(1), bs.u(1)) for _ in range(max_sub_layers_minus1)]
+  if max_sub_layers_minus1 > 0:
+    bs.u(2 * (8 - max_sub_layers_minus1))
+  for profile_present, level_present in sub_layers:
+    bs.u(88 * profile_present + 8 * level_present)
+
+  bs.ue()  # sps_seq_parameter_set_id
+  chroma_format_idc = bs.ue()
+  separate_colour_plane = bs.u(1) if chroma_format_idc == 3 else 0
+  w, h = bs.ue(), bs.ue()
+
+  if bs.u(1):  # conformance_window_flag
+    left, right, top, bottom = bs.ue(), bs.ue(), bs.ue(), bs.ue()
+    chroma_array_type = 0 if separate_colour_plane else chroma_format_idc
+    sub_width = 2 if chroma_array_type in (1, 2) else 1
+    sub_height = 2 if chroma_array_type == 1 else 1
+    w -= sub_width * (left + right)
+    h -= sub_height * (top + bottom)
+
+  return w, h
+
+
+class HEVCIndexer:
+  """Builds the slice index and parameter set prefix of an Annex-B HEVC stream.
+
+  Data can be fed in blocks as it arrives, e.g. while the file is downloading, and
+  only the first bytes of every slice NAL are copied. Offsets and prefix match the
+  old vidindex tool: NALs start at their 3 byte start code and run up to the next one.
+  """
+  def __init__(self):
+    self.size = 0
+    self.nal_start = None  # file offset of the current NAL
+    self.nal_head = bytearray()  # start of the current NAL, all of it for parameter sets
+    self.tail = b""  # last bytes fed, to find start codes split over two blocks
+    self.done = False
+
+    self.prefix = bytearray()
+    self.index = []
+    self.w, self.h = None, None
 
-  with tempfile.NamedTemporaryFile() as prefix_f, \
-       tempfile.NamedTemporaryFile() as index_f:
-    try:
-      subprocess.check_call([vidindex, typ, fn, prefix_f.name, index_f.name])
-    except subprocess.CalledProcessError:
-      raise DataUnreadableError(f"vidindex failed on file {fn}")
-    with open(index_f.name, "rb") as f:
-      index = f.read()
-    with open(prefix_f.name, "rb") as f:
-      prefix = f.read()
+  def _append(self, dat):
+    n = max(0, NAL_HEAD_SIZE - len(self.nal_head))
+    self.nal_head += dat[:n]
+    if len(dat) > n and ((self.nal_head[3] >> 1) & 0x3F) in HEVC_NAL_TYPE_PARAMETER_SETS:
+      self.nal_head += dat[n:]
 
-  index = np.frombuffer(index, np.uint32).reshape(-1, 2)
+  def _parse_nal(self, nal_size):
+    nal = bytes(self.nal_head[:nal_size])
+    if nal_size < 6:
+      self.done = True
+      return
 
-  assert index[-1, 0] == 0xFFFFFFFF
-  assert index[-1, 1] == os.path.getsize(fn)
+    nal_unit_type = (nal[3] >> 1) & 0x3F
+    if nal_unit_type in HEVC_NAL_TYPE_PARAMETER_SETS:
+      self.prefix += nal
+      if nal_unit_type == HEVC_NAL_TYPE_SPS_NUT and self.w is None:
+        self.w, self.h = hevc_sps_size(nal)
+    elif nal_unit_type in HEVC_NAL_TYPE_SLICES:
+      # slice_segment_header, assumes no extra slice header bits and dependent slices like vidindex did
+      bs = BitReader(nal[5:])
+      first_slice_segment_in_pic_flag = bs.u(1)
+      if HEVC_NAL_TYPE_BLA_W_LP <= nal_unit_type <= HEVC_NAL_TYPE_RSV_IRAP_VCL23:
+        bs.u(1)  # no_output_of_prior_pics_flag
+      bs.u(1)  # slice_pic_parameter_set_id
+      if first_slice_segment_in_pic_flag:
+        self.index.append((bs.ue(), self.nal_start))
+
+  def feed(self, dat):
+    base = self.size
+    self.size += len(dat)
+    if self.done or len(dat) == 0:
+      return
 
-  return index, prefix
+    dat = memoryview(dat)
+    if base == 0 and dat[0] != 0:
+      raise DataUnreadableError("video doesn't start with a 4 byte start code")
+
+    # start codes inside this block, and ones split with the previous block
+    a = np.frombuffer(dat, dtype=np.uint8)
+    ones = np.flatnonzero(a[2:] == 1)
+    start_codes = ones[(a[ones] == 0) & (a[ones + 1] == 0)] + base
+    edge = self.tail + bytes(dat[:2])
+    start_codes = [base - len(self.tail) + i for i in range(len(self.tail)) if edge[i:i+3] == b"\x00\x00\x01"] + start_codes.tolist()
+    self.tail = (self.tail + bytes(dat[-2:]))[-2:]
+    del a
+
+    for p in start_codes:
+      if self.nal_start is None:
+        if p != 1:
+          raise DataUnreadableError("video doesn't start with a 4 byte start code")
+      else:
+        if p > base:
+          self._append(dat[max(0, self.nal_start - base):p - base])
+        self._parse_nal(p - self.nal_start)
+        if self.done:
+          return
 
+      self.nal_start = p
+      # the start code's bytes that were in the previous block
+      self.nal_head = bytearray(max(0, base - p))
 
-def cache_fn(func):
-  @wraps(func)
-  def cache_inner(fn, *args, **kwargs):
-    if kwargs.pop('no_cache', None):
-      cache_path = None
-    else:
-      cache_prefix = kwargs.pop('cache_prefix', None)
-      cache_path = cache_path_for_file_path(fn, cache_prefix)
+    if self.nal_start is not None:
+      self._append(dat[max(0, self.nal_start - base):])
 
-    if cache_path and os.path.exists(cache_path):
-      with open(cache_path, "rb") as cache_file:
-        cache_value = pickle.load(cache_file)
-    else:
-      cache_value = func(fn, *args, **kwargs)
+  def finish(self):
+    """Indexes the last NAL and returns (index, prefix) like vidindex."""
+    if self.nal_start is None:
+      raise DataUnreadableError("video doesn't start with a 4 byte start code")
+
+    if not self.done:
+      # like vidindex, the last NAL ends 4 bytes before the end of the file
+      self._parse_nal(max(1, self.size - 4 - self.nal_start))
+      self.done = True
 
-      if cache_path:
-        with atomic_write_in_dir(cache_path, mode="wb", overwrite=True) as cache_file:
-          pickle.dump(cache_value, cache_file, -1)
+    index = np.array(self.index + [(0xFFFFFFFF, self.size)], dtype=np.uint32).reshape(-1, 2)
+    return index, bytes(self.prefix)
 
-    return cache_value
 
-  return cache_inner
+def hevc_index(fn):
+  indexer = HEVCIndexer()
+  with FileReader(fn) as f:
+    if isinstance(f, _io.BufferedReader):
+      with mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ) as mm:
+        indexer.feed(mm)
+    else:
+      # index while downloading
+      while True:
+        dat = f.read(1024*1024)
+        if len(dat) == 0:
+          break
+        indexer.feed(dat)
 
+  index, prefix = indexer.finish()
+  if indexer.w is None:
+    raise DataUnreadableError(f"no SPS found in {fn}")
+  return {
+    'index': index,
+    'global_prefix': prefix,
+    'w': indexer.w,
+    'h': indexer.h,
+  }
 
-@cache_fn
-def index_stream(fn, typ):
-  assert typ in ("hevc", )
 
-  with FileReader(fn) as f:
-    assert os.path.exists(f.name), fn
-    index, prefix = vidindex(f.name, typ)
-    probe = ffprobe(f.name, typ)
+def write_video_index(f, index_data):
+  index = np.ascontiguousarray(index_data['index'], dtype='<u4')
+  f.write(VIDEO_INDEX_HEADER.pack(VIDEO_INDEX_MAGIC, VIDEO_INDEX_VERSION, index_data['w'], index_data['h'],
+                                  len(index_data['global_prefix']), index.shape[0]))
+  f.write(index_data['global_prefix'])
+  f.write(index.tobytes())
 
+
+def read_video_index(f):
+  """Returns the index written by write_video_index, or None if it's from another version."""
+  header = f.read(VIDEO_INDEX_HEADER.size)
+  if len(header) != VIDEO_INDEX_HEADER.size:
+    return None
+  magic, version, w, h, prefix_size, num_entries = VIDEO_INDEX_HEADER.unpack(header)
+  if magic != VIDEO_INDEX_MAGIC or version != VIDEO_INDEX_VERSION:
+    return None
+
+  prefix = f.read(prefix_size)
+  index = np.frombuffer(f.read(num_entries * 8), dtype='<u4').reshape(-1, 2)
   return {
     'index': index,
     'global_prefix': prefix,
-    'probe': probe
+    'w': w,
+    'h': h,
   }
 
 
+def video_index_cache_path(fn, cache_prefix=None):
+  return cache_path_for_file_path(fn, cache_prefix) + ".vidindex"
+
+
+def index_stream(fn, typ, cache_prefix=None, no_cache=False):
+  assert typ in ("hevc", )
+
+  cache_path = None if no_cache else video_index_cache_path(fn, cache_prefix)
+  if cache_path and os.path.exists(cache_path):
+    with open(cache_path, "rb") as cache_file:
+      index_data = read_video_index(cache_file)
+    if index_data is not None:
+      return index_data
+
+  index_data = hevc_index(fn)
+  if cache_path:
+    with atomic_write_in_dir(cache_path, mode="wb", overwrite=True) as cache_file:
+      write_video_index(cache_file, index_data)
+  return index_data
+
+
 def index_videos(camera_paths, cache_prefix=None):
   """Requires that paths in camera_paths are contiguous and of the same type."""
   if len(camera_paths) < 1:
@@ -152,30 +333,17 @@ def index_videos(camera_paths, cache_prefix=None):
 
 
 def index_video(fn, frame_type=None, cache_prefix=None):
-  cache_path = cache_path_for_file_path(fn, cache_prefix)
-
-  if os.path.exists(cache_path):
-    return
-
   if frame_type is None:
-    frame_type = fingerprint_video(fn[0])
+    frame_type = fingerprint_video(fn)
 
   if frame_type == FrameType.h265_stream:
-    index_stream(fn, "hevc", cache_prefix=cache_prefix)
+    return index_stream(fn, "hevc", cache_prefix=cache_prefix)
   else:
     raise NotImplementedError("Only h265 supported")
 
 
 def get_video_index(fn, frame_type, cache_prefix=None):
-  cache_path = cache_path_for_file_path(fn, cache_prefix)
-
-  if not os.path.exists(cache_path):
-    index_video(fn, frame_type, cache_prefix)
-
-  if not os.path.exists(cache_path):
-    return None
-  with open(cache_path, "rb") as cache_file:
-    return pickle.load(cache_file)
+  return index_video(fn, frame_type, cache_prefix)
 
 
 def read_file_check_size(f, sz, cookie):
@@ -235,16 +403,161 @@ def decompress_video_data(rawdat, vid_fmt, w, h, pix_fmt):
     if proc.wait() != 0:
       raise DataUnreadableError("ffmpeg failed")
 
+  return np.frombuffer(dat, dtype=np.uint8).reshape((-1,) + frame_shape(w, h, pix_fmt))
+
+
+def frame_shape(w, h, pix_fmt):
   if pix_fmt == "rgb24":
-    ret = np.frombuffer(dat, dtype=np.uint8).reshape(-1, h, w, 3)
+    return (h, w, 3)
   elif pix_fmt == "yuv420p":
-    ret = np.frombuffer(dat, dtype=np.uint8).reshape(-1, (h*w*3//2))
+    return (h*w*3//2,)
   elif pix_fmt == "yuv444p":
-    ret = np.frombuffer(dat, dtype=np.uint8).reshape(-1, 3, h, w)
+    return (3, h, w)
   else:
     raise NotImplementedError
 
-  return ret
+
+class AVDecoder:
+  """libav decoder that is flushed and reused for every GOP instead of starting an ffmpeg process per GOP.
+
+  Decodes with the same settings as the ffmpeg command line of decompress_video_data, including FFMPEG_THREADS
+  and FFMPEG_CUDA. Every frame is returned in its own array, so they can be cached without a copy.
+  """
+  def __init__(self, vid_fmt):
+    self.vid_fmt = vid_fmt
+    self.ctx = self._create()
+
+  def _create(self):
+    if os.getenv("FFMPEG_CUDA", "0") == "1":
+      ctx = av.CodecContext.create(self.vid_fmt, "r", hwaccel=av.codec.hwaccel.HWAccel("cuda"))
+    else:
+      ctx = av.CodecContext.create(self.vid_fmt, "r")
+    ctx.options = {"flags2": "+showall"}  # output the frames before the first keyframe, like -flags2 showall
+    ctx.thread_count = int(os.getenv("FFMPEG_THREADS", "0"))
+    ctx.thread_type = "AUTO"
+    return ctx
+
+  def _reset(self):
+    if hasattr(self.ctx, "flush_buffers"):
+      self.ctx.flush_buffers()
+    else:
+      self.ctx = self._create()
+
+  def decode(self, rawdat, w, h, pix_fmt):
+    try:
+      frames = [f for packet in self.ctx.parse(bytes(rawdat)) + self.ctx.parse(None) for f in self.ctx.decode(packet)]
+      frames += self.ctx.decode(None)
+    except av.error.FFmpegError as e:
+      self.ctx = self._create()
+      raise DataUnreadableError("libav failed") from e
+    self._reset()
+
+    shape = frame_shape(w, h, pix_fmt)
+    return [f.to_ndarray(format=pix_fmt).reshape(shape) for f in frames]
+
+
+_decoders = threading.local()
+_decode_pool = None
+
+
+def decode_video_data(rawdat, vid_fmt, w, h, pix_fmt):
+  """Decodes a GOP with this thread's long-lived libav decoder, falling back to ffmpeg if PyAV isn't installed.
+
+  Returns a list of frames with libav, and one array of all the frames with ffmpeg.
+  """
+  if av is None:
+    return decompress_video_data(rawdat, vid_fmt, w, h, pix_fmt)
+
+  decoders = _decoders.__dict__.setdefault("decoders", {})
+  if vid_fmt not in decoders:
+    decoders[vid_fmt] = AVDecoder(vid_fmt)
+  return decoders[vid_fmt].decode(rawdat, w, h, pix_fmt)
+
+
+def get_decode_pool():
+  # threads live for the whole process, so their decoders are only created once
+  global _decode_pool
+  if _decode_pool is None:
+    _decode_pool = ThreadPoolExecutor(max_workers=DECODE_THREADS)
+  return _decode_pool
+
+
+class FrameCache:
+  """LRU cache of decoded frames bounded in bytes, with a separate budget per pix_fmt.
+
+  Keys are (reader, frame number, pix_fmt), so one instance can be shared by several readers.
+  """
+  def __init__(self, budget=FRAME_CACHE_BUDGET, pix_fmt_budgets=None):
+    self.budget = budget
+    self.pix_fmt_budgets = pix_fmt_budgets or {}
+
+    self.lock = threading.RLock()
+    self.frames = defaultdict(OrderedDict)
+    self.nbytes = defaultdict(int)
+
+    self.hits = 0
+    self.misses = 0
+    self.evictions = 0
+
+  def __contains__(self, key):
+    with self.lock:
+      return key in self.frames[key[-1]]
+
+  def get(self, key):
+    pix_fmt = key[-1]
+    with self.lock:
+      frame = self.frames[pix_fmt].get(key)
+      if frame is None:
+        self.misses += 1
+      else:
+        self.hits += 1
+        self.frames[pix_fmt].move_to_end(key)
+      return frame
+
+  def put(self, key, frame):
+    """Caches frame and returns the cached array. Views into a larger buffer, like a GOP decoded by ffmpeg,
+    are copied, so the budget counts every byte kept alive."""
+    base = frame
+    while isinstance(base, np.ndarray) and base.base is not None:
+      base = base.base
+    if memoryview(base).nbytes > frame.nbytes:
+      frame = frame.copy()
+
+    pix_fmt = key[-1]
+    budget = self.pix_fmt_budgets.get(pix_fmt, self.budget)
+    with self.lock:
+      frames = self.frames[pix_fmt]
+      if key in frames:
+        self.nbytes[pix_fmt] -= frames.pop(key).nbytes
+      frames[key] = frame
+      self.nbytes[pix_fmt] += frame.nbytes
+
+      while self.nbytes[pix_fmt] > budget and len(frames) > 1:
+        _, evicted = frames.popitem(last=False)
+        self.nbytes[pix_fmt] -= evicted.nbytes
+        self.evictions += 1
+      return frame
+
+  def stats(self):
+    with self.lock:
+      return {
+        'hits': self.hits,
+        'misses': self.misses,
+        'evictions': self.evictions,
+        'frames': {pix_fmt: len(frames) for pix_fmt, frames in self.frames.items()},
+        'nbytes': dict(self.nbytes),
+      }
+
+
+_shared_frame_cache = None
+
+
+def get_shared_frame_cache():
+  """Process-wide FrameCache, to open several cameras under one memory budget."""
+  global _shared_frame_cache
+  if _shared_frame_cache is None:
+    _shared_frame_cache = FrameCache()
+  return _shared_frame_cache
 
 
 class BaseFrameReader:
@@ -263,14 +576,15 @@ class BaseFrameReader:
     raise NotImplementedError
 
 
-def FrameReader(fn, cache_prefix=None, readahead=False, readbehind=False, index_data=None):
+def FrameReader(fn, cache_prefix=None, readahead=False, readbehind=False, index_data=None, frame_cache=None, readahead_gops=2):
   frame_type = fingerprint_video(fn)
   if frame_type == FrameType.raw:
     return RawFrameReader(fn)
   elif frame_type in (FrameType.h265_stream,):
     if not index_data:
       index_data = get_video_index(fn, frame_type, cache_prefix)
-    return StreamFrameReader(fn, frame_type, index_data, readahead=readahead, readbehind=readbehind)
+    return StreamFrameReader(fn, frame_type, index_data, readahead=readahead, readbehind=readbehind,
+                             frame_cache=frame_cache, readahead_gops=readahead_gops)
   else:
     raise NotImplementedError(frame_type)
 
@@ -414,7 +728,6 @@ class StreamGOPReader(GOPReader):
 
     self.index = index_data['index']
     self.prefix = index_data['global_prefix']
-    probe = index_data['probe']
 
     self.prefix_frame_data = None
     self.num_prefix_frames = 0
@@ -429,8 +742,12 @@ class StreamGOPReader(GOPReader):
 
     self.frame_count = len(self.index) - 1
 
-    self.w = probe['streams'][0]['width']
-    self.h = probe['streams'][0]['height']
+    if 'w' in index_data:
+      self.w, self.h = index_data['w'], index_data['h']
+    else:
+      # index_data from an ffprobe based index
+      self.w = index_data['probe']['streams'][0]['width']
+      self.h = index_data['probe']['streams'][0]['height']
 
   def _lookup_gop(self, num):
     frame_b = num
@@ -471,18 +788,21 @@ class StreamGOPReader(GOPReader):
 
 class GOPFrameReader(BaseFrameReader):
   #FrameReader with caching and readahead for formats that are group-of-picture based
+  _reader_ids = itertools.count()
 
-  def __init__(self, readahead=False, readbehind=False):
+  def __init__(self, readahead=False, readbehind=False, frame_cache=None, readahead_gops=2):
     self.open_ = True
 
     self.readahead = readahead
     self.readbehind = readbehind
-    self.frame_cache = LRU(64)
+    self.frame_cache = frame_cache if frame_cache is not None else FrameCache()
+    self.reader_id = next(self._reader_ids)
 
     if self.readahead:
       self.cache_lock = threading.RLock()
       self.readahead_last = None
-      self.readahead_len = 30
+      self.readahead_gops = readahead_gops
+      self.last_num = None
       self.readahead_c = threading.Condition()
       self.readahead_thread = threading.Thread(target=self._readahead_thread)
       self.readahead_thread.daemon = True
@@ -513,35 +833,47 @@ class GOPFrameReader(BaseFrameReader):
       if not self.open_:
         break
       assert self.readahead_last
-      num, pix_fmt = self.readahead_last
+      num, step, pix_fmt = self.readahead_last
 
-      if self.readbehind:
-        for k in range(num - 1, max(0, num - self.readahead_len), -1):
-          self._get_one(k, pix_fmt)
-      else:
-        for k in range(num, min(self.frame_count, num + self.readahead_len)):
-          self._get_one(k, pix_fmt)
+      # follow playback: the next GOPs in the direction of travel, or every step frames when skipping faster than a GOP
+      for _ in range(self.readahead_gops):
+        if not (0 <= num < self.frame_count) or not self.open_:
+          break
+        frame_b, frame_e, _, _ = self._lookup_gop(num)
+        self._get_one(num, pix_fmt)
+
+        if abs(step) > frame_e - frame_b:
+          num += step
+        elif step > 0:
+          num = frame_e
+        else:
+          num = frame_b - 1
 
   def _get_one(self, num, pix_fmt):
     assert num < self.frame_count
 
-    if (num, pix_fmt) in self.frame_cache:
-      return self.frame_cache[(num, pix_fmt)]
+    frame = self.frame_cache.get((self.reader_id, num, pix_fmt))
+    if frame is not None:
+      return frame
 
     with self.cache_lock:
-      if (num, pix_fmt) in self.frame_cache:
-        return self.frame_cache[(num, pix_fmt)]
+      # decoded by another thread while we waited for the lock
+      if (self.reader_id, num, pix_fmt) in self.frame_cache:
+        return self.frame_cache.get((self.reader_id, num, pix_fmt))
+
+      frame_b, ret = self._decode_gop(num, pix_fmt)
+      frames = [self.frame_cache.put((self.reader_id, frame_b+i, pix_fmt), ret[i]) for i in range(len(ret))]
 
-      frame_b, num_frames, skip_frames, rawdat = self.get_gop(num)
+      return frames[num - frame_b]
 
-      ret = decompress_video_data(rawdat, self.vid_fmt, self.w, self.h, pix_fmt)
-      ret = ret[skip_frames:]
-      assert ret.shape[0] == num_frames
+  def _decode_gop(self, num, pix_fmt):
+    frame_b, num_frames, skip_frames, rawdat = self.get_gop(num)
 
-      for i in range(ret.shape[0]):
-        self.frame_cache[(frame_b+i, pix_fmt)] = ret[i]
+    ret = decode_video_data(rawdat, self.vid_fmt, self.w, self.h, pix_fmt)
+    ret = ret[skip_frames:]
+    assert len(ret) == num_frames
 
-      return self.frame_cache[(num, pix_fmt)]
+    return frame_b, ret
 
   def get(self, num, count=1, pix_fmt="yuv420p"):
     assert self.frame_count is not None
@@ -555,18 +887,58 @@ class GOPFrameReader(BaseFrameReader):
     ret = [self._get_one(num + i, pix_fmt) for i in range(count)]
 
     if self.readahead:
-      self.readahead_last = (num+count, pix_fmt)
+      if self.last_num is not None and num != self.last_num:
+        step = num - self.last_num
+      else:
+        step = -count if self.readbehind else count
+      self.last_num = num
+
+      self.readahead_last = (num+count if step > 0 else num-1, step, pix_fmt)
       self.readahead_c.acquire()
       self.readahead_c.notify()
       self.readahead_c.release()
 
     return ret
 
+  def get_range(self, num, count, pix_fmt="yuv420p"):
+    """Like get, but decodes all the GOPs the range touches concurrently on the decode pool."""
+    assert self.frame_count is not None
+
+    if num + count > self.frame_count:
+      raise ValueError(f"{num + count} > {self.frame_count}")
+
+    if pix_fmt not in ("yuv420p", "rgb24", "yuv444p"):
+      raise ValueError(f"Unsupported pixel format {pix_fmt!r}")
+
+    ret = [self.frame_cache.get((self.reader_id, i, pix_fmt)) for i in range(num, num + count)]
+
+    # first missing frame of every GOP that still has to be decoded
+    to_decode = []
+    i = num
+    while i < num + count:
+      frame_b, frame_e, _, _ = self._lookup_gop(i)
+      if any(ret[k - num] is None for k in range(i, min(frame_e, num + count))):
+        to_decode.append(i)
+      i = frame_e
+
+    def decode(k):
+      # cached on the decoding thread, so ffmpeg's GOP buffers are released as soon as possible
+      frame_b, frames = self._decode_gop(k, pix_fmt)
+      with self.cache_lock:
+        return frame_b, [self.frame_cache.put((self.reader_id, frame_b+i, pix_fmt), frames[i]) for i in range(len(frames))]
+
+    for frame_b, frames in get_decode_pool().map(decode, to_decode):
+      for i, frame in enumerate(frames):
+        if num <= frame_b + i < num + count:
+          ret[frame_b + i - num] = frame
+
+    return ret
+
 
 class StreamFrameReader(StreamGOPReader, GOPFrameReader):
-  def __init__(self, fn, frame_type, index_data, readahead=False, readbehind=False):
+  def __init__(self, fn, frame_type, index_data, readahead=False, readbehind=False, frame_cache=None, readahead_gops=2):
     StreamGOPReader.__init__(self, fn, frame_type, index_data)
-    GOPFrameReader.__init__(self, readahead, readbehind)
+    GOPFrameReader.__init__(self, readahead, readbehind, frame_cache, readahead_gops)
 
 
 def GOPFrameIterator(gop_reader, pix_fmt):
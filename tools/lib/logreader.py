@@ -2,32 +2,76 @@
 import os
 import sys
 import bz2
+import struct
+import concurrent.futures
 import urllib.parse
 import capnp
+import numpy as np
 
 from cereal import log as capnp_log
+from common.file_helpers import atomic_write_in_dir, mkdirs_exists_ok
+from tools.lib.cache import cache_path_for_file_path
 from tools.lib.filereader import FileReader
 from tools.lib.route import Route, SegmentName
 
+STREAM_READ_SIZE = 1024 * 1024
+LOG_INDEX_VERSION = 1
+LOG_COLUMNS_VERSION = 2
+
 # this is an iterator itself, and uses private variables from LogReader
 class MultiLogIterator:
-  def __init__(self, log_paths, sort_by_time=False):
+  def __init__(self, log_paths, sort_by_time=False, services=None, readahead=0):
     self._log_paths = log_paths
     self.sort_by_time = sort_by_time
+    self.services = services
+    self.readahead = readahead
+
+    # logs after the current one are downloaded and parsed in the background
+    self._prefetch_pool = concurrent.futures.ThreadPoolExecutor(max_workers=readahead) if readahead > 0 else None
+    self._prefetched = {}
 
-    self._first_log_idx = next(i for i in range(len(log_paths)) if log_paths[i] is not None)
+    self._log_readers = [None]*len(log_paths)
+    self._first_log_idx = self._next_log(0)
     self._current_log = self._first_log_idx
     self._idx = 0
-    self._log_readers = [None]*len(log_paths)
-    self.start_time = self._log_reader(self._first_log_idx)._ts[0]
+    self.start_time = self._start_time()
+
+  def _start_time(self):
+    # seek and tell count from the first event of the route, not the first one the services filter keeps
+    first = next((i for i, p in enumerate(self._log_paths) if p is not None), None)
+    if first is None:
+      return 0
+    if self.services is None:
+      ts = self._log_reader(first)._ts
+      return ts[0] if len(ts) else 0
+
+    mono_times = get_log_index(self._log_paths[first])['mono_time']
+    if len(mono_times) == 0:
+      return 0
+    return int(mono_times.min() if self.sort_by_time else mono_times[0])
 
   def _log_reader(self, i):
     if self._log_readers[i] is None and self._log_paths[i] is not None:
-      log_path = self._log_paths[i]
-      self._log_readers[i] = LogReader(log_path, sort_by_time=self.sort_by_time)
+      if i in self._prefetched:
+        self._log_readers[i] = self._prefetched.pop(i).result()
+      else:
+        log_path = self._log_paths[i]
+        self._log_readers[i] = LogReader(log_path, sort_by_time=self.sort_by_time, services=self.services)
+
+    if self._prefetch_pool is not None:
+      for j in range(i + 1, min(i + 1 + self.readahead, len(self._log_paths))):
+        if self._log_paths[j] is not None and self._log_readers[j] is None and j not in self._prefetched:
+          self._prefetched[j] = self._prefetch_pool.submit(LogReader, self._log_paths[j], sort_by_time=self.sort_by_time,
+                                                           services=self.services)
 
     return self._log_readers[i]
 
+  def _next_log(self, i):
+    # first log from i on that has events, the services filter can leave logs empty
+    while i < len(self._log_paths) and (self._log_paths[i] is None or len(self._log_reader(i)._ents) == 0):
+      i += 1
+    return i
+
   def __iter__(self):
     return self
 
@@ -37,12 +81,11 @@ class MultiLogIterator:
       self._idx += 1
     else:
       self._idx = 0
-      self._current_log = next(i for i in range(self._current_log + 1, len(self._log_readers) + 1)
-                               if i == len(self._log_readers) or self._log_paths[i] is not None)
-      if self._current_log == len(self._log_readers):
-        raise StopIteration
+      self._current_log = self._next_log(self._current_log + 1)
 
   def __next__(self):
+    if self._current_log == len(self._log_readers):
+      raise StopIteration
     while 1:
       lr = self._log_reader(self._current_log)
       ret = lr._ents[self._idx]
@@ -61,35 +104,90 @@ class MultiLogIterator:
 
     self._current_log = minute
 
-    # HACK: O(n) seek afterward
-    self._idx = 0
-    while self.tell() < ts:
+    # first event at or past ts, or the start of the next log if there is none
+    lr = self._log_reader(minute)
+    self._idx = int(np.searchsorted(lr._ts_max, self.start_time + int(ts * 1e9)))
+    if self._idx == len(lr._ents):
+      self._idx -= 1
       self._inc()
     return True
 
+  def close(self):
+    # __init__ may have failed before the pool was made
+    if getattr(self, "_prefetch_pool", None) is not None:
+      self._prefetch_pool.shutdown(wait=False, cancel_futures=True)
+      self._prefetch_pool = None
+      self._prefetched = {}
+
+  def __enter__(self):
+    return self
+
+  def __exit__(self, *args):
+    self.close()
+
+  def __del__(self):
+    self.close()
+
   def reset(self):
-    self.__init__(self._log_paths, sort_by_time=self.sort_by_time)
+    self.close()
+    self.__init__(self._log_paths, sort_by_time=self.sort_by_time, services=self.services, readahead=self.readahead)
+
+def load_log_data(fn, services=None, cache_prefix=None):
+  """Returns the decompressed capnp data of a log, only keeping the events of services if given."""
+  _, ext = os.path.splitext(urllib.parse.urlparse(fn).path)
+  with FileReader(fn) as f:
+    dat = f.read()
+
+  if ext == "":
+    # old rlogs weren't bz2 compressed
+    pass
+  elif ext == ".bz2":
+    dat = bz2.decompress(dat)
+  else:
+    raise Exception(f"unknown extension {ext}")
+
+  if services is not None:
+    # only hand the frames of the requested services to capnp
+    index = get_log_index(fn, cache_prefix=cache_prefix, dat=dat)
+    mask = np.isin(index['which'], [i for i, s in enumerate(index['services']) if s in services])
+    dat_view = memoryview(dat)
+    dat = b"".join(dat_view[o:o+sz] for o, sz in zip(index['offset'][mask], index['size'][mask]))
+
+  return dat
+
 
 class LogReader:
-  def __init__(self, fn, canonicalize=True, only_union_types=False, sort_by_time=False):
+  def __init__(self, fn, canonicalize=True, only_union_types=False, sort_by_time=False, services=None, dat=None):
     data_version = None
-    _, ext = os.path.splitext(urllib.parse.urlparse(fn).path)
-    with FileReader(fn) as f:
-      dat = f.read()
-
-    if ext == "":
-      # old rlogs weren't bz2 compressed
-      ents = capnp_log.Event.read_multiple_bytes(dat)
-    elif ext == ".bz2":
-      dat = bz2.decompress(dat)
-      ents = capnp_log.Event.read_multiple_bytes(dat)
-    else:
-      raise Exception(f"unknown extension {ext}")
+    if dat is None:
+      dat = load_log_data(fn, services)
 
-    self._ents = list(sorted(ents, key=lambda x: x.logMonoTime) if sort_by_time else ents)
+    ents = capnp_log.Event.read_multiple_bytes(dat)
+    # file order is kept for the column cache, which has to be the same for every reader
+    self._file_ents = list(ents)
+    self._ents = list(sorted(self._file_ents, key=lambda x: x.logMonoTime)) if sort_by_time else self._file_ents
     self._ts = [x.logMonoTime for x in self._ents]
+    # running max of _ts, logs are only mostly sorted by time so this is what can be bisected
+    self._ts_max = np.maximum.accumulate(np.array(self._ts, dtype=np.uint64))
     self.data_version = data_version
     self._only_union_types = only_union_types
+    self._fn = fn
+    self._services = services
+    self._sort_by_time = sort_by_time
+
+  def to_columns(self, fields, cache_prefix=None):
+    """Returns {service: structured array} of the requested fields, see get_log_columns.
+
+    Rows are sorted by logMonoTime like the events if the reader sorts by time.
+    """
+    ents = None
+    if self._services is None or all(s in self._services for s in fields):
+      ents = self._file_ents
+    ret = get_log_columns(self._fn, fields, cache_prefix=cache_prefix, ents=ents)
+    if self._sort_by_time:
+      # stable, so rows end up in the same order as the sorted events
+      ret = {service: arr[np.argsort(arr['logMonoTime'], kind='stable')] for service, arr in ret.items()}
+    return ret
 
   def __iter__(self):
     for ent in self._ents:
@@ -103,13 +201,264 @@ class LogReader:
         yield ent
 
 
-def logreader_from_route_or_segment(r, sort_by_time=False):
+def _capnp_message_size(buf, pos):
+  # size of the capnp stream message framed at buf[pos:], or None if the header is incomplete
+  if len(buf) - pos < 4:
+    return None
+  num_segments = struct.unpack_from("<I", buf, pos)[0] + 1
+  header_size = (4 + 4 * num_segments + 7) & ~7
+  if len(buf) - pos < header_size:
+    return None
+  segment_words = struct.unpack_from(f"<{num_segments}I", buf, pos + 4)
+  return header_size + 8 * sum(segment_words)
+
+
+def stream_log_chunks(fn, read_size=STREAM_READ_SIZE):
+  """Yields decompressed log data in blocks that end on capnp message boundaries."""
+  _, ext = os.path.splitext(urllib.parse.urlparse(fn).path)
+  if ext == "":
+    # old rlogs weren't bz2 compressed
+    decompressor = None
+  elif ext == ".bz2":
+    decompressor = bz2.BZ2Decompressor()
+  else:
+    raise Exception(f"unknown extension {ext}")
+
+  buf = bytearray()
+  with FileReader(fn) as f:
+    while True:
+      dat = f.read(read_size)
+      if len(dat) == 0:
+        break
+      if decompressor is not None:
+        dat = decompressor.decompress(dat)
+        # handle concatenated bz2 streams the same way bz2.decompress does
+        while decompressor.eof and decompressor.unused_data:
+          unused_data = decompressor.unused_data
+          decompressor = bz2.BZ2Decompressor()
+          dat += decompressor.decompress(unused_data)
+      buf += dat
+
+      pos = 0
+      while True:
+        size = _capnp_message_size(buf, pos)
+        if size is None or pos + size > len(buf):
+          break
+        pos += size
+
+      if pos > 0:
+        yield bytes(buf[:pos])
+        del buf[:pos]
+
+  # trailing bytes of a truncated log are dropped
+
+
+class StreamingLogReader:
+  """LogReader that decompresses and decodes lazily, keeping memory bounded by one read block.
+
+  Events are yielded in file order; iterating again rereads the file.
+  """
+  def __init__(self, fn, canonicalize=True, only_union_types=False, read_size=STREAM_READ_SIZE):
+    self._fn = fn
+    self._only_union_types = only_union_types
+    self._read_size = read_size
+
+  def __iter__(self):
+    for dat in stream_log_chunks(self._fn, self._read_size):
+      for ent in capnp_log.Event.read_multiple_bytes(dat):
+        if self._only_union_types:
+          try:
+            ent.which()
+          except capnp.lib.capnp.KjException:
+            continue
+        yield ent
+
+
+def build_log_index(fn, dat=None):
+  """Returns the byte offset and size in the decompressed log, logMonoTime and service of every event.
+
+  dat is the already decompressed log, if there is none the log is streamed from fn.
+  """
+  offsets, sizes, mono_times, which = [], [], [], []
+  services = {}
+
+  offset = 0
+  for dat in (stream_log_chunks(fn) if dat is None else [dat]):
+    pos = 0
+    for ent in capnp_log.Event.read_multiple_bytes(dat):
+      size = _capnp_message_size(dat, pos)
+      try:
+        service = ent.which()
+      except capnp.lib.capnp.KjException:
+        service = ""
+
+      offsets.append(offset + pos)
+      sizes.append(size)
+      mono_times.append(ent.logMonoTime)
+      which.append(services.setdefault(service, len(services)))
+      pos += size
+    offset += len(dat)
+
+  return {
+    'offset': np.array(offsets, dtype=np.uint64),
+    'size': np.array(sizes, dtype=np.uint64),
+    'mono_time': np.array(mono_times, dtype=np.uint64),
+    'which': np.array(which, dtype=np.uint16),
+    'services': list(services),
+  }
+
+
+def get_log_index(fn, cache_prefix=None, dat=None):
+  """Loads the event index of a log from the cache, building it on first use (from dat if given)."""
+  cache_path = cache_path_for_file_path(fn, cache_prefix) + ".logindex"
+
+  if os.path.exists(cache_path):
+    with np.load(cache_path, allow_pickle=False) as index:
+      if index['version'] == LOG_INDEX_VERSION:
+        ret = {k: index[k] for k in ('offset', 'size', 'mono_time', 'which')}
+        ret['services'] = index['services'].tolist()
+        return ret
+
+  index = build_log_index(fn, dat)
+  with atomic_write_in_dir(cache_path, mode="wb", overwrite=True) as cache_file:
+    np.savez(cache_file, version=LOG_INDEX_VERSION, **{k: np.array(v) for k, v in index.items()})
+  return index
+
+
+def _get_field(struct, path):
+  for name in path.split("."):
+    struct = getattr(struct, name)
+  return struct
+
+
+def _events_to_columns(ents, service, fields):
+  # services that are lists (e.g. can) get one row per list element
+  mono_times = []
+  values = {f: [] for f in fields}
+  for ent in ents:
+    try:
+      if ent.which() != service:
+        continue
+    except capnp.lib.capnp.KjException:
+      continue
+
+    msg = getattr(ent, service)
+    rows = msg if isinstance(msg, capnp.lib.capnp._DynamicListReader) else [msg]
+    for row in rows:
+      mono_times.append(ent.logMonoTime)
+      for f in fields:
+        values[f].append(_get_field(row, f))
+
+  columns = {'logMonoTime': np.array(mono_times, dtype=np.uint64)}
+  for f in fields:
+    if len(values[f]) and isinstance(values[f][0], bytes):
+      # np.bytes_ drops trailing zeros, so keep raw bytes and their lengths instead
+      lens = np.array([len(v) for v in values[f]], dtype=np.uint16)
+      col = np.zeros((len(values[f]), max(lens)), dtype=np.uint8)
+      for i, v in enumerate(values[f]):
+        col[i, :len(v)] = np.frombuffer(v, dtype=np.uint8)
+      columns[f] = col
+      columns[f + "_len"] = lens
+    else:
+      col = np.array(values[f])
+      if col.dtype == object:
+        # enums
+        col = np.array([str(v) for v in values[f]])
+      columns[f] = col
+  return columns
+
+
+def get_log_columns(fn, fields, cache_prefix=None, ents=None):
+  """Returns {service: structured array} with logMonoTime and the requested fields of every event.
+
+  fields maps service names to lists of (dotted) field names, e.g. {'carState': ['vEgo', 'cruiseState.speed']}.
+  Bytes fields are returned as uint8 rows padded with zeros, with their lengths in '<field>_len'.
+  Every column is cached next to the log, so only fields that weren't queried before are decoded.
+  Rows are in file order, ents has to be in file order too.
+  """
+  columns_dir = cache_path_for_file_path(fn, cache_prefix) + ".columns"
+  mkdirs_exists_ok(columns_dir)
+
+  def column_path(service, field):
+    return os.path.join(columns_dir, f"v{LOG_COLUMNS_VERSION}_{service}_{field}.npy")
+
+  columns = {service: {} for service in fields}
+  missing = {}
+  for service, service_fields in fields.items():
+    for f in ["logMonoTime"] + list(service_fields):
+      if not os.path.exists(column_path(service, f)):
+        missing.setdefault(service, []).append(f)
+        continue
+      columns[service][f] = np.load(column_path(service, f), allow_pickle=False)
+      if os.path.exists(column_path(service, f + "_len")):
+        columns[service][f + "_len"] = np.load(column_path(service, f + "_len"), allow_pickle=False)
+
+  if len(missing):
+    if ents is None:
+      ents = list(capnp_log.Event.read_multiple_bytes(load_log_data(fn, list(missing), cache_prefix=cache_prefix)))
+
+    for service, service_fields in missing.items():
+      decoded = _events_to_columns(ents, service, [f for f in service_fields if f != "logMonoTime"])
+      for name, col in decoded.items():
+        with atomic_write_in_dir(column_path(service, name), mode="wb", overwrite=True) as f:
+          np.save(f, col, allow_pickle=False)
+      columns[service].update(decoded)
+
+  ret = {}
+  for service, service_fields in fields.items():
+    names = [n for f in ["logMonoTime"] + list(service_fields) for n in (f, f + "_len") if n in columns[service]]
+    arr = np.empty(len(columns[service]["logMonoTime"]), dtype=[(n, columns[service][n].dtype, columns[service][n].shape[1:]) for n in names])
+    for n in names:
+      arr[n] = columns[service][n]
+    ret[service] = arr
+  return ret
+
+
+def iter_log_readers(log_paths, readahead=4, ordered=True, use_processes=False, sort_by_time=False, services=None):
+  """Yields (segment number, LogReader) for every log in log_paths while up to readahead
+  logs are downloaded, decompressed and parsed in a pool.
+
+  With ordered=False logs are yielded as soon as they are loaded. Processes only decompress
+  and filter the data, since capnp readers can't be sent back to the parent.
+  """
+  executor_cls = concurrent.futures.ProcessPoolExecutor if use_processes else concurrent.futures.ThreadPoolExecutor
+  to_load = iter([i for i, fn in enumerate(log_paths) if fn is not None])
+
+  with executor_cls(max_workers=readahead) as pool:
+    pending = {}
+
+    def submit():
+      for i in to_load:
+        if use_processes:
+          pending[pool.submit(load_log_data, log_paths[i], services)] = i
+        else:
+          pending[pool.submit(LogReader, log_paths[i], sort_by_time=sort_by_time, services=services)] = i
+        if len(pending) >= readahead:
+          break
+
+    submit()
+    while len(pending):
+      if ordered:
+        fut = next(iter(pending))
+      else:
+        fut = next(concurrent.futures.as_completed(pending))
+      i = pending.pop(fut)
+      submit()
+
+      if use_processes:
+        lr = LogReader(log_paths[i], sort_by_time=sort_by_time, services=services, dat=fut.result())
+      else:
+        lr = fut.result()
+      yield i, lr
+
+
+def logreader_from_route_or_segment(r, sort_by_time=False, services=None, readahead=0):
   sn = SegmentName(r, allow_route_name=True)
   route = Route(sn.route_name.canonical_name)
   if sn.segment_num < 0:
-    return MultiLogIterator(route.log_paths(), sort_by_time)
+    return MultiLogIterator(route.log_paths(), sort_by_time, services=services, readahead=readahead)
   else:
-    return LogReader(route.log_paths()[sn.segment_num], sort_by_time)
+    return LogReader(route.log_paths()[sn.segment_num], sort_by_time=sort_by_time, services=services)
 
 
 if __name__ == "__main__":
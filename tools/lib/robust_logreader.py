@@ -7,6 +7,7 @@ import tqdm
 import glob
 from tempfile import TemporaryDirectory
 import capnp
+import numpy as np
 
 from tools.lib.logreader import FileReader, LogReader
 from cereal import log as capnp_log
@@ -56,5 +57,6 @@ class RobustLogReader(LogReader):
         progress.update(1)
 
     self._ts = [x.logMonoTime for x in self._ents]
+    self._ts_max = np.maximum.accumulate(np.array(self._ts, dtype=np.uint64))
     self.data_version = data_version
     self._only_union_types = only_union_types
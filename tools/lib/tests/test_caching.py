@@ -1,10 +1,47 @@
 #!/usr/bin/env python3
 import os
+import re
 import shutil
+import tempfile
+import threading
 import unittest
+from unittest import mock
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
 
 os.environ["COMMA_CACHE"] = "/tmp/__test_cache__"
-from tools.lib.url_file import URLFile, CACHE_DIR
+from tools.lib import chunk_cache
+from tools.lib.chunk_cache import ChunkCache
+from tools.lib.url_file import URLFile, CACHE_DIR, CHUNK_SIZE
+
+
+class RangeRequestHandler(BaseHTTPRequestHandler):
+  protocol_version = "HTTP/1.1"
+  data = os.urandom(int(CHUNK_SIZE * 5.5))
+  requests = []
+
+  def log_message(self, *args):
+    pass
+
+  def _send(self, body_only_length=False):
+    begin, end = 0, len(self.data) - 1
+    m = re.match(r"bytes=(\d+)-(\d+)", self.headers.get("Range", ""))
+    if m is not None:
+      begin, end = int(m.group(1)), int(m.group(2))
+      self.send_response(206)
+      self.send_header("Content-Range", f"bytes {begin}-{end}/{len(self.data)}")
+    else:
+      self.send_response(200)
+    self.send_header("Content-Length", str(end - begin + 1))
+    self.end_headers()
+    if not body_only_length:
+      self.requests.append((begin, end))
+      self.wfile.write(self.data[begin:end + 1])
+
+  def do_HEAD(self):
+    self._send(body_only_length=True)
+
+  def do_GET(self):
+    self._send()
 
 
 class TestFileDownload(unittest.TestCase):
@@ -65,5 +102,96 @@ class TestFileDownload(unittest.TestCase):
     self.compare_loads(large_file_url)
 
 
+class TestLocalFileDownload(unittest.TestCase):
+  @classmethod
+  def setUpClass(cls):
+    cls.server = ThreadingHTTPServer(("127.0.0.1", 0), RangeRequestHandler)
+    cls.server_thread = threading.Thread(target=cls.server.serve_forever, daemon=True)
+    cls.server_thread.start()
+    cls.url = f"http://127.0.0.1:{cls.server.server_port}/fcamera.hevc"
+
+  @classmethod
+  def tearDownClass(cls):
+    cls.server.shutdown()
+    cls.server.server_close()
+
+  def setUp(self):
+    shutil.rmtree(CACHE_DIR, ignore_errors=True)
+    RangeRequestHandler.requests.clear()
+
+  def test_reads(self):
+    data = RangeRequestHandler.data
+    for cache in (True, False):
+      for start, length in [(0, None), (10, 100), (CHUNK_SIZE - 10, 20), (CHUNK_SIZE * 2, CHUNK_SIZE * 3), (len(data) - 1, 1)]:
+        f = URLFile(self.url, cache=cache, concurrency=4)
+        f.seek(start)
+        end = start + length if length is not None else len(data)
+        self.assertEqual(f.read(ll=length), data[start:end])
+
+  def test_concurrent_full_read(self):
+    f = URLFile(self.url, cache=False, concurrency=2)
+    self.assertEqual(f.read(), RangeRequestHandler.data)
+    half = -(-len(RangeRequestHandler.data) // 2)
+    self.assertEqual(sorted(RangeRequestHandler.requests), [(0, half - 1), (half, len(RangeRequestHandler.data) - 1)])
+
+  def test_coalesce_missing_chunks(self):
+    f = URLFile(self.url, cache=True, concurrency=2)
+    f.seek(CHUNK_SIZE)
+    f.read(ll=CHUNK_SIZE)
+    RangeRequestHandler.requests.clear()
+
+    # chunk 1 is cached, the 5 missing chunks are fetched in runs of at most 3 adjacent chunks
+    f.seek(0)
+    self.assertEqual(f.read(), RangeRequestHandler.data)
+    self.assertEqual(sorted(RangeRequestHandler.requests), [(0, CHUNK_SIZE - 1),
+                                                            (CHUNK_SIZE * 2, CHUNK_SIZE * 5 - 1),
+                                                            (CHUNK_SIZE * 5, len(RangeRequestHandler.data) - 1)])
+
+    # everything is cached now
+    RangeRequestHandler.requests.clear()
+    f.seek(0)
+    self.assertEqual(f.read(), RangeRequestHandler.data)
+    self.assertEqual(RangeRequestHandler.requests, [])
+
+
+class TestChunkCache(unittest.TestCase):
+  def setUp(self):
+    self.tmp = tempfile.mkdtemp()
+    self.addCleanup(shutil.rmtree, self.tmp, ignore_errors=True)
+
+  def test_lru_eviction(self):
+    cache = ChunkCache(self.tmp, 300)
+    with mock.patch.object(chunk_cache.time, "time", side_effect=range(1000, 2000, 100)):
+      for name in "abc":
+        cache.put(name, name.encode() * 100)
+      # a is older than the access interval, so the hit moves it to the front
+      self.assertEqual(bytes(cache.get("a")), b"a" * 100)
+      cache.put("d", b"d" * 100)
+
+    self.assertIsNone(cache.get("b"))
+    self.assertEqual(bytes(cache.get("a")), b"a" * 100)
+    self.assertEqual(cache.size(), 300)
+
+  def test_hits_are_throttled(self):
+    cache = ChunkCache(self.tmp, 1000)
+    cache.put("a", b"a")
+    conn = cache._connect()
+    changes = conn.total_changes
+    for _ in range(10):
+      self.assertEqual(bytes(cache.get("a")), b"a")
+    self.assertEqual(conn.total_changes, changes)
+
+    # another process only sees the access time written by the put
+    self.assertEqual(bytes(ChunkCache(self.tmp, 1000).get("a")), b"a")
+
+  def test_cache_dir_removed(self):
+    cache = ChunkCache(self.tmp, 1000)
+    cache.put("a", b"a")
+    shutil.rmtree(self.tmp)
+    self.assertIsNone(cache.get("a"))
+    cache.put("b", b"bb")
+    self.assertEqual(cache.size(), 2)
+
+
 if __name__ == "__main__":
   unittest.main()
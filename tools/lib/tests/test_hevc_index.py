@@ -0,0 +1,182 @@
+#!/usr/bin/env python3
+import io
+import tempfile
+import unittest
+
+import numpy as np
+
+from tools.lib.exceptions import DataUnreadableError
+from tools.lib.framereader import HEVC_SLICE_B, HEVC_SLICE_I, HEVC_SLICE_P, VIDEO_INDEX_HEADER, VIDEO_INDEX_MAGIC, \
+                                  VIDEO_INDEX_VERSION, HEVCIndexer, hevc_index, hevc_sps_size, read_video_index, \
+                                  write_video_index
+
+START_CODE = b"\x00\x00\x00\x01"
+
+
+class BitWriter:
+  def __init__(self):
+    self.bits = []
+
+  def u(self, n, v):
+    self.bits += [(v >> (n - 1 - i)) & 1 for i in range(n)]
+
+  def ue(self, v):
+    n = (v + 1).bit_length()
+    self.u(n - 1, 0)
+    self.u(n, v + 1)
+
+  def rbsp(self):
+    bits = self.bits + [1] + [0] * (-(len(self.bits) + 1) % 8)  # rbsp_trailing_bits
+    return bytes(int("".join(map(str, bits[i:i+8])), 2) for i in range(0, len(bits), 8))
+
+
+def emulation_prevention(rbsp):
+  ret = bytearray()
+  zeros = 0
+  for b in rbsp:
+    if zeros == 2 and b <= 3:
+      ret.append(3)
+      zeros = 0
+    ret.append(b)
+    zeros = zeros + 1 if b == 0 else 0
+  return bytes(ret)
+
+
+def nal(nal_type, rbsp):
+  return START_CODE + bytes([nal_type << 1, 1]) + emulation_prevention(rbsp)
+
+
+def sps(w, h, crop=None, chroma_format_idc=1, sub_layers=()):
+  bs = BitWriter()
+  bs.u(4, 0)  # sps_video_parameter_set_id
+  bs.u(3, len(sub_layers))  # sps_max_sub_layers_minus1
+  bs.u(1, 1)  # sps_temporal_id_nesting_flag
+  bs.u(96, 0)  # general profile and level, all zeros so the NAL needs emulation prevention
+  for profile_present, level_present in sub_layers:
+    bs.u(1, profile_present)
+    bs.u(1, level_present)
+  if len(sub_layers):
+    bs.u(2 * (8 - len(sub_layers)), 0)
+  for profile_present, level_present in sub_layers:
+    bs.u(88 * profile_present + 8 * level_present, 0)
+  bs.ue(0)  # sps_seq_parameter_set_id
+  bs.ue(chroma_format_idc)
+  if chroma_format_idc == 3:
+    bs.u(1, 0)  # separate_colour_plane_flag
+  bs.ue(w)
+  bs.ue(h)
+  bs.u(1, crop is not None)
+  for c in (crop or ()):
+    bs.ue(c)
+  return nal(33, bs.rbsp())
+
+
+def slice_nal(nal_type, slice_type, payload_size=40):
+  bs = BitWriter()
+  bs.u(1, 1)  # first_slice_segment_in_pic_flag
+  if 16 <= nal_type <= 23:
+    bs.u(1, 0)  # no_output_of_prior_pics_flag
+  bs.ue(0)  # slice_pic_parameter_set_id
+  bs.ue(slice_type)
+  return nal(nal_type, bs.rbsp() + b"\x55" * payload_size)
+
+
+def make_stream():
+  """Returns an Annex-B stream with its expected index and prefix, like vidindex builds them"""
+  prefix = nal(32, b"\x0c\x01\xff\xff") + sps(1928, 1208, crop=(0, 4, 0, 4)) + nal(34, b"\xc1\x72\xb4\x62\x40")
+  dat = prefix
+  index = []
+  for nal_type, slice_type in [(19, HEVC_SLICE_I), (1, HEVC_SLICE_P), (1, HEVC_SLICE_B), (1, HEVC_SLICE_P), (19, HEVC_SLICE_I), (1, HEVC_SLICE_P)]:
+    index.append((slice_type, len(dat) + 1))  # NALs start at their 3 byte start code
+    dat += slice_nal(nal_type, slice_type)
+  index.append((0xFFFFFFFF, len(dat)))
+  # the prefix runs from the first 3 byte start code to the one of the first slice
+  return dat, np.array(index, dtype=np.uint32), prefix[1:] + b"\x00"
+
+
+class TestHEVCIndex(unittest.TestCase):
+  def setUp(self):
+    self.dat, self.index, self.prefix = make_stream()
+
+  def _feed(self, blocks):
+    indexer = HEVCIndexer()
+    for b in blocks:
+      indexer.feed(b)
+    return indexer.finish() + (indexer.w, indexer.h)
+
+  def test_mmap(self):
+    with tempfile.NamedTemporaryFile(suffix=".hevc") as f:
+      f.write(self.dat)
+      f.flush()
+      index_data = hevc_index(f.name)
+
+    np.testing.assert_array_equal(index_data['index'], self.index)
+    self.assertEqual(index_data['global_prefix'], self.prefix)
+    self.assertEqual((index_data['w'], index_data['h']), (1920, 1200))
+
+  def test_split_blocks(self):
+    expected = self._feed([self.dat])
+    np.testing.assert_array_equal(expected[0], self.index)
+
+    # every split point, so start codes are split over blocks in every possible way
+    for i in range(1, len(self.dat)):
+      index, prefix, w, h = self._feed([self.dat[:i], self.dat[i:]])
+      np.testing.assert_array_equal(index, self.index, err_msg=f"split at {i}")
+      self.assertEqual((prefix, w, h), expected[1:], f"split at {i}")
+
+    for size in (1, 2, 3, 5, 64):
+      index, prefix, w, h = self._feed([self.dat[i:i+size] for i in range(0, len(self.dat), size)])
+      np.testing.assert_array_equal(index, self.index, err_msg=f"blocks of {size}")
+      self.assertEqual((prefix, w, h), expected[1:], f"blocks of {size}")
+
+  def test_missing_start_code(self):
+    with self.assertRaises(DataUnreadableError):
+      self._feed([self.dat[1:]])
+    with self.assertRaises(DataUnreadableError):
+      self._feed([b"\x00" * 8])
+
+
+class TestSPS(unittest.TestCase):
+  def test_emulation_prevention(self):
+    nal = sps(1928, 1208)
+    self.assertIn(b"\x00\x00\x03", nal)
+    self.assertEqual(hevc_sps_size(nal[1:]), (1928, 1208))
+
+  def test_conformance_window(self):
+    # crops are in chroma samples, 4:2:0 halves both directions and 4:4:4 neither
+    self.assertEqual(hevc_sps_size(sps(1928, 1208, crop=(2, 2, 1, 3))[1:]), (1920, 1200))
+    self.assertEqual(hevc_sps_size(sps(1928, 1208, crop=(2, 2, 1, 3), chroma_format_idc=3)[1:]), (1924, 1204))
+    self.assertEqual(hevc_sps_size(sps(1928, 1208, crop=(0, 0, 0, 0))[1:]), (1928, 1208))
+
+  def test_sub_layers(self):
+    self.assertEqual(hevc_sps_size(sps(1164, 874, sub_layers=[(1, 1), (0, 1)])[1:]), (1164, 874))
+
+
+class TestVideoIndexFile(unittest.TestCase):
+  def setUp(self):
+    dat, index, prefix = make_stream()
+    self.index_data = {'index': index, 'global_prefix': prefix, 'w': 1920, 'h': 1200}
+
+  def _write(self):
+    f = io.BytesIO()
+    write_video_index(f, self.index_data)
+    return f.getvalue()
+
+  def test_round_trip(self):
+    index_data = read_video_index(io.BytesIO(self._write()))
+    np.testing.assert_array_equal(index_data['index'], self.index_data['index'])
+    self.assertEqual({k: v for k, v in index_data.items() if k != 'index'},
+                     {k: v for k, v in self.index_data.items() if k != 'index'})
+
+  def test_rejected(self):
+    dat = self._write()
+    _, version, w, h, prefix_size, entries = VIDEO_INDEX_HEADER.unpack_from(dat)
+    bad_magic = VIDEO_INDEX_HEADER.pack(b"VIDINDEX", version, w, h, prefix_size, entries) + dat[VIDEO_INDEX_HEADER.size:]
+    bad_version = VIDEO_INDEX_HEADER.pack(VIDEO_INDEX_MAGIC, VIDEO_INDEX_VERSION + 1, w, h, prefix_size, entries) + dat[VIDEO_INDEX_HEADER.size:]
+
+    for dat in (bad_magic, bad_version, dat[:VIDEO_INDEX_HEADER.size - 1], b""):
+      self.assertIsNone(read_video_index(io.BytesIO(dat)))
+
+
+if __name__ == "__main__":
+  unittest.main()
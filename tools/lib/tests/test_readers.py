@@ -1,12 +1,17 @@
 #!/usr/bin/env python
+import bz2
+import os
 import unittest
 import requests
 import tempfile
+from unittest import mock
 
 from collections import defaultdict
 import numpy as np
-from tools.lib.framereader import FrameReader
-from tools.lib.logreader import LogReader
+from tools.lib import cache
+from tools.lib.framereader import FrameCache, FrameReader
+from cereal import log as capnp_log
+from tools.lib.logreader import LogReader, MultiLogIterator, StreamingLogReader, get_log_columns
 
 
 class TestReaders(unittest.TestCase):
@@ -28,6 +33,9 @@ class TestReaders(unittest.TestCase):
       lr_file = LogReader(fp.name)
       _check_data(lr_file)
 
+      lr_stream = StreamingLogReader(fp.name)
+      _check_data(lr_stream)
+
     lr_url = LogReader("https://github.com/commaai/comma2k19/blob/master/Example_1/b0c9d2329ad1606b%7C2018-08-02--08-34-47/40/raw_log.bz2?raw=true")
     _check_data(lr_url)
 
@@ -52,6 +60,9 @@ class TestReaders(unittest.TestCase):
       assert np.all(frame_first_30[0] == frame_0[0])
       assert np.all(frame_first_30[15] == frame_15[0])
 
+      frame_range = f.get_range(0, 30)
+      assert all(np.all(a == b) for a, b in zip(frame_range, frame_first_30))
+
     with tempfile.NamedTemporaryFile(suffix=".hevc") as fp:
       r = requests.get("https://github.com/commaai/comma2k19/blob/master/Example_1/b0c9d2329ad1606b%7C2018-08-02--08-34-47/40/video.hevc?raw=true")
       fp.write(r.content)
@@ -63,5 +74,114 @@ class TestReaders(unittest.TestCase):
     fr_url = FrameReader("https://github.com/commaai/comma2k19/blob/master/Example_1/b0c9d2329ad1606b%7C2018-08-02--08-34-47/40/video.hevc?raw=true")
     _check_data(fr_url)
 
+
+def write_log(fn, events):
+  dat = b""
+  for t, service in events:
+    ent = capnp_log.Event.new_message(logMonoTime=t)
+    ent.init(service)
+    dat += ent.to_bytes()
+  with open(fn, "wb") as f:
+    f.write(bz2.compress(dat))
+
+
+class TestMultiLogIterator(unittest.TestCase):
+  def test_services_filter_empty_logs(self):
+    with tempfile.TemporaryDirectory() as tmp, mock.patch.object(cache, "DEFAULT_CACHE_DIR", os.path.join(tmp, "cache")):
+      paths = [os.path.join(tmp, f"{i}--rlog.bz2") for i in range(4)]
+      write_log(paths[0], [(int(1e9), 'carState')])
+      write_log(paths[1], [(int(61e9), 'controlsState'), (int(62e9), 'carState')])
+      write_log(paths[2], [(int(121e9), 'carState')])
+      write_log(paths[3], [(int(181e9), 'controlsState')])
+
+      # the first and third logs have no controlsState
+      lr = MultiLogIterator(paths, services=['controlsState'])
+      self.assertEqual([m.logMonoTime for m in lr], [int(61e9), int(181e9)])
+
+      # times are still relative to the first event of the route
+      lr.reset()
+      self.assertEqual(lr.start_time, int(1e9))
+      self.assertTrue(lr.seek(60))
+      self.assertAlmostEqual(lr.tell(), 60.)
+      self.assertEqual(next(lr).logMonoTime, int(61e9))
+
+      self.assertTrue(lr.seek(130))
+      self.assertEqual(next(lr).logMonoTime, int(181e9))
+
+  def test_close(self):
+    with tempfile.TemporaryDirectory() as tmp, mock.patch.object(cache, "DEFAULT_CACHE_DIR", os.path.join(tmp, "cache")):
+      paths = [os.path.join(tmp, f"{i}--rlog.bz2") for i in range(3)]
+      for i, path in enumerate(paths):
+        write_log(path, [(int((i * 60 + 1) * 1e9), 'carState')])
+
+      with MultiLogIterator(paths, readahead=2) as lr:
+        pool = lr._prefetch_pool
+        self.assertEqual(next(lr).logMonoTime, int(1e9))
+      self.assertIsNone(lr._prefetch_pool)
+      self.assertTrue(pool._shutdown)
+
+      # dropping an unclosed iterator shuts its pool down
+      lr = MultiLogIterator(paths, readahead=2)
+      pool = lr._prefetch_pool
+      del lr
+      self.assertTrue(pool._shutdown)
+
+
+class TestLogColumns(unittest.TestCase):
+  def setUp(self):
+    self.tmp = tempfile.TemporaryDirectory()
+    self.addCleanup(self.tmp.cleanup)
+    self.fn = os.path.join(self.tmp.name, "rlog.bz2")
+
+    # logMonoTime isn't sorted, like in real logs
+    self.mono_times = [5, 1, 4, 2, 3, 8, 6, 7]
+    dat = b""
+    for i, t in enumerate(self.mono_times):
+      ent = capnp_log.Event.new_message(logMonoTime=t)
+      ent.init('carState')
+      ent.carState.vEgo = i
+      ent.carState.aEgo = -i
+      dat += ent.to_bytes()
+    with open(self.fn, "wb") as f:
+      f.write(bz2.compress(dat))
+
+  def test_sorted_and_file_order(self):
+    cache_prefix = os.path.join(self.tmp.name, "cache")
+
+    # each query only decodes the new field, in a different order of the events
+    sorted_cols = LogReader(self.fn, sort_by_time=True).to_columns({'carState': ['vEgo']}, cache_prefix=cache_prefix)['carState']
+    file_cols = get_log_columns(self.fn, {'carState': ['vEgo', 'aEgo']}, cache_prefix=cache_prefix)['carState']
+    both = LogReader(self.fn, sort_by_time=True).to_columns({'carState': ['vEgo', 'aEgo']}, cache_prefix=cache_prefix)['carState']
+
+    self.assertEqual(file_cols['logMonoTime'].tolist(), self.mono_times)
+    self.assertEqual(file_cols['vEgo'].tolist(), list(range(len(self.mono_times))))
+    self.assertEqual(sorted_cols['logMonoTime'].tolist(), sorted(self.mono_times))
+    self.assertEqual(both.tolist(), np.sort(file_cols, order='logMonoTime').tolist())
+    self.assertTrue(np.all(both['vEgo'] == -both['aEgo']))
+
+
+class TestFrameCache(unittest.TestCase):
+  def test_budget_counts_kept_bytes(self):
+    gop = np.zeros((20, 16, 16, 3), dtype=np.uint8)
+    cache = FrameCache(budget=gop[0].nbytes * 3)
+    for i in range(gop.shape[0]):
+      frame = cache.put((0, i, "rgb24"), gop[i])
+      self.assertIsNone(frame.base)
+      self.assertTrue(np.all(frame == gop[i]))
+
+    # only the last 3 frames are kept, and they don't keep the decoded GOP alive
+    self.assertEqual(cache.stats()['frames']['rgb24'], 3)
+    self.assertEqual(cache.stats()['nbytes']['rgb24'], gop[0].nbytes * 3)
+    self.assertIsNone(cache.get((0, 19, "rgb24")).base)
+    self.assertIsNone(cache.get((0, 0, "rgb24")))
+
+  def test_frames_not_copied(self):
+    # libav returns every frame in its own array, reshaped for yuv420p
+    cache = FrameCache()
+    frame = np.zeros((24, 16), dtype=np.uint8)
+    self.assertIs(cache.put((0, 0, "rgb24"), frame), frame)
+    view = frame.reshape(-1)
+    self.assertIs(cache.put((0, 1, "yuv420p"), view), view)
+
 if __name__ == "__main__":
   unittest.main()
@@ -6,15 +6,21 @@ import tempfile
 import threading
 import urllib.parse
 import pycurl
+from concurrent.futures import ThreadPoolExecutor
 from hashlib import sha256
 from io import BytesIO
 from tenacity import retry, wait_random_exponential, stop_after_attempt
 from common.file_helpers import mkdirs_exists_ok, atomic_write_in_dir
+from tools.lib.chunk_cache import ChunkCache
 #  Cache chunk size
 K = 1000
 CHUNK_SIZE = 1000 * K
 
 CACHE_DIR = os.environ.get("COMMA_CACHE", "/tmp/comma_download_cache/")
+#  Chunks are evicted least recently used first once the cache grows past this many bytes
+CACHE_MAX_SIZE = int(os.environ.get("COMMA_CACHE_MAX_SIZE", 10 * 1000 * 1000 * K))
+#  Max number of range requests in flight per read
+DOWNLOAD_CONCURRENCY = int(os.environ.get("URLFILE_CONCURRENCY", "8"))
 
 
 def hash_256(link):
@@ -24,23 +30,32 @@ def hash_256(link):
 
 class URLFile:
   _tlocal = threading.local()
+  _chunk_cache = ChunkCache(CACHE_DIR, CACHE_MAX_SIZE)
+  #  Shared by all URLFiles, every pool thread keeps its own keep-alive curl handle
+  _download_pool = ThreadPoolExecutor(max_workers=DOWNLOAD_CONCURRENCY)
 
-  def __init__(self, url, debug=False, cache=None):
+  def __init__(self, url, debug=False, cache=None, concurrency=None):
     self._url = url
     self._pos = 0
     self._length = None
     self._local_file = None
     self._debug = debug
+    self._concurrency = concurrency if concurrency is not None else DOWNLOAD_CONCURRENCY
     #  True by default, false if FILEREADER_CACHE is defined, but can be overwritten by the cache input
     self._force_download = not int(os.environ.get("FILEREADER_CACHE", "0"))
     if cache is not None:
       self._force_download = not cache
 
+    mkdirs_exists_ok(CACHE_DIR)
+
+  @property
+  def _curl(self):
+    #  curl handles can't be shared between threads, but reusing one per thread keeps its connection alive
     try:
-      self._curl = self._tlocal.curl
+      return self._tlocal.curl
     except AttributeError:
-      self._curl = self._tlocal.curl = pycurl.Curl()
-    mkdirs_exists_ok(CACHE_DIR)
+      self._tlocal.curl = pycurl.Curl()
+      return self._tlocal.curl
 
   def __enter__(self):
     return self
@@ -83,47 +98,87 @@ class URLFile:
 
   def read(self, ll=None):
     if self._force_download:
-      return self.read_aux(ll=ll)
+      if ll is not None and ll <= CHUNK_SIZE:
+        return self.read_aux(ll=ll)
+
+      #  Split large reads, including reads of the whole file, into ranges that are downloaded concurrently
+      file_begin = self._pos
+      file_end = min(self._pos + ll, self.get_length()) if ll is not None else self.get_length()
+      if file_end - file_begin <= CHUNK_SIZE:
+        return self.read_aux(ll=ll)
+      step = max(CHUNK_SIZE, -(-(file_end - file_begin) // self._concurrency))
+      ranges = [(b, min(b + step, file_end)) for b in range(file_begin, file_end, step)]
+      self._pos = max(file_begin, file_end)
+      return b"".join(self._download_ranges(ranges))
 
     file_begin = self._pos
-    file_end = self._pos + ll if ll is not None else self.get_length()
-    #  We have to align with chunks we store. Position is the begginiing of the latest chunk that starts before or at our file
-    position = (file_begin // CHUNK_SIZE) * CHUNK_SIZE
-    response = b""
-    while True:
-      self._pos = position
-      chunk_number = self._pos / CHUNK_SIZE
-      file_name = hash_256(self._url) + "_" + str(chunk_number)
-      full_path = os.path.join(CACHE_DIR, str(file_name))
-      data = None
-      #  If we don't have a file, download it
-      if not os.path.exists(full_path):
-        data = self.read_aux(ll=CHUNK_SIZE)
-        with atomic_write_in_dir(full_path, mode="wb") as new_cached_file:
-          new_cached_file.write(data)
+    file_end = min(self._pos + ll, self.get_length()) if ll is not None else self.get_length()
+    if file_begin >= file_end:
+      return b""
+
+    #  We have to align with chunks we store, slices of the (memory mapped) chunks are joined once at the end
+    chunk_numbers = range(file_begin // CHUNK_SIZE, (file_end - 1) // CHUNK_SIZE + 1)
+    file_names = {n: hash_256(self._url) + "_" + str(n) for n in chunk_numbers}
+    datas = {n: self._chunk_cache.get(file_names[n]) for n in chunk_numbers}
+
+    #  If we don't have a chunk, download it
+    missing = [n for n in chunk_numbers if datas[n] is None]
+    if len(missing):
+      for n, data in self._download_chunks(missing).items():
+        self._chunk_cache.put(file_names[n], data)
+        datas[n] = data
+
+    chunks = []
+    for n in chunk_numbers:
+      position = n * CHUNK_SIZE
+      chunks.append(memoryview(datas[n])[max(0, file_begin - position): min(CHUNK_SIZE, file_end - position)])
+
+    self._pos = file_end
+    return b"".join(chunks)
+
+  def _download_chunks(self, chunk_numbers):
+    """Downloads sorted chunk numbers, coalescing adjacent chunks into single range requests
+       while still splitting the work over up to self._concurrency requests."""
+    max_run = max(1, -(-len(chunk_numbers) // self._concurrency))
+    runs = []
+    for n in chunk_numbers:
+      if len(runs) and runs[-1][-1] == n - 1 and len(runs[-1]) < max_run:
+        runs[-1].append(n)
       else:
-        with open(full_path, "rb") as cached_file:
-          data = cached_file.read()
+        runs.append([n])
 
-      response += data[max(0, file_begin - position): min(CHUNK_SIZE, file_end - position)]
+    length = self.get_length()
+    ranges = [(run[0] * CHUNK_SIZE, min((run[-1] + 1) * CHUNK_SIZE, length)) for run in runs]
 
-      position += CHUNK_SIZE
-      if position >= file_end:
-        self._pos = file_end
-        return response
+    ret = {}
+    for run, data in zip(runs, self._download_ranges(ranges)):
+      data = memoryview(data)
+      for i, n in enumerate(run):
+        ret[n] = data[i * CHUNK_SIZE:(i + 1) * CHUNK_SIZE]
+    return ret
+
+  def _download_ranges(self, ranges):
+    if len(ranges) == 1:
+      return [self._download(*ranges[0])]
+    return list(self._download_pool.map(lambda r: self._download(*r), ranges))
 
-  @retry(wait=wait_random_exponential(multiplier=1, max=5), stop=stop_after_attempt(3), reraise=True)
   def read_aux(self, ll=None):
+    end = None if ll is None else min(self._pos + ll, self.get_length())
+    ret = self._download(self._pos, end)
+    self._pos += len(ret)
+    return ret
+
+  @retry(wait=wait_random_exponential(multiplier=1, max=5), stop=stop_after_attempt(3), reraise=True)
+  def _download(self, start, end=None):
+    #  Downloads [start, end), or the rest of the file if end is None
     download_range = False
     headers = ["Connection: keep-alive"]
-    if self._pos != 0 or ll is not None:
-      if ll is None:
-        end = self.get_length() - 1
-      else:
-        end = min(self._pos + ll, self.get_length()) - 1
-      if self._pos >= end:
+    if start != 0 or end is not None:
+      if end is None:
+        end = self.get_length()
+      if start >= end:
         return b""
-      headers.append(f"Range: bytes={self._pos}-{end}")
+      headers.append(f"Range: bytes={start}-{end - 1}")
       download_range = True
 
     dats = BytesIO()
@@ -166,9 +221,7 @@ class URLFile:
     if (not download_range) and response_code != 200:  # OK
       raise Exception(f"Error {response_code} {headers} ({self._url}): {repr(dats.getvalue())[:500]}")
 
-    ret = dats.getvalue()
-    self._pos += len(ret)
-    return ret
+    return dats.getvalue()
 
   def seek(self, pos):
     self._pos = pos